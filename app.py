@@ -1,19 +1,97 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, Response
-from pathlib import Path
-import traceback
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
+import json
+import logging
+import time
 from urllib.parse import quote
 
 # 导入我们的服务模块和配置
-from services import file_service, llm_service
-from services.export_service import create_markdown_from_paper
+from services import (file_service, llm_service, batch_service, cache_service, job_service, synthesis_service,
+                      context_service, governor_service, revision_service, draft_service, prompt_service,
+                      export_service, annotation_service, search_service, metrics_service, profile_service)
 # 导入模型列表和新的论文结构配置
-from config import AVAILABLE_MODELS, PAPER_STRUCTURE, PAPER_STRUCTURE_MAP
+from config import (AVAILABLE_MODELS, PAPER_STRUCTURE, PAPER_STRUCTURE_MAP, BATCH_MAX_WORKERS,
+                    COMPREHENSIVE_DEFAULT_MODE, COMPREHENSIVE_SINGLE_PASS_MAX_CHARS, SEARCH_DEFAULT_LIMIT,
+                    PROFILE_HEADER_ENABLED, PROFILE_ROUTES)
 
+metrics_service.configure_logging()
+logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
-# 在应用启动时加载一次所有提示词
-PROMPTS = file_service.load_prompts()
+# 在应用启动时加载并校验所有提示词，之后 prompts.json 被修改时会自动重新加载
+prompt_service.load()
+# 在后台补录服务停止期间新增或修改的文件到全文检索索引
+search_service.start_background_sync()
+
+
+def _collect_service_metrics():
+    """将响应缓存和调用治理已有的统计导出到 /metrics。"""
+    cache_stats = cache_service.get_stats()
+    governor_metrics = governor_service.get_metrics()
+    return [
+        ("llm_cache_hits_total", "counter", "LLM 响应缓存命中次数", cache_stats["hits"]),
+        ("llm_cache_misses_total", "counter", "LLM 响应缓存未命中次数", cache_stats["misses"]),
+        ("llm_cache_evictions_total", "counter", "LLM 响应缓存淘汰的条目数", cache_stats["evictions"]),
+        ("llm_cache_entries", "gauge", "LLM 响应缓存的条目数", cache_stats["entries"]),
+        ("llm_cache_bytes", "gauge", "LLM 响应缓存的总大小（字节）", cache_stats["bytes"]),
+        ("governor_calls_total", "counter", "经过调用治理的模型调用次数", governor_metrics["calls"]),
+        ("governor_failures_total", "counter", "最终失败的模型调用次数", governor_metrics["failures"]),
+        ("governor_retries_total", "counter", "模型调用的重试次数", governor_metrics["retries"]),
+        ("governor_rate_limited_responses_total", "counter", "服务商返回 429 的次数",
+         governor_metrics["rate_limited_responses"]),
+        ("governor_throttle_wait_seconds_total", "counter", "限流等待的总时间（秒）",
+         governor_metrics["throttle_wait_seconds"]),
+        ("governor_backoff_wait_seconds_total", "counter", "重试退避等待的总时间（秒）",
+         governor_metrics["backoff_wait_seconds"]),
+        ("governor_circuit_rejections_total", "counter", "因熔断被拒绝的调用次数", governor_metrics["circuit_rejections"]),
+        ("governor_open_circuits", "gauge", "当前未闭合的断路器数量", len(governor_metrics["open_circuits"])),
+    ]
+
+
+metrics_service.register_collector(_collect_service_metrics)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request_latency(response):
+    """按路由模板（而非实际路径）记录 API 请求的耗时，避免论文名等参数产生大量标签。"""
+    start = g.pop('request_start', None)
+    if start is not None and request.path != '/metrics':
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        metrics_service.observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+    return response
+
+
+@app.before_request
+def _start_profiler():
+    """请求头 X-Profile: 1（PROFILE_HEADER_ENABLED 时）或路由在 PROFILE_ROUTES 中时剖析该请求。"""
+    requested = PROFILE_HEADER_ENABLED and request.headers.get('X-Profile') == '1'
+    if requested or (request.url_rule is not None and request.url_rule.rule in PROFILE_ROUTES):
+        g.profiler = profile_service.start()
+
+
+@app.after_request
+def _save_profile(response):
+    """保存剖析结果，并通过 Server-Timing 和 X-Profile-Report 响应头返回各阶段耗时和报告文件名。"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        report = profile_service.save(profiler, request.method, route, request.path)
+        response.headers['Server-Timing'] = profile_service.server_timing(report)
+        response.headers['X-Profile-Report'] = report['report']
+    return response
+
+
+@app.teardown_request
+def _stop_profiler(error=None):
+    """请求因未处理的异常中断时（不会执行 after_request）停止采样线程。"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
 
 
 @app.context_processor
@@ -25,6 +103,32 @@ def inject_models():
     return dict(models=AVAILABLE_MODELS)
 
 
+def _sse_response(chunks, on_complete):
+    """
+    将模型输出的文本片段包装为 Server-Sent Events 响应。
+
+    每个片段以 `token` 事件推送；生成结束后调用 `on_complete(完整文本)`，
+    并将其返回的字典作为 `done` 事件推送。任何异常都会转换为 `error` 事件。
+    """
+    def sse_event(event: str, payload: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def event_stream():
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event("token", {"text": chunk})
+            result = on_complete("".join(parts))
+            yield sse_event("done", {"status": "success", **result})
+        except Exception as e:
+            logger.exception("流式生成失败")
+            yield sse_event("error", {"status": "error", "message": str(e)})
+
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # --- 页面路由 ---
 
 @app.route('/')
@@ -86,35 +190,67 @@ def process_single_file():
             return jsonify({"status": "error", "message": f"请求体中必须提供 '{param}' 参数。"}), 400
 
     try:
-        # 文件处理逻辑
         temperature_markdown = float(temperature_markdown_str)
         temperature_analysis = float(temperature_analysis_str)
-        file_stem = Path(filename).stem
-        file_path = file_service.PAPERS_DIR / filename
-        if not file_path.exists():
-            return jsonify({"status": "error", "message": f"文件 {filename} 未在服务器上找到。"}), 404
-
-        markdown_path = file_service.MARKDOWNS_DIR / f"{file_stem}.md"
-        if not markdown_path.exists():
-            prompt_markdown = PROMPTS['single_analysis_markdown']
-            markdown_content = llm_service.analyze_pdf_content(file_path, prompt_markdown, model, temperature_markdown,
-                                                               api_key)
-            file_service.save_markdown_result(file_stem, markdown_content)
-
-        analysis_path = file_service.ANALYSES_DIR / f"{file_stem}.md"
-        if not analysis_path.exists():
-            prompt_analysis = PROMPTS['single_analysis_report']
-            analysis_content = llm_service.analyze_pdf_content(file_path, prompt_analysis, model, temperature_analysis,
-                                                               api_key)
-            file_service.save_analysis_result(file_stem, analysis_content)
-
-        return jsonify({"status": "success", "message": f"文件 {filename} 处理成功。"})
     except (ValueError, TypeError):
         return jsonify({"status": "error", "message": "Temperature 参数必须是有效的数字。"}), 400
+
+    try:
+        batch_service.process_paper(filename, prompt_service.get_prompts(), model, temperature_markdown,
+                                    temperature_analysis, api_key, use_cache=data.get('use_cache', True))
+        return jsonify({"status": "success", "message": f"文件 {filename} 处理成功。"})
+    except FileNotFoundError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/api/single_analysis/batch', methods=['POST'])
+def start_single_analysis_batch():
+    """API: 提交一批PDF文件，由服务端线程池并发处理，立即返回批处理任务ID。"""
+    data = request.json
+    api_key = data.get('apiKey')
+    filenames = data.get('filenames')
+    model = data.get('model')
+    temperature_markdown_str = data.get('temperature_markdown')
+    temperature_analysis_str = data.get('temperature_analysis')
+
+    required_params = {
+        'apiKey': api_key, 'filenames': filenames, 'model': model,
+        'temperature_markdown': temperature_markdown_str, 'temperature_analysis': temperature_analysis_str
+    }
+    for param, value in required_params.items():
+        if value is None:
+            return jsonify({"status": "error", "message": f"请求体中必须提供 '{param}' 参数。"}), 400
+    if not filenames:
+        return jsonify({"status": "error", "message": "请至少提供一个待处理的文件。"}), 400
+
+    try:
+        temperature_markdown = float(temperature_markdown_str)
+        temperature_analysis = float(temperature_analysis_str)
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Temperature 参数必须是有效的数字。"}), 400
+
+    missing = [name for name in filenames if not (file_service.PAPERS_DIR / name).exists()]
+    if missing:
+        return jsonify({"status": "error", "message": f"以下文件未在服务器上找到: {', '.join(missing)}"}), 404
+
+    batch_id = batch_service.start_batch(filenames, {
+        'model': model, 'temperature_markdown': temperature_markdown,
+        'temperature_analysis': temperature_analysis, 'use_cache': data.get('use_cache', True)
+    }, api_key)
+    return jsonify({"status": "success", "batch_id": batch_id})
+
+
+@app.route('/api/single_analysis/batch/<batch_id>', methods=['GET'])
+def get_single_analysis_batch(batch_id):
+    """API: 查询批处理任务中每个文件的处理进度。"""
+    status = batch_service.get_batch_status(batch_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "批处理任务未找到。"}), 404
+    return jsonify(status)
+
+
 @app.route('/api/analyzed_papers', methods=['GET'])
 def get_analyzed_papers_api():
     """API: 获取所有已成功生成分析报告的文献列表。"""
@@ -129,31 +265,80 @@ def get_comprehensive_report():
     return jsonify({"content": content})
 
 
+def _prepare_comprehensive_analysis(data, report_progress=None):
+    """
+    校验综合分析请求的参数并构建提示词。
+    文献内容过多（或指定 mode='hierarchical'）时，会先执行分层综合，再构建最终综述的提示词。
+    返回 (提示词内容列表, temperature, None)，调用时使用 context_label='comprehensive'（见 llm_service 的上下文缓存）；
+    参数有误时返回 (None, None, (错误信息, HTTP状态码))。
+    """
+    api_key, model, temperature_str, selected_papers = data.get('apiKey'), data.get('model'), data.get(
+        'temperature'), data.get('papers', [])
+    if not api_key: return None, None, ("API Key 缺失。", 400)
+    if not model: return None, None, ("必须提供 'model' 参数。", 400)
+    if temperature_str is None:
+        return None, None, ("必须提供 'temperature' 参数。", 400)
+    if not selected_papers:
+        return None, None, ("请至少选择一篇文献进行分析。", 400)
+    try:
+        temperature = float(temperature_str)
+    except (ValueError, TypeError):
+        return None, None, ("Temperature 参数必须是有效的数字。", 400)
+    mode = data.get('mode') or COMPREHENSIVE_DEFAULT_MODE
+    if mode not in ('single', 'hierarchical', 'auto'):
+        return None, None, (f"无效的 mode: {mode}", 400)
+
+    prompts = prompt_service.get_prompts()
+    combined_text = file_service.get_combined_analysis_text(selected_papers)
+    if not combined_text:
+        return None, None, ("未能读取所选文献的分析内容。", 500)
+    if mode == 'single' or (mode == 'auto' and len(combined_text) <= COMPREHENSIVE_SINGLE_PASS_MAX_CHARS):
+        contents = prompts.render_contents('comprehensive_analysis', 'combined_text', combined_text=combined_text)
+        return contents, temperature, None
+
+    # 分层模式：先分批生成阶段性综合报告，再基于它们构建最终综述的提示词
+    partials = synthesis_service.synthesize_partials(selected_papers, prompts, model, temperature, api_key,
+                                                     use_cache=data.get('use_cache', True),
+                                                     report_progress=report_progress)
+    return [synthesis_service.build_final_prompt(partials, prompts)], temperature, None
+
+
 @app.route('/api/comprehensive_analysis/start', methods=['POST'])
 def start_comprehensive_analysis():
     """API: 启动综合文献分析，生成并覆盖保存综述报告。"""
     data = request.json
-    api_key, model, temperature_str, selected_papers = data.get('apiKey'), data.get('model'), data.get(
-        'temperature'), data.get('papers', [])
-    if not api_key: return jsonify({"status": "error", "message": "API Key 缺失。"}), 400
-    if not model: return jsonify({"status": "error", "message": "必须提供 'model' 参数。"}), 400
-    if temperature_str is None: return jsonify({"status": "error", "message": "必须提供 'temperature' 参数。"}), 400
-    if not selected_papers: return jsonify({"status": "error", "message": "请至少选择一篇文献进行分析。"}), 400
     try:
-        temperature = float(temperature_str)
-        combined_text = file_service.get_combined_analysis_text(selected_papers)
-        if not combined_text: return jsonify({"status": "error", "message": "未能读取所选文献的分析内容。"}), 500
-        prompt = PROMPTS['comprehensive_analysis'].format(combined_text=combined_text)
-        report_content = llm_service.generate_text_from_prompt([prompt], model, temperature, api_key)
+        contents, temperature, error = _prepare_comprehensive_analysis(data)
+        if error: return jsonify({"status": "error", "message": error[0]}), error[1]
+        report_content = llm_service.generate_text_from_prompt(contents, data['model'], temperature, data['apiKey'],
+                                                               use_cache=data.get('use_cache', True),
+                                                               context_label='comprehensive')
         file_service.save_comprehensive_report(report_content)
         return jsonify({"status": "success", "message": "综合分析报告 'Comprehensive_Report.md' 已生成/更新。",
                         "report": report_content})
-    except (ValueError, TypeError):
-        return jsonify({"status": "error", "message": "Temperature 参数必须是有效的数字。"}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/api/comprehensive_analysis/stream', methods=['POST'])
+def stream_comprehensive_analysis():
+    """API: 流式版本的综合文献分析，通过 SSE 逐段推送生成内容，结束后保存综述报告。"""
+    data = request.json
+    try:
+        contents, temperature, error = _prepare_comprehensive_analysis(data)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if error: return jsonify({"status": "error", "message": error[0]}), error[1]
+    chunks = llm_service.stream_text_from_prompt(contents, data['model'], temperature, data['apiKey'],
+                                                 use_cache=data.get('use_cache', True), context_label='comprehensive')
+
+    def on_complete(report_content):
+        file_service.save_comprehensive_report(report_content)
+        return {"message": "综合分析报告 'Comprehensive_Report.md' 已生成/更新。", "report": report_content}
+
+    return _sse_response(chunks, on_complete)
+
+
 @app.route('/api/brainstorming/result', methods=['GET'])
 def get_brainstorming_result():
     """API: 获取已有的头脑风暴结果内容。"""
@@ -161,33 +346,114 @@ def get_brainstorming_result():
     return jsonify({"content": content})
 
 
+def _prepare_brainstorming(data):
+    """
+    校验头脑风暴请求的参数并构建提示词（初次生成或基于已有结果修改）。
+    返回 (提示词内容列表, temperature, None)，调用时使用 context_label='brainstorming'；
+    参数有误时返回 (None, None, (错误信息, HTTP状态码))。
+    """
+    api_key, model, temperature_str, existing_results, modification_prompt = data.get('apiKey'), data.get(
+        'model'), data.get('temperature'), data.get('existing_results'), data.get('modification_prompt')
+    if not api_key: return None, None, ("API Key 缺失。", 400)
+    if not model: return None, None, ("必须提供 'model' 参数。", 400)
+    if temperature_str is None:
+        return None, None, ("必须提供 'temperature' 参数。", 400)
+    try:
+        temperature = float(temperature_str)
+    except (ValueError, TypeError):
+        return None, None, ("Temperature 参数必须是有效的数字。", 400)
+    if modification_prompt and existing_results:
+        contents = [prompt_service.get_prompts().render('brainstorming_modify', existing_results=existing_results,
+                                                        modification_prompt=modification_prompt)]
+    else:
+        source_text, error_message = context_service.get_brainstorming_source_text(model)
+        if error_message: return None, None, (error_message, 404)
+        contents = prompt_service.get_prompts().render_contents('brainstorming_generate', 'source_text',
+                                                                source_text=source_text)
+    return contents, temperature, None
+
+
 @app.route('/api/brainstorming/start', methods=['POST'])
 def start_brainstorming():
     """API: 基于文献分析进行头脑风暴，支持初次生成和后续修改。"""
     data = request.json
-    api_key, model, temperature_str, existing_results, modification_prompt = data.get('apiKey'), data.get(
-        'model'), data.get('temperature'), data.get('existing_results'), data.get('modification_prompt')
-    if not api_key: return jsonify({"status": "error", "message": "API Key 缺失。"}), 400
-    if not model: return jsonify({"status": "error", "message": "必须提供 'model' 参数。"}), 400
-    if temperature_str is None: return jsonify({"status": "error", "message": "必须提供 'temperature' 参数。"}), 400
     try:
-        temperature = float(temperature_str)
-        if modification_prompt and existing_results:
-            prompt = PROMPTS['brainstorming_modify'].format(existing_results=existing_results,
-                                                            modification_prompt=modification_prompt)
-        else:
-            source_text, error_message = file_service.get_brainstorming_source_text()
-            if error_message: return jsonify({"status": "error", "message": error_message}), 404
-            prompt = PROMPTS['brainstorming_generate'].format(source_text=source_text)
-        brainstorm_results = llm_service.generate_text_from_prompt([prompt], model, temperature, api_key)
+        contents, temperature, error = _prepare_brainstorming(data)
+        if error: return jsonify({"status": "error", "message": error[0]}), error[1]
+        brainstorm_results = llm_service.generate_text_from_prompt(contents, data['model'], temperature,
+                                                                   data['apiKey'],
+                                                                   use_cache=data.get('use_cache', True),
+                                                                   context_label='brainstorming')
         file_service.save_brainstorming_result(brainstorm_results)
         return jsonify({"status": "success", "results": brainstorm_results})
-    except (ValueError, TypeError):
-        return jsonify({"status": "error", "message": "Temperature 参数必须是有效的数字。"}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/api/brainstorming/stream', methods=['POST'])
+def stream_brainstorming():
+    """API: 流式版本的头脑风暴，通过 SSE 逐段推送生成内容，结束后保存结果。"""
+    data = request.json
+    try:
+        contents, temperature, error = _prepare_brainstorming(data)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if error: return jsonify({"status": "error", "message": error[0]}), error[1]
+    chunks = llm_service.stream_text_from_prompt(contents, data['model'], temperature, data['apiKey'],
+                                                 use_cache=data.get('use_cache', True), context_label='brainstorming')
+
+    def on_complete(brainstorm_results):
+        file_service.save_brainstorming_result(brainstorm_results)
+        return {"results": brainstorm_results}
+
+    return _sse_response(chunks, on_complete)
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """API: 获取 LLM 响应缓存的命中/未命中计数和容量使用情况。"""
+    return jsonify(cache_service.get_stats())
+
+
+@app.route('/api/governor/stats', methods=['GET'])
+def get_governor_stats():
+    """API: 获取模型调用治理的统计信息（重试次数、限流等待时间、熔断情况等）。"""
+    return jsonify(governor_service.get_metrics())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """API: 以 Prometheus 文本格式输出请求耗时、模型调用耗时与 token 用量、缓存和调用治理等指标。"""
+    return Response(metrics_service.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/search', methods=['GET'])
+def search_documents():
+    """
+    API: 在文献的 Markdown 转换结果、单篇分析和论文章节中全文检索。
+    参数: q（搜索词，空白分隔的多个词须同时命中）、kind（可选，逗号分隔的 markdown/analysis/paper）、limit（可选）。
+    """
+    query = request.args.get('q', '')
+    kinds = [kind for kind in request.args.get('kind', '').split(',') if kind]
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit 必须是整数"}), 400
+    start = time.perf_counter()
+    try:
+        results = search_service.search(query, kinds, limit)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "query": query, "results": results,
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+
+@app.route('/api/search/stats', methods=['GET'])
+def get_search_stats():
+    """API: 获取全文检索索引中各类文档的数量。"""
+    return jsonify(search_service.get_stats())
+
+
 # --- 论文写作 API ---
 
 @app.route('/api/paper/structure', methods=['GET'])
@@ -223,12 +489,62 @@ def save_paper_content(paper_name):
     """API: 保存指定名称论文的完整内容JSON对象。"""
     try:
         data = request.json
+        previous = file_service.get_paper_content(paper_name) or {}
         file_service.save_paper_content(paper_name, data)
+        revision_service.record_changes(paper_name, {
+            key: (previous.get(key, {}).get('content', ''), data[key].get('content', ''))
+            for key in PAPER_STRUCTURE_MAP if isinstance(data.get(key), dict)
+        })
         return jsonify({"status": "success", "message": "内容已保存。"})
     except Exception as e:
         return jsonify({"status": "error", "message": f"保存失败: {e}"}), 500
 
 
+@app.route('/api/paper/content/<paper_name>', methods=['PATCH'])
+def patch_paper_content(paper_name):
+    """
+    API: 增量保存论文，只提交发生变化的章节。
+    请求体: {"version": 客户端所基于的版本号, "sections": {章节key: {"content": ..., "status": ..., "action": ...}}}
+    其中 action 为产生该修改的操作类型（如 edit、polish、expand），仅记录在修订历史中；
+    章节还可以包含 AI 生成接口返回的 generation 生成记录（用于检测过期章节），
+    以及该章节所基于的版本号 base_version（未提供时使用 version）。
+    要保存的章节在所基于的版本之后被修改过时返回 409，并附带服务器上的当前版本号和冲突的章节。
+    """
+    data = request.json or {}
+    sections = data.get('sections')
+    if not isinstance(data.get('version'), int) or not isinstance(sections, dict):
+        return jsonify({"status": "error", "message": "请求必须包含整数 version 和 sections 对象。"}), 400
+    for fields in sections.values():
+        generation = fields.get('generation') if isinstance(fields, dict) else None
+        if not isinstance(fields, dict) \
+                or not set(fields) <= {'content', 'status', 'action', 'generation', 'base_version'} \
+                or not all(isinstance(value, str) for key, value in fields.items()
+                           if key not in ('generation', 'base_version')) \
+                or not isinstance(fields.get('base_version', 0), int) \
+                or (generation is not None and not (isinstance(generation, dict)
+                                                    and set(generation) == {'fingerprint', 'model', 'language'})):
+            return jsonify({"status": "error",
+                            "message": "章节只能包含字符串类型的 content、status、action 字段、generation 生成记录"
+                                       "和整数 base_version。"}), 400
+    actions = {key: fields.pop('action') for key, fields in sections.items() if 'action' in fields}
+    base_versions = {key: fields.pop('base_version') for key, fields in sections.items() if 'base_version' in fields}
+    try:
+        new_version = file_service.patch_paper_sections(
+            paper_name, sections, data['version'],
+            on_saved=lambda changes: revision_service.record_changes(paper_name, changes, actions),
+            section_base_versions=base_versions)
+        return jsonify({"status": "success", "message": "内容已保存。", "version": new_version})
+    except file_service.PaperVersionConflict as e:
+        return jsonify({"status": "error", "message": str(e), "version": e.current_version,
+                        "sections": e.sections}), 409
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "论文未找到"}), 404
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"保存失败: {e}"}), 500
+
+
 @app.route('/api/papers/new', methods=['POST'])
 def create_new_paper():
     """API: 创建一篇新论文。"""
@@ -236,8 +552,8 @@ def create_new_paper():
         new_paper_meta = file_service.create_new_paper()
         return jsonify({"status": "success", "paper": new_paper_meta})
     except Exception as e:
-        # 打印详细错误到服务器控制台，方便调试
-        traceback.print_exc()
+        # 记录详细错误（含调用栈），方便调试
+        logger.exception("创建新论文失败")
         return jsonify({"status": "error", "message": f"创建新论文失败: {e}"}), 500
 
 
@@ -246,6 +562,8 @@ def delete_paper(paper_name):
     """API: 删除一篇论文。"""
     try:
         if file_service.delete_paper(paper_name):
+            revision_service.delete_log(paper_name)
+            llm_service.release_context_caches(f"paper:{paper_name}:")
             return jsonify({"status": "success", "message": "论文已删除。"})
         return jsonify({"status": "error", "message": "论文未找到或删除失败。"}), 404
     except Exception as e:
@@ -262,6 +580,8 @@ def rename_paper(old_paper_name):
     try:
         success, message = file_service.rename_paper(old_paper_name, new_name)
         if success:
+            revision_service.rename_log(old_paper_name, file_service.sanitize_paper_name(new_name))
+            llm_service.release_context_caches(f"paper:{old_paper_name}:")
             return jsonify({"status": "success", "message": message})
         else:
             # 根据 file_service 返回的具体错误信息设置状态码
@@ -271,115 +591,382 @@ def rename_paper(old_paper_name):
         return jsonify({"status": "error", "message": f"重命名时发生未知错误: {e}"}), 500
 
 
-@app.route('/api/paper/generate', methods=['POST'])
-def generate_paper_section():
+@app.route('/api/paper/stale/<paper_name>', methods=['GET'])
+def get_stale_sections(paper_name):
+    """API: 列出因依赖章节被修改而过期、需要重新生成的章节。"""
+    paper_data = file_service.get_paper_content(paper_name)
+    if paper_data is None:
+        return jsonify({"status": "error", "message": "论文未找到"}), 404
+    stale = draft_service.find_stale_sections(paper_data, _build_generate_prompt)
+    return jsonify({"status": "success", "stale": stale})
+
+
+@app.route('/api/paper/annotations/<paper_name>', methods=['GET'])
+def get_paper_annotations(paper_name):
+    """API: 统计论文各章节中的批注数量，并列出每条批注的位置、原文和修改意见。"""
+    paper_data = file_service.get_paper_content(paper_name)
+    if paper_data is None:
+        return jsonify({"status": "error", "message": "论文未找到"}), 404
+    summary = annotation_service.summarize(paper_data, [section['key'] for section in PAPER_STRUCTURE])
+    return jsonify({"status": "success", **summary})
+
+
+@app.route('/api/paper/revisions/<paper_name>', methods=['GET'])
+def list_paper_revisions(paper_name):
+    """API: 按时间倒序列出论文的修订历史，可通过 ?section= 只列出某个章节。"""
+    section = request.args.get('section')
+    limit = request.args.get('limit', default=100, type=int)
+    return jsonify(revision_service.list_revisions(paper_name, section, limit))
+
+
+@app.route('/api/paper/revisions/<paper_name>/<section>/<int:rev>', methods=['GET'])
+def get_paper_revision(paper_name, section, rev):
+    """API: 获取某个章节在指定修订时的内容。"""
+    content = revision_service.get_section_content(paper_name, section, rev)
+    if content is None:
+        return jsonify({"status": "error", "message": "未找到该修订。"}), 404
+    return jsonify({"status": "success", "section": section, "rev": rev, "content": content})
+
+
+@app.route('/api/paper/revisions/<paper_name>/<section>/<int:rev>/restore', methods=['POST'])
+def restore_paper_revision(paper_name, section, rev):
     """
-    API: 为论文的特定部分生成或修改内容。
-    现在完全由 config.py驱动，支持动态的依赖关系和章节名称。
+    API: 将某个章节恢复为指定修订时的内容。
+    请求体: {"version": 客户端中该章节所基于的版本号}，该章节在此之后被修改过时返回 409。
+    恢复本身也会作为一条新的修订记录下来。
     """
-    data = request.json
-    api_key, model, temperature_str, language, target_section, paper_data, action_type = \
+    data = request.json or {}
+    if not isinstance(data.get('version'), int):
+        return jsonify({"status": "error", "message": "请求必须包含整数 version。"}), 400
+    content = revision_service.get_section_content(paper_name, section, rev)
+    if content is None:
+        return jsonify({"status": "error", "message": "未找到该修订。"}), 404
+    try:
+        new_version = file_service.patch_paper_sections(
+            paper_name, {section: {"content": content}}, data['version'],
+            on_saved=lambda changes: revision_service.record_changes(paper_name, changes, {section: "restore"}))
+        return jsonify({"status": "success", "message": "已恢复。", "version": new_version, "content": content})
+    except file_service.PaperVersionConflict as e:
+        return jsonify({"status": "error", "message": str(e), "version": e.current_version,
+                        "sections": e.sections}), 409
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "论文未找到"}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"恢复失败: {e}"}), 500
+
+
+def _build_section_prompt(language: str, target_section: str, paper_data: dict, action_type: str,
+                          user_prompt: str = ''):
+    """
+    根据 config.py 中的论文结构和依赖关系，为指定章节的指定操作构建完整提示词。
+    返回 (提示词内容列表, None)，依赖章节的内容足够多时单独作为第一段，以便使用上下文缓存；
+    章节或操作类型无效时返回 (None, 错误信息)。
+    """
+    target_section_config = PAPER_STRUCTURE_MAP.get(target_section)
+    if not target_section_config:
+        return None, f"未知的论文部分: {target_section}"
+    if action_type not in prompt_service.SECTION_ACTIONS:
+        return None, f"无效的 action_type: {action_type}"
+
+    dep_keys = target_section_config.get('dependencies', [])
+    context_parts = []
+    for key in dep_keys:
+        if paper_data.get(key, {}).get('content'):
+            dep_section_config = PAPER_STRUCTURE_MAP.get(key)
+            display_name = dep_section_config['name'] if dep_section_config else key.capitalize()
+            context_parts.append(f"【{display_name}】:\n{paper_data[key]['content']}")
+
+    contents = prompt_service.get_prompts().build_section_contents(
+        language, action_type, target_section_config['name'], "\n\n".join(context_parts),
+        paper_data.get(target_section, {}).get('content', ''), user_prompt)
+    return contents, None
+
+
+def _prepare_paper_section(data):
+    """
+    校验章节生成请求的参数并构建提示词。
+    论文内容优先通过 'paper_name' 从服务端读取，也可以直接在 'paper_data' 中提供完整的论文对象。
+    返回 (提示词内容列表, temperature, 论文内容, None)；参数有误时返回 (None, None, None, (错误信息, HTTP状态码))。
+    """
+    api_key, model, temperature_str, language, target_section, action_type = \
         data.get('apiKey'), data.get('model'), data.get('temperature'), data.get('language'), \
-            data.get('target_section'), data.get('paper_data'), data.get('action_type')
+            data.get('target_section'), data.get('action_type')
 
     required_params = {'apiKey': api_key, 'model': model, 'temperature': temperature_str, 'language': language,
-                       'target_section': target_section, 'paper_data': paper_data, 'action_type': action_type}
+                       'target_section': target_section, 'action_type': action_type}
     for param, value in required_params.items():
-        if value is None: return jsonify({"status": "error", "message": f"请求体中必须提供 '{param}' 参数。"}), 400
+        if value is None:
+            return None, None, None, (f"请求体中必须提供 '{param}' 参数。", 400)
+
+    if data.get('paper_name') is not None:
+        paper_data = file_service.get_paper_content(data['paper_name'])
+        if paper_data is None:
+            return None, None, None, ("论文未找到", 404)
+    elif data.get('paper_data') is not None:
+        paper_data = data['paper_data']
+    else:
+        return None, None, None, ("请求体中必须提供 'paper_name' 或 'paper_data' 参数。", 400)
 
-    user_prompt = data.get('user_prompt', '')
     try:
         temperature = float(temperature_str)
-        prompt_parts = [PROMPTS['paper_section_base'].format(language=language)]
-
-        target_section_config = PAPER_STRUCTURE_MAP.get(target_section)
-        if not target_section_config:
-            return jsonify({"status": "error", "message": f"未知的论文部分: {target_section}"}), 400
-
-        dep_keys = target_section_config.get('dependencies', [])
-        context_parts = []
-        for key in dep_keys:
-            if paper_data.get(key, {}).get('content'):
-                dep_section_config = PAPER_STRUCTURE_MAP.get(key)
-                display_name = dep_section_config['name'] if dep_section_config else key.capitalize()
-                context_parts.append(f"【{display_name}】:\n{paper_data[key]['content']}")
-
-        if context_parts:
-            context_string = "\n\n".join(context_parts)
-            prompt_parts.append(PROMPTS['paper_section_context_header'].format(context_string=context_string))
-
-        display_target_name = target_section_config['name']
-        action_map = {'generate': 'paper_section_instruction_generate',
-                      'modify': 'paper_section_instruction_modify',
-                      'ai_annotate': 'paper_section_instruction_ai_annotate',
-                      'modify_annotated': 'paper_section_instruction_modify_annotated',
-                      'expand': 'paper_section_instruction_expand',
-                      'polish': 'paper_section_instruction_polish'}
-        prompt_key = action_map.get(action_type)
-        if not prompt_key: return jsonify({"status": "error", "message": f"无效的 action_type: {action_type}"}), 400
-
-        prompt_template = PROMPTS[prompt_key]
-        current_content = paper_data.get(target_section, {}).get('content', '')
-
-        if action_type == 'generate':
-            instruction = prompt_template.format(language=language, target_name=display_target_name)
-        elif action_type == 'modify':
-            instruction = prompt_template.format(target_name=display_target_name,
-                                                 current_content=current_content,
-                                                 language=language, user_prompt=user_prompt)
-        elif action_type in ['modify_annotated', 'ai_annotate']:
-            instruction = prompt_template.format(target_name=display_target_name,
-                                                 current_content=current_content,
-                                                 language=language)
-        else:  # expand, polish
-            instruction = prompt_template.format(target_name=display_target_name,
-                                                 current_content=current_content,
-                                                 language=language)
-
-        prompt_parts.append(instruction)
-        prompt_parts.append(PROMPTS['paper_section_output_format'])
-        final_prompt = "\n".join(prompt_parts)
-        generated_content = llm_service.generate_text_from_prompt([final_prompt], model, temperature, api_key)
-        return jsonify({"status": "success", "content": generated_content.strip()})
     except (ValueError, TypeError):
-        return jsonify({"status": "error", "message": "Temperature 参数必须是有效的数字。"}), 400
+        return None, None, None, ("Temperature 参数必须是有效的数字。", 400)
+
+    contents, error_message = _build_section_prompt(language, target_section, paper_data, action_type,
+                                                    data.get('user_prompt', ''))
+    if error_message: return None, None, None, (error_message, 400)
+    return contents, temperature, paper_data, None
+
+
+def _section_context_label(data):
+    """章节请求的上下文缓存标签；论文内容直接随请求提供时不设置标签（缓存只按内容复用）。"""
+    if data.get('paper_name') is None:
+        return None
+    return f"paper:{data['paper_name']}:{data['target_section']}"
+
+
+def _build_generate_prompt(paper_data: dict, section_key: str, language: str) -> list:
+    """构建章节的生成提示词内容列表，用于草稿生成和计算章节的生成指纹。"""
+    contents, error_message = _build_section_prompt(language, section_key, paper_data, 'generate')
+    if error_message: raise ValueError(error_message)
+    return contents
+
+
+def _section_generation_record(data, paper_data: dict):
+    """
+    为已通过校验的章节生成请求计算生成记录（依赖章节内容、提示词和模型的指纹），
+    paper_data 为 _prepare_paper_section 构建提示词时使用的论文内容。在生成成功后才调用。
+    前端接受生成结果时将其随章节一起保存，之后依赖章节的修改会使该章节被标记为过期。
+    """
+    contents = _build_generate_prompt(paper_data, data['target_section'], data['language'])
+    return draft_service.generation_record(contents, data['model'], data['language'])
+
+
+@app.route('/api/paper/generate', methods=['POST'])
+def generate_paper_section():
+    """
+    API: 为论文的特定部分生成或修改内容。
+    现在完全由 config.py驱动，支持动态的依赖关系和章节名称。
+    """
+    data = request.json
+    try:
+        contents, temperature, paper_data, error = _prepare_paper_section(data)
+        if error: return jsonify({"status": "error", "message": error[0]}), error[1]
+        generated_content = llm_service.generate_text_from_prompt(contents, data['model'], temperature,
+                                                                  data['apiKey'],
+                                                                  use_cache=data.get('use_cache', True),
+                                                                  context_label=_section_context_label(data))
+        return jsonify({"status": "success", "content": generated_content.strip(),
+                        "generation": _section_generation_record(data, paper_data)})
+    except Exception as e:
+        logger.exception("生成论文章节失败")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/api/paper/generate/stream', methods=['POST'])
+def stream_paper_section():
+    """
+    API: 流式版本的章节生成，通过 SSE 逐段推送生成内容。
+    与非流式版本一致，生成结果不会直接写入论文，由用户在差异对比中确认后再保存。
+    """
+    data = request.json
+    try:
+        contents, temperature, paper_data, error = _prepare_paper_section(data)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("构建章节提示词失败")
         return jsonify({"status": "error", "message": str(e)}), 500
+    if error: return jsonify({"status": "error", "message": error[0]}), error[1]
+    chunks = llm_service.stream_text_from_prompt(contents, data['model'], temperature, data['apiKey'],
+                                                 use_cache=data.get('use_cache', True),
+                                                 context_label=_section_context_label(data))
+    return _sse_response(chunks, lambda content: {"content": content.strip(),
+                                                  "generation": _section_generation_record(data, paper_data)})
 
 
-@app.route('/api/paper/export/markdown/<paper_name>', methods=['GET'])
-def export_paper_as_markdown(paper_name):
+def _attachment_response(chunks, filename: str, mimetype: str):
+    """将分块产出的内容作为下载文件流式返回。"""
+    # 对包含非 ASCII 字符的文件名进行 URL 编码，以符合 RFC 5987 标准
+    # filename* 参数用于处理非 ASCII 字符，确保中文名能正确显示
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"})
+
+
+@app.route('/api/paper/export/<export_format>/<paper_name>', methods=['GET'])
+def export_paper(paper_name, export_format):
     """
-    API: 将指定论文导出为格式化的 Markdown 文件。
-    此端点会触发浏览器下载文件。
+    API: 将指定论文导出为 Markdown、HTML 或 Word (DOCX) 文件。
+    此端点会触发浏览器下载文件；内容未变化的论文直接复用之前的渲染结果。
     """
+    if export_format not in export_service.EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"不支持的导出格式: {export_format}"}), 400
     try:
         paper_content = file_service.get_paper_content(paper_name)
         if paper_content is None:
             return jsonify({"status": "error", "message": "论文未找到"}), 404
-
-        # 调用新的导出服务来生成 Markdown 文本
-        markdown_text = create_markdown_from_paper(paper_content, PAPER_STRUCTURE)
-
-        # 对包含非 ASCII 字符的文件名进行 URL 编码，以符合 RFC 5987 标准
-        encoded_filename = quote(f"{paper_name}.md")
-
-        # 创建一个 Flask Response 对象，设置正确的 MIME 类型和 Content-Disposition 头
-        # 这会告诉浏览器将响应内容作为文件下载，而不是直接显示
-        # filename* 参数用于处理非 ASCII 字符，确保中文名能正确显示
-        return Response(
-            markdown_text,
-            mimetype='text/markdown; charset=utf-8',
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
-            }
-        )
+        path = export_service.render_cached(paper_content, export_format, paper_name)
+        extension, mimetype, _ = export_service.EXPORT_FORMATS[export_format]
+        return _attachment_response(export_service.stream_file(path), f"{paper_name}{extension}", mimetype)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("导出论文 '%s' 失败", paper_name)
         return jsonify({"status": "error", "message": f"导出失败: {e}"}), 500
 
 
+@app.route('/api/papers/export/<export_format>', methods=['GET'])
+def export_all_papers(export_format):
+    """
+    API: 将 result/paper_writing 中的所有论文以指定格式打包为 ZIP 下载。
+    ZIP 边生成边输出，每篇论文在写入时才被读取和渲染，内存占用与论文数量无关。
+    """
+    if export_format not in export_service.EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"不支持的导出格式: {export_format}"}), 400
+    extension, _, compress = export_service.EXPORT_FORMATS[export_format]
+
+    def entries():
+        for paper in file_service.list_papers():
+            paper_content = file_service.get_paper_content(paper['id'])
+            if paper_content is None:  # 导出过程中被删除
+                continue
+            yield (f"{paper['id']}{extension}",
+                   export_service.render_cached(paper_content, export_format, paper['id']), compress)
+
+    return _attachment_response(export_service.stream_zip(entries()), f"papers-{export_format}.zip",
+                                'application/zip')
+
+
+# --- 后台任务 API ---
+
+def _run_single_paper_job(params, api_key, report_progress):
+    """后台任务：处理单个PDF文件（Markdown 转换与分析报告）。"""
+    batch_service.process_paper(params['filename'], prompt_service.get_prompts(), params['model'],
+                                float(params['temperature_markdown']), float(params['temperature_analysis']),
+                                api_key, use_cache=params.get('use_cache', True), report_progress=report_progress)
+    return {"filename": params['filename']}
+
+
+def _run_comprehensive_report_job(params, api_key, report_progress):
+    """后台任务：生成并保存综合文献综述报告。"""
+    contents, temperature, error = _prepare_comprehensive_analysis({**params, 'apiKey': api_key}, report_progress)
+    if error: raise ValueError(error[0])
+    report_content = llm_service.generate_text_from_prompt(contents, params['model'], temperature, api_key,
+                                                           use_cache=params.get('use_cache', True),
+                                                           context_label='comprehensive')
+    file_service.save_comprehensive_report(report_content)
+    return {"report": report_content}
+
+
+def _run_brainstorming_job(params, api_key, report_progress):
+    """后台任务：进行头脑风暴（初次生成或修改）并保存结果。"""
+    contents, temperature, error = _prepare_brainstorming({**params, 'apiKey': api_key})
+    if error: raise ValueError(error[0])
+    brainstorm_results = llm_service.generate_text_from_prompt(contents, params['model'], temperature, api_key,
+                                                               use_cache=params.get('use_cache', True),
+                                                               context_label='brainstorming')
+    file_service.save_brainstorming_result(brainstorm_results)
+    return {"results": brainstorm_results}
+
+
+def _run_paper_section_job(params, api_key, report_progress):
+    """后台任务：为论文的指定章节生成内容（结果不会直接写入论文）。"""
+    contents, temperature, paper_data, error = _prepare_paper_section({**params, 'apiKey': api_key})
+    if error: raise ValueError(error[0])
+    generated_content = llm_service.generate_text_from_prompt(contents, params['model'], temperature, api_key,
+                                                              use_cache=params.get('use_cache', True),
+                                                              context_label=_section_context_label(params))
+    return {"content": generated_content.strip(), "generation": _section_generation_record(params, paper_data)}
+
+
+def _run_paper_draft_job(params, api_key, report_progress, section_keys=None):
+    """后台任务：按章节依赖关系并行生成整篇论文草稿，每个章节完成后立即写入论文。"""
+    for param in ('paper_name', 'model', 'temperature', 'language'):
+        if params.get(param) is None:
+            raise ValueError(f"请求体中必须提供 '{param}' 参数。")
+    paper_name = params['paper_name']
+    return draft_service.generate_draft(
+        paper_name, _build_generate_prompt, params['model'], float(params['temperature']), api_key,
+        params['language'], section_keys=section_keys,
+        use_cache=params.get('use_cache', True), overwrite=params.get('overwrite', False),
+        on_section_saved=lambda changes: revision_service.record_changes(
+            paper_name, changes, {key: 'generate' for key in changes}),
+        report_progress=report_progress)
+
+
+def _run_paper_refresh_stale_job(params, api_key, report_progress):
+    """后台任务：只重新生成因依赖章节被修改而过期的章节，互不依赖的章节并行生成。"""
+    paper_data = file_service.get_paper_content(params.get('paper_name'))
+    if paper_data is None:
+        raise FileNotFoundError(f"论文未找到: {params.get('paper_name')}")
+    stale = draft_service.find_stale_sections(paper_data, _build_generate_prompt)
+    if not stale:
+        return {"generated": [], "failed": {}, "skipped": []}
+    return _run_paper_draft_job(params, api_key, report_progress, section_keys=stale)
+
+
+job_service.register_handler('single_paper', _run_single_paper_job, max_workers=BATCH_MAX_WORKERS)
+job_service.register_handler('comprehensive_report', _run_comprehensive_report_job)
+job_service.register_handler('brainstorming', _run_brainstorming_job)
+job_service.register_handler('paper_section', _run_paper_section_job)
+job_service.register_handler('paper_draft', _run_paper_draft_job)
+job_service.register_handler('paper_refresh_stale', _run_paper_refresh_stale_job)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    API: 提交一个后台任务，立即返回任务ID。
+    请求体中的 'type' 指定任务类型，'apiKey' 仅保存在内存中，其余字段作为任务参数持久化。
+    """
+    data = request.json
+    job_type, api_key = data.get('type'), data.get('apiKey')
+    if not api_key: return jsonify({"status": "error", "message": "API Key 缺失。"}), 400
+    if not job_service.is_registered(job_type):
+        return jsonify({"status": "error", "message": f"未知的任务类型: {job_type}"}), 400
+    params = {k: v for k, v in data.items() if k not in ('type', 'apiKey')}
+    job_id = job_service.submit(job_type, params, api_key)
+    return jsonify({"status": "success", "job_id": job_id})
+
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """API: 按创建时间倒序列出最近的后台任务，可通过 type 参数过滤。"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(job_service.list_jobs(job_type=request.args.get('type'), limit=limit))
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """API: 查询后台任务的状态、进度和结果。"""
+    job = job_service.get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "任务未找到。"}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """API: 通过 SSE 推送后台任务的状态变化，任务结束后关闭连接。"""
+    if job_service.get_job(job_id) is None:
+        return jsonify({"status": "error", "message": "任务未找到。"}), 404
+
+    def event_stream():
+        for job in job_service.iter_job_updates(job_id):
+            yield f"event: job\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    """API: 使用新提供的 API Key 恢复一个已中断或失败的后台任务。"""
+    api_key = (request.json or {}).get('apiKey')
+    if not api_key: return jsonify({"status": "error", "message": "API Key 缺失。"}), 400
+    success, message = job_service.resume(job_id, api_key)
+    if success:
+        return jsonify({"status": "success", "message": message})
+    status_code = 404 if message == "任务未找到" else 409
+    return jsonify({"status": "error", "message": message}), status_code
+
+
 if __name__ == '__main__':
     file_service.PAPERS_DIR.mkdir(exist_ok=True)
     file_service.RESULT_DIR.mkdir(exist_ok=True)
@@ -0,0 +1,105 @@
+# benchmarks/bench_annotations.py
+"""
+批注清理基准测试。
+
+生成数 MB 的合成论文文本，分别测量 annotation_service 的单遍扫描器和原先的惰性正则
+`{{([\s\S]+?)}}【修改意见：[\s\S]+?】` 的清理耗时。文本类型：
+- well_formed: 密集的正常批注；
+- unclosed_open: 正常批注之间夹杂大量没有闭合的 `{{`；
+- missing_end: 大量缺少 `】` 的意见标记；
+- nested: 多层嵌套的批注。
+
+扫描器在每种文本上按倍增的大小测量，若耗时的增长明显超过文本大小的增长（非线性），以非零状态退出。
+原正则在病态文本上是平方时间，只在不超过 --legacy-max-mb 的大小上测量。
+
+用法:
+    python benchmarks/bench_annotations.py --sizes 1 2 4 8 --legacy-max-mb 0.05
+"""
+import argparse
+import math
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import annotation_service  # noqa: E402
+
+LEGACY_PATTERN = r"{{([\s\S]+?)}}【修改意见：[\s\S]+?】"
+FILLER = "本研究基于面板数据检验了数字化转型对企业创新绩效的影响机制，结果表明 effect size 显著。"
+
+# 非线性判定：大小每翻一倍，耗时允许增长到该倍数以内（留出缓存和计时误差的余量）
+MAX_GROWTH_PER_DOUBLING = 2.6
+
+
+def _unit(kind: str, i: int) -> str:
+    if kind == "well_formed":
+        return f"{FILLER}{{{{原文{i}}}}}【修改意见：请补充文献{i}】"
+    if kind == "unclosed_open":
+        return f"{FILLER}{{{{未闭合{i} " + (f"{{{{原文}}}}【修改意见：意见{i}】" if i % 4 == 0 else "")
+    if kind == "missing_end":
+        return f"{FILLER}{{{{原文{i}}}}}【修改意见：缺少结束符 "
+    if kind == "nested":
+        return f"{{{{外层 {FILLER} {{{{内层{i}}}}}【修改意见：内层意见】 结尾}}}}【修改意见：外层意见{i}】"
+    raise ValueError(kind)
+
+
+def make_document(kind: str, size_bytes: int) -> str:
+    parts, total, i = [], 0, 0
+    while total < size_bytes:
+        unit = _unit(kind, i)
+        parts.append(unit)
+        total += len(unit.encode("utf-8"))
+        i += 1
+    return "".join(parts)
+
+
+def _time(func, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 2, 4, 8], help="文本大小（MB），从小到大排列")
+    parser.add_argument("--legacy-max-mb", type=float, default=0.05, help="原正则只在该大小的文本上测量（病态文本上耗时随大小平方增长）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量重复次数（取最好成绩）")
+    args = parser.parse_args()
+
+    legacy = re.compile(LEGACY_PATTERN)
+    linear = True
+    for kind in ("well_formed", "unclosed_open", "missing_end", "nested"):
+        print(f"--- {kind} ---")
+        previous = None
+        for size_mb in args.sizes:
+            text = make_document(kind, int(size_mb * 1024 * 1024))
+            elapsed = _time(annotation_service.strip, text, args.repeat)
+            line = f"{size_mb:6.2f}MB  扫描器 {elapsed * 1000:9.1f}ms ({elapsed / size_mb * 1000:7.1f}ms/MB)"
+            if previous is not None:
+                growth = elapsed / previous[1]
+                allowed = MAX_GROWTH_PER_DOUBLING ** math.log2(size_mb / previous[0])
+                line += f"  增长 x{growth:.2f}"
+                if growth > allowed:
+                    linear = False
+                    line += " (超出线性预期)"
+            previous = (size_mb, elapsed)
+            print(line)
+
+        legacy_size = args.legacy_max_mb
+        text = make_document(kind, int(legacy_size * 1024 * 1024))
+        new_elapsed = _time(annotation_service.strip, text, args.repeat)
+        old_elapsed = _time(lambda t: legacy.sub(r"\1", t), text, 1)
+        print(f"{legacy_size:6.2f}MB  原正则 {old_elapsed * 1000:9.1f}ms  扫描器 {new_elapsed * 1000:9.1f}ms  "
+              f"加速 x{old_elapsed / new_elapsed:.1f}")
+
+    print("线性时间检查:", "通过" if linear else "未通过")
+    sys.exit(0 if linear else 1)
+
+
+if __name__ == "__main__":
+    main()
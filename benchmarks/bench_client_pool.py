@@ -0,0 +1,113 @@
+# benchmarks/bench_client_pool.py
+"""
+genai.Client 连接池微基准测试。
+
+在本地启动一个模拟 Gemini API 的 HTTP 服务，分别测量：
+- 每次调用都新建 genai.Client（连接池引入前的行为）；
+- 通过 llm_service 连接池复用客户端；
+两种方式下单次 generate_content 调用的开销。
+
+可通过 --handshake-ms 为每个新建的 TCP 连接注入额外延迟，模拟真实环境中的 TLS 握手成本。
+
+用法:
+    python benchmarks/bench_client_pool.py --calls 200 --handshake-ms 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+RESPONSE_BODY = json.dumps({
+    "candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}, "finishReason": "STOP"}],
+}).encode("utf-8")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """对任何 POST 请求返回固定的 generateContent 响应，并保持长连接。"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    handshake_delay = 0.0
+    connections = 0
+
+    def setup(self):
+        # setup 在每个新的 TCP 连接上只执行一次
+        type(self).connections += 1
+        if self.handshake_delay:
+            time.sleep(self.handshake_delay)
+        super().setup()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _measure(label: str, calls: int, call_once):
+    StubHandler.connections = 0
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call_once()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    print(f"{label:<28} mean={statistics.mean(durations):7.2f}ms  "
+          f"p50={durations[len(durations) // 2]:7.2f}ms  "
+          f"p95={durations[int(len(durations) * 0.95) - 1]:7.2f}ms  "
+          f"connections={StubHandler.connections}")
+    return statistics.mean(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100, help="每种方式的调用次数")
+    parser.add_argument("--handshake-ms", type=float, default=0.0, help="每个新连接注入的延迟（毫秒）")
+    args = parser.parse_args()
+
+    StubHandler.handshake_delay = args.handshake_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GOOGLE_GEMINI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+
+    from google import genai
+    from services import llm_service
+
+    api_key = "benchmark-key"
+    model = "gemini-2.5-flash"
+
+    def per_call_client():
+        client = genai.Client(api_key=api_key)
+        try:
+            client.models.generate_content(model=model, contents=["ping"])
+        finally:
+            client.close()
+
+    def pooled_client():
+        with llm_service.checkout_client(api_key) as client:
+            client.models.generate_content(model=model, contents=["ping"])
+
+    # 预热，排除首次导入和初始化的影响
+    per_call_client()
+    pooled_client()
+
+    before = _measure("每次调用新建 Client", args.calls, per_call_client)
+    after = _measure("连接池复用 Client", args.calls, pooled_client)
+    print(f"单次调用开销降低: {before - after:.2f}ms ({(1 - after / before) * 100:.1f}%)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# benchmarks/bench_load.py
+"""
+接口负载基准测试。
+
+使用本地模拟的模型后端（backend_service 的 stub 模式，或回放 record 模式录制的响应），
+在临时目录中启动完整的 Flask 应用，由 N 个并发的模拟用户通过 HTTP 反复调用以下接口：
+- ingest: 单篇文献分析（/api/single_analysis/process_file，每次使用一份新复制的 PDF）；
+- report: 综合文献分析（/api/comprehensive_analysis/start）；
+- brainstorm: 头脑风暴（/api/brainstorming/start）；
+- section: 论文章节生成（/api/paper/generate）。
+结束后按场景输出请求数、失败数、吞吐量和 p50 / p95 / p99 延迟。
+
+所有结果写入临时目录，不会影响 result/ 中的数据；默认不使用响应缓存，并取消调用治理的限流
+（--keep-rate-limits 保留 config.py 中的限流配置）。
+
+用法:
+    python benchmarks/bench_load.py --users 8 --requests 10 --latency 0.5 --tokens-per-second 200
+    python benchmarks/bench_load.py --users 16 --scenarios report,section --error-rate 0.05
+"""
+import argparse
+import json
+import math
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import (backend_service, cache_service, file_service, governor_service, job_service,  # noqa: E402
+                      pdf_service, profile_service, search_service)
+
+SCENARIOS = ("ingest", "report", "brainstorm", "section")
+MODEL = "gemini-2.5-flash"
+SECTIONS = ["abstract", "keywords", "introduction", "background"]
+
+
+def isolate(tmp_dir: Path):
+    """将所有结果目录指向临时目录。"""
+    result_dir = tmp_dir / "result"
+    file_service.RESULT_DIR = result_dir
+    file_service.PAPERS_DIR = tmp_dir / "papers"
+    file_service.MARKDOWNS_DIR = result_dir / "markdowns"
+    file_service.MARKDOWN_CHUNKS_DIR = result_dir / "markdown_chunks"
+    file_service.ANALYSES_DIR = result_dir / "analyses"
+    file_service.REPORTS_DIR = result_dir / "reports"
+    file_service.PARTIAL_REPORTS_DIR = file_service.REPORTS_DIR / "partials"
+    file_service.BRAINSTORMS_DIR = result_dir / "brainstorms"
+    file_service.PAPER_WRITING_DIR = result_dir / "paper_writing"
+    file_service.PAPER_REVISIONS_DIR = file_service.PAPER_WRITING_DIR / "revisions"
+    file_service.EXPORT_CACHE_DIR = result_dir / "exports"
+    file_service.COMPREHENSIVE_REPORT_PATH = file_service.REPORTS_DIR / "Comprehensive_Report.md"
+    file_service.BRAINSTORMING_RESULTS_PATH = file_service.BRAINSTORMS_DIR / "Brainstorming_Results.md"
+    file_service.PAPER_INDEX_PATH = result_dir / "paper_index.json"
+    cache_service.CACHE_DIR = result_dir / "cache"
+    cache_service.CACHE_DB_PATH = cache_service.CACHE_DIR / "llm_responses.sqlite3"
+    job_service.JOBS_DIR = result_dir / "jobs"
+    job_service.JOBS_DB_PATH = job_service.JOBS_DIR / "jobs.sqlite3"
+    search_service.SEARCH_DIR = result_dir / "search"
+    search_service.SEARCH_DB_PATH = search_service.SEARCH_DIR / "index.sqlite3"
+    pdf_service.PDF_EXTRACTS_DIR = result_dir / "pdf_extracts"
+    profile_service.PROFILES_DIR = result_dir / "profiles"
+    for directory in (file_service.PAPERS_DIR, file_service.MARKDOWNS_DIR, file_service.ANALYSES_DIR,
+                      file_service.PARTIAL_REPORTS_DIR, file_service.BRAINSTORMS_DIR,
+                      file_service.PAPER_REVISIONS_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+def seed(analyses: int, analysis_kb: int) -> list:
+    """写入合成的单篇分析和综合报告，供综合分析和头脑风暴使用，返回分析的文件名列表。"""
+    paragraph = "本文基于面板数据研究数字化转型对企业创新的影响，并检验融资约束的中介作用。" * 8
+    stems = []
+    for i in range(analyses):
+        stem = f"synthetic_{i:04d}"
+        body = "\n\n".join(f"## 第 {j + 1} 部分\n{paragraph}" for j in range(max(1, analysis_kb * 1024 // 700)))
+        (file_service.ANALYSES_DIR / f"{stem}.md").write_text(f"# {stem}\n\n{body}\n", encoding="utf-8")
+        stems.append(stem)
+    file_service.save_comprehensive_report("# 综合分析报告\n\n" + paragraph * 20)
+    return stems
+
+
+class Workload:
+    """为每个场景构造请求；ingest 每次复制一份新的 PDF，使每个请求都完整执行解析和分析。"""
+
+    def __init__(self, args, stems: list, source_pdfs: list):
+        self.args = args
+        self.stems = stems
+        self.source_pdfs = source_pdfs
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def _next(self) -> int:
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def build(self, scenario: str):
+        base = {"apiKey": "bench", "model": MODEL, "use_cache": self.args.use_cache}
+        n = self._next()
+        if scenario == "ingest":
+            source = self.source_pdfs[n % len(self.source_pdfs)]
+            filename = f"bench_{n:05d}.pdf"
+            shutil.copyfile(source, file_service.PAPERS_DIR / filename)
+            return "/api/single_analysis/process_file", {**base, "filename": filename, "temperature_markdown": 0.2,
+                                                         "temperature_analysis": 0.2}
+        if scenario == "report":
+            return "/api/comprehensive_analysis/start", {**base, "temperature": 0.2, "mode": "single",
+                                                         "papers": self.stems[:self.args.report_papers]}
+        if scenario == "brainstorm":
+            return "/api/brainstorming/start", {**base, "temperature": 0.2}
+        section = SECTIONS[n % len(SECTIONS)]
+        paper_data = {"idea": {"content": f"研究想法 {n}：数字化转型与企业创新。" * 20},
+                      "title": {"content": f"数字化转型与企业创新 {n}"},
+                      "abstract": {"content": "本文研究数字化转型对企业创新的影响。" * 30}}
+        return "/api/paper/generate", {**base, "temperature": 0.2, "language": "中文", "target_section": section,
+                                       "action_type": "generate", "paper_data": paper_data}
+
+
+def post(url: str, payload: dict) -> bool:
+    request = urllib.request.Request(url, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=600) as response:
+            return json.loads(response.read()).get("status") == "success"
+    except urllib.error.HTTPError:
+        return False
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """最近秩法计算百分位数。"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8, help="并发的模拟用户数")
+    parser.add_argument("--requests", type=int, default=10, help="每个用户发出的请求数")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景，用户轮流执行")
+    parser.add_argument("--backend", choices=["stub", "replay"], default="stub", help="模型后端")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟的首个 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="模拟的输出速度")
+    parser.add_argument("--output-tokens", type=int, default=400, help="每次模拟响应的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟 503 错误的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="模拟 429 错误的比例")
+    parser.add_argument("--analyses", type=int, default=50, help="合成的单篇分析数量")
+    parser.add_argument("--analysis-kb", type=int, default=8, help="每篇合成分析的大小（KB）")
+    parser.add_argument("--report-papers", type=int, default=20, help="综合分析选择的文献数")
+    parser.add_argument("--papers-dir", default=str(Path(__file__).resolve().parent.parent / "papers"),
+                        help="ingest 场景使用的 PDF 所在目录")
+    parser.add_argument("--use-cache", action="store_true", help="使用响应缓存（默认关闭，每个请求都调用模型）")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="保留 config.py 中的调用治理限流配置")
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+    source_pdfs = sorted(Path(args.papers_dir).glob("*.pdf"))
+    if "ingest" in scenarios and not source_pdfs:
+        print(f"{args.papers_dir} 中没有 PDF 文件，跳过 ingest 场景。")
+        scenarios.remove("ingest")
+
+    backend_service.LLM_BACKEND = args.backend
+    backend_service.LLM_STUB_LATENCY_SECONDS = args.latency
+    backend_service.LLM_STUB_TOKENS_PER_SECOND = args.tokens_per_second
+    backend_service.LLM_STUB_OUTPUT_TOKENS = args.output_tokens
+    backend_service.LLM_STUB_ERROR_RATE = args.error_rate
+    backend_service.LLM_STUB_RATE_LIMIT_RATE = args.rate_limit_rate
+    if not args.keep_rate_limits:
+        governor_service.GOVERNOR_RATE_LIMIT_PER_MINUTE = 10 ** 6
+        governor_service.GOVERNOR_MODEL_RATE_LIMITS = {}
+        governor_service.GOVERNOR_BURST = 10 ** 6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        isolate(Path(tmp))
+        if args.backend == "replay":
+            # 回放 result/ 中录制的响应
+            backend_service.RECORDINGS_DIR = Path(__file__).resolve().parent.parent / "result" / "llm_recordings"
+        stems = seed(args.analyses, args.analysis_kb)
+
+        # 应用在导入时加载提示词并同步检索索引，须在结果目录指向临时目录之后导入
+        import app as app_module
+        from werkzeug.serving import make_server
+        server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        workload = Workload(args, stems, source_pdfs)
+        latencies = defaultdict(list)
+        failures = defaultdict(int)
+        results_lock = threading.Lock()
+
+        def user(index: int):
+            for i in range(args.requests):
+                scenario = scenarios[(index + i) % len(scenarios)]
+                path, payload = workload.build(scenario)
+                start = time.perf_counter()
+                try:
+                    ok = post(base_url + path, payload)
+                except Exception as e:
+                    print(f"{scenario} 请求出错: {e}")
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with results_lock:
+                    latencies[scenario].append(elapsed)
+                    if not ok:
+                        failures[scenario] += 1
+
+        print(f"{args.users} 个用户 x {args.requests} 个请求，场景 {', '.join(scenarios)}，后端 {args.backend}"
+              f"（延迟 {args.latency}s，{args.tokens_per_second} token/s，{args.output_tokens} token/响应，"
+              f"503 比例 {args.error_rate}，429 比例 {args.rate_limit_rate}）")
+        start = time.perf_counter()
+        users = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        wall = time.perf_counter() - start
+        server.shutdown()
+
+        print(f"{'场景':12} {'请求':>6} {'失败':>6} {'吞吐(req/s)':>12} {'p50(ms)':>10} {'p95(ms)':>10} {'p99(ms)':>10}")
+        for scenario in [*scenarios, "total"]:
+            values = sorted(sum(latencies.values(), []) if scenario == "total" else latencies[scenario])
+            failed = sum(failures.values()) if scenario == "total" else failures[scenario]
+            print(f"{scenario:12} {len(values):6d} {failed:6d} {len(values) / wall:12.2f} "
+                  f"{percentile(values, 50) * 1000:10.1f} {percentile(values, 95) * 1000:10.1f} "
+                  f"{percentile(values, 99) * 1000:10.1f}")
+        print(f"总耗时 {wall:.1f}s，调用治理统计: {governor_service.get_metrics()}")
+
+
+if __name__ == "__main__":
+    main()
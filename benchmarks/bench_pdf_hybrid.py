@@ -0,0 +1,72 @@
+# benchmarks/bench_pdf_hybrid.py
+"""
+PDF 本地预处理基准测试。
+
+对指定目录（默认 papers/）中的每个 PDF 运行 pdf_service 的本地预处理（不使用缓存），输出：
+- 解析耗时；
+- 以文本发送和以 PDF 发送的页数，以及各页被判定为复杂页的原因；
+- 需要上传的字节数（精简 PDF 或完整 PDF）与原文件大小的对比，以及文本部分的估算 token 数。
+
+用法:
+    python benchmarks/bench_pdf_hybrid.py --dir papers
+"""
+import argparse
+import hashlib
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import context_service, pdf_service  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=str(Path(__file__).resolve().parent.parent / "papers"), help="PDF 所在目录")
+    args = parser.parse_args()
+
+    if not pdf_service.is_available():
+        print("本地预处理不可用：请安装 pypdf 并在 config.py 中启用 PDF_HYBRID_ENABLED。")
+        sys.exit(1)
+
+    files = sorted(Path(args.dir).glob("*.pdf"))
+    if not files:
+        print(f"{args.dir} 中没有 PDF 文件。")
+        sys.exit(1)
+
+    total_original, total_upload = 0, 0
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_service.PDF_EXTRACTS_DIR = Path(tmp)
+        for file_path in files:
+            file_hash = hashlib.sha256(file_path.read_bytes()).hexdigest()
+            start = time.perf_counter()
+            document = pdf_service.prepare_document(file_path, file_hash)
+            elapsed = time.perf_counter() - start
+
+            with open(Path(tmp) / f"{file_hash}.json", "r", encoding="utf-8") as f:
+                record = json.load(f)
+            original = file_path.stat().st_size
+            if document is None:
+                upload, text_tokens, mode = original, 0, "完整 PDF"
+            else:
+                upload = document["pdf_path"].stat().st_size if document["pdf_path"] else 0
+                text_tokens, mode = context_service.estimate_tokens(document["text"]), "文本 + 精简 PDF"
+            total_original += original
+            total_upload += upload
+
+            pages = record["page_count"]
+            print(f"{file_path.name[:60]}")
+            print(f"    解析 {elapsed * 1000:7.1f}ms  {mode}  文本页 {pages - len(record['pdf_pages'])}/{pages}  "
+                  f"上传 {upload / 1024:7.1f}KB / 原文件 {original / 1024:7.1f}KB  文本约 {text_tokens} tokens")
+            if record.get("features"):
+                print(f"    复杂页: {record['features']}")
+
+    print(f"合计上传 {total_upload / 1024:.1f}KB / 原文件 {total_original / 1024:.1f}KB "
+          f"({total_upload / total_original:.0%})")
+
+
+if __name__ == "__main__":
+    main()
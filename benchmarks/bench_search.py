@@ -0,0 +1,83 @@
+# benchmarks/bench_search.py
+"""
+全文检索基准测试。
+
+在临时目录中生成若干篇合成的 Markdown 文献，写入 search_service 的索引后，
+测量典型查询（中文片段、英文单词前缀、多词组合）的耗时，并与逐个读取文件做子串匹配的方式对比。
+
+用法:
+    python benchmarks/bench_search.py --documents 3000 --doc-kb 20 --repeat 20
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import search_service  # noqa: E402
+
+VOCABULARY = ["数字化转型", "企业创新", "绩效", "面板数据", "双重差分", "异质性", "融资约束", "政府补贴",
+              "机制检验", "稳健性", "instrumental variable", "regression", "heterogeneity", "panel data",
+              "研发投入", "专利产出", "高管激励", "环境规制", "绿色创新", "供应链"]
+QUERIES = ["数字化转型", "融资约束 绿色创新", "regress", "双重差分 heterogeneity", "专利", "不存在的词语"]
+
+
+def make_document(rng: random.Random, size_bytes: int) -> str:
+    words, total = [], 0
+    while total < size_bytes:
+        word = rng.choice(VOCABULARY)
+        words.append(word + rng.choice(["，", "。", " ", "的", "对"]))
+        total += len(words[-1].encode("utf-8"))
+    return "".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=3000, help="合成文献的数量")
+    parser.add_argument("--doc-kb", type=int, default=20, help="每篇文献的大小（KB）")
+    parser.add_argument("--repeat", type=int, default=20, help="每个查询的重复次数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        search_service.SEARCH_DIR = tmp_dir / "search"
+        search_service.SEARCH_DB_PATH = search_service.SEARCH_DIR / "index.sqlite3"
+        source_dir = tmp_dir / "markdowns"
+        source_dir.mkdir()
+
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for i in range(args.documents):
+            content = make_document(rng, args.doc_kb * 1024)
+            (source_dir / f"doc_{i}.md").write_text(content, encoding="utf-8")
+            with search_service._lock:
+                search_service._apply(search_service.KIND_MARKDOWN, f"doc_{i}", content)
+        elapsed = time.perf_counter() - start
+        print(f"建立索引: {args.documents} 篇 x {args.doc_kb}KB，耗时 {elapsed:.1f}s "
+              f"({elapsed / args.documents * 1000:.2f}ms/篇)")
+
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results = search_service.search(query, limit=20)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+
+            start = time.perf_counter()
+            terms = [term.lower() for term in query.split()]
+            grep_hits = sum(1 for path in source_dir.glob("*.md")
+                            if all(term in path.read_text(encoding="utf-8").lower() for term in terms))
+            grep_elapsed = time.perf_counter() - start
+
+            print(f"{query!r:28} 结果 {len(results):3d}  中位数 {statistics.median(timings) * 1000:7.2f}ms  "
+                  f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:7.2f}ms  "
+                  f"逐个读取文件 {grep_elapsed * 1000:8.1f}ms（{grep_hits} 篇命中）")
+
+
+if __name__ == "__main__":
+    main()
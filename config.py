@@ -33,4 +33,181 @@ PAPER_STRUCTURE = [
 ]
 
 # 为了方便在后端快速按key查找，创建一个字典映射版本
-PAPER_STRUCTURE_MAP = {section['key']: section for section in PAPER_STRUCTURE}
\ No newline at end of file
+PAPER_STRUCTURE_MAP = {section['key']: section for section in PAPER_STRUCTURE}
+
+# 服务端批量处理（单篇文献分析）的配置。
+# - BATCH_MAX_WORKERS: 后台线程池大小，即同时处理的文献数量上限。
+BATCH_MAX_WORKERS = 4
+
+# 已上传PDF文件句柄的保留时间（秒）。
+# 同一文件（按内容哈希识别）的多次分析会复用同一个远端句柄；
+# 所有分析完成后，句柄会在空闲超过该时长后被删除，期间的重试或重新分析无需再次上传。
+PDF_UPLOAD_TTL_SECONDS = 600
+
+# 单篇文献分析前的本地 PDF 预处理（需要安装 pypdf，未安装或解析失败时上传完整 PDF）。
+# 本地提取每页的文字并检测页面是否包含表格、插图或公式：纯文字页面直接以文本发送给模型，
+# 只有复杂页面（以及提取不到文字的扫描页）组成精简的 PDF 上传，减少上传量和模型输入成本。
+# - PDF_HYBRID_ENABLED: 是否启用本地预处理。
+# - PDF_HYBRID_MAX_COMPLEX_RATIO: 复杂页面占比超过该值时直接上传完整 PDF（拆分的收益很小）。
+# - PDF_MIN_TEXT_CHARS: 提取到的文字少于该字符数的页面视为扫描页。
+# - PDF_MIN_IMAGE_PIXELS: 像素数不低于该值的图片才视为插图（忽略 Logo、图标等小图）。
+# - PDF_FIGURE_PATH_OPERATORS: 绘图路径操作（线段、曲线、矩形）不少于该数量的页面视为包含矢量图。
+# - PDF_MATH_CHARS: 使用数学字体排版的字符不少于该数量的页面视为包含公式（少量行内符号不计）。
+PDF_HYBRID_ENABLED = True
+PDF_HYBRID_MAX_COMPLEX_RATIO = 0.6
+PDF_MIN_TEXT_CHARS = 200
+PDF_MIN_IMAGE_PIXELS = 100000
+PDF_FIGURE_PATH_OPERATORS = 200
+PDF_MATH_CHARS = 120
+
+# 长文献（如学位论文、会议论文集）的分段 Markdown 转换（需要安装 pypdf）。
+# 页数不少于 PDF_CHUNK_MIN_PAGES 的 PDF 按页码范围拆分为多个片段并行转换，再按顺序拼接为完整的 Markdown，
+# 避免单次调用超出输出 token 上限或耗时过长。拼接时统一标题层级并移除重复的页眉页脚。
+# 每个片段的转换结果保存在 result/markdown_chunks/ 中，失败后重试只需重新转换失败的片段。
+# - PDF_CHUNK_MIN_PAGES: 启用分段转换的最少页数。
+# - PDF_CHUNK_PAGES: 每个片段的页数。
+# - PDF_CHUNK_MAX_WORKERS: 同一篇文献同时转换的片段数。
+PDF_CHUNK_MIN_PAGES = 40
+PDF_CHUNK_PAGES = 15
+PDF_CHUNK_MAX_WORKERS = 4
+
+# genai.Client 连接池的空闲回收时间（秒）。
+# 每个 API Key 复用同一个客户端以保持长连接；超过该时长未被使用的客户端会被关闭并移出连接池。
+CLIENT_POOL_IDLE_SECONDS = 300
+
+# Gemini 显式上下文缓存（Context Caching）的配置。
+# 多次调用共享的大段稳定资料（如所有文献分析、论文的依赖章节）会在远端创建缓存，之后的调用只发送其余部分。
+# - CONTEXT_CACHE_ENABLED: 是否启用上下文缓存。
+# - CONTEXT_CACHE_MIN_TOKENS: 估算 token 数不低于该值的资料才会被缓存（Gemini 对缓存内容有最小 token 数要求，且资料过短时收益很小）。
+# - CONTEXT_CACHE_TTL_SECONDS: 远端缓存的有效期；剩余有效期不足一半时，下一次使用会将其延长。
+CONTEXT_CACHE_ENABLED = True
+CONTEXT_CACHE_MIN_TOKENS = 4096
+CONTEXT_CACHE_TTL_SECONDS = 600
+
+# LLM 响应缓存（磁盘持久化，位于 result/cache/）的配置。
+# 缓存键由模型、temperature、提示词内容（以及PDF文件内容哈希）共同决定。
+# - LLM_CACHE_ENABLED: 是否启用响应缓存；单次请求也可通过 `use_cache: false` 跳过缓存。
+# - LLM_CACHE_MAX_TEMPERATURE: 仅缓存 temperature 不高于该值的调用，高温度调用通常期望每次得到不同结果。
+# - LLM_CACHE_MAX_BYTES: 缓存总大小上限，超出后按最近最少使用（LRU）顺序淘汰。
+LLM_CACHE_ENABLED = True
+LLM_CACHE_MAX_TEMPERATURE = 0.5
+LLM_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# 后台任务队列的配置。
+# 任务状态持久化在 result/jobs/ 下的 SQLite 数据库中，服务重启后仍可查询历史任务。
+# - JOB_MAX_WORKERS: 通用任务（综合分析、头脑风暴、章节生成等）的后台线程数。
+#   单篇文献处理任务使用独立的线程池，大小由 BATCH_MAX_WORKERS 决定。
+JOB_MAX_WORKERS = 4
+
+# 综合文献分析的分层（map-reduce）模式配置。
+# 文献过多时，先将分析报告分批并行做阶段性综合（map），再逐级合并为最终综述（reduce）。
+# - COMPREHENSIVE_DEFAULT_MODE: 'single'（单次调用）、'hierarchical'（分层）或 'auto'（按内容长度自动选择）。
+# - COMPREHENSIVE_SINGLE_PASS_MAX_CHARS: 'auto' 模式下，合并文本超过该字符数时改用分层模式。
+# - COMPREHENSIVE_MAP_BATCH_SIZE: 每批文献的平均数量；批次边界由文献名决定，新增文献只影响其所在批次。
+# - COMPREHENSIVE_MAP_MAX_WORKERS: 并行执行阶段性综合的线程数。
+# - COMPREHENSIVE_REDUCE_FAN_IN: 每次合并的阶段性报告数量上限，超出时逐级合并。
+COMPREHENSIVE_DEFAULT_MODE = "auto"
+COMPREHENSIVE_SINGLE_PASS_MAX_CHARS = 300000
+COMPREHENSIVE_MAP_BATCH_SIZE = 8
+COMPREHENSIVE_MAP_MAX_WORKERS = 4
+COMPREHENSIVE_REDUCE_FAN_IN = 6
+
+# 每个模型可用于输入资料（如头脑风暴所依据的文献分析）的 token 预算。
+# 预算低于模型的上下文窗口上限，为提示词中的指令部分和模型输出预留空间。
+# 不在此列表中的模型使用 DEFAULT_CONTEXT_BUDGET。
+MODEL_CONTEXT_BUDGETS = {
+    "gemini-2.5-pro": 900000,
+    "gemini-2.5-flash-preview-09-2025": 900000,
+    "gemini-2.5-flash": 900000,
+}
+DEFAULT_CONTEXT_BUDGET = 100000
+
+# Gemini 调用治理（限流、重试、熔断）的配置，作用于所有模型调用。
+# - GOVERNOR_RATE_LIMIT_PER_MINUTE: 每个 (API Key, 模型) 每分钟允许发起的调用次数，应与服务商的配额一致。
+# - GOVERNOR_MODEL_RATE_LIMITS: 按模型覆盖上述速率，例如 {"gemini-2.5-pro": 5}。
+# - GOVERNOR_BURST: 空闲后允许连续发起的调用次数（令牌桶容量）。
+# - GOVERNOR_MAX_RETRIES: 遇到 429、5xx 或网络错误时的最大重试次数。
+# - GOVERNOR_BACKOFF_BASE_SECONDS / GOVERNOR_BACKOFF_MAX_SECONDS: 指数退避的初始上限与最大上限，
+#   实际等待时间在该上限内随机选取，避免并发调用同时重试。
+# - GOVERNOR_BREAKER_FAILURE_THRESHOLD: 连续失败多少次后熔断。
+# - GOVERNOR_BREAKER_COOLDOWN_SECONDS: 熔断后的冷却时间，期间的调用立即失败。
+GOVERNOR_RATE_LIMIT_PER_MINUTE = 30
+GOVERNOR_MODEL_RATE_LIMITS = {}
+GOVERNOR_BURST = 5
+GOVERNOR_MAX_RETRIES = 4
+GOVERNOR_BACKOFF_BASE_SECONDS = 2
+GOVERNOR_BACKOFF_MAX_SECONDS = 60
+GOVERNOR_BREAKER_FAILURE_THRESHOLD = 5
+GOVERNOR_BREAKER_COOLDOWN_SECONDS = 60
+
+# 论文修订历史的配置。每篇论文的修订记录保存在 result/paper_writing/revisions/ 下的只追加日志中。
+# - REVISION_SNAPSHOT_INTERVAL: 每个章节每隔多少条修订保存一次完整快照，其余修订只保存差异；
+#   恢复任一版本最多只需回放这么多条差异。
+# - REVISION_MAX_PER_SECTION: 每个章节保留的修订数量，超出后压缩日志并丢弃最早的修订。
+REVISION_SNAPSHOT_INTERVAL = 20
+REVISION_MAX_PER_SECTION = 200
+
+# 论文文档缓存（写回式）的配置。
+# - PAPER_CACHE_MAX_ENTRIES: 内存中缓存的论文数量上限，超出后按最近最少使用的顺序淘汰（未写回的先写入磁盘）。
+# - PAPER_FLUSH_DELAY_SECONDS: 保存后延迟多少秒写回磁盘，期间的多次保存只写一次；进程正常退出时会立即写回。
+PAPER_CACHE_MAX_ENTRIES = 32
+PAPER_FLUSH_DELAY_SECONDS = 2
+
+# 论文导出的配置。
+# - EXPORT_CACHE_MAX_BYTES: result/exports/ 中渲染结果缓存的总大小上限，超出后删除最久未使用的文件。
+# - EXPORT_CHUNK_SIZE: 流式导出时每次读取和输出的字节数。
+EXPORT_CACHE_MAX_BYTES = 100 * 1024 * 1024
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# 检查 prompts/prompts.json 是否被修改的最小间隔（秒）。文件修改后无需重启，新提示词会在下一次检查时生效。
+PROMPT_RELOAD_CHECK_SECONDS = 1
+
+# 整篇论文草稿生成的并发数：依赖已满足的章节最多同时生成多少个。
+DRAFT_MAX_WORKERS = 4
+
+# 全文检索索引（result/search/ 下的 SQLite FTS5 数据库）的配置。
+# 文献的 Markdown 转换结果、单篇分析和论文各章节在保存时增量更新索引；启动时会补录在服务之外新增、修改或删除的文件。
+# - SEARCH_INDEX_ENABLED: 是否启用全文检索索引。
+# - SEARCH_DEFAULT_LIMIT / SEARCH_MAX_LIMIT: 搜索接口默认返回和最多返回的结果数。
+# - SEARCH_SNIPPET_CHARS: 每条结果摘要的长度（字符数）。
+SEARCH_INDEX_ENABLED = True
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_SNIPPET_CHARS = 120
+
+# 日志与监控指标的配置。指标由 /metrics 接口以 Prometheus 文本格式输出。
+# - LOG_LEVEL: 日志级别（DEBUG / INFO / WARNING / ERROR）。
+# - LOG_SAMPLE_RATE: 每次模型调用都会产生的常规日志（开始生成、命中缓存、调用耗时等）的输出比例（0~1），
+#   批量分析时可调低以免刷屏；警告和错误总是输出，指标不受采样影响。
+# - METRICS_LATENCY_BUCKETS: 耗时直方图的桶边界（秒）。
+# - METRICS_SIZE_BUCKETS: 提示词和响应长度直方图的桶边界（字符数）。
+LOG_LEVEL = "INFO"
+LOG_SAMPLE_RATE = 1.0
+METRICS_LATENCY_BUCKETS = [0.005, 0.025, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+METRICS_SIZE_BUCKETS = [1000, 4000, 16000, 64000, 256000, 1000000, 4000000]
+
+# 请求性能剖析的配置。剖析结果（火焰图数据和各阶段耗时）保存在 result/profiles/。
+# - PROFILE_HEADER_ENABLED: 是否允许通过请求头 "X-Profile: 1" 剖析单个请求。
+# - PROFILE_ROUTES: 总是剖析的路由（Flask 路由规则），例如 ["/api/paper/generate"]。
+# - PROFILE_SAMPLE_INTERVAL_MS: 采样间隔（毫秒）。
+# - PROFILE_MAX_REPORTS: 最多保留的剖析报告数量，超出后删除最早的。
+PROFILE_HEADER_ENABLED = True
+PROFILE_ROUTES = []
+PROFILE_SAMPLE_INTERVAL_MS = 5
+PROFILE_MAX_REPORTS = 50
+
+# 模型后端的配置（见 services/backend_service.py）。
+# - LLM_BACKEND: "genai"（调用 Google Gemini API）、"stub"（本地模拟，不需要网络，API Key 可填任意值）、
+#   "record"（调用 Gemini API 并把响应录制到 result/llm_recordings/）、"replay"（只回放录制的响应，不需要网络）。
+# - LLM_STUB_LATENCY_SECONDS: 模拟的首个 token 延迟（秒）。
+# - LLM_STUB_TOKENS_PER_SECOND: 模拟的输出速度（token/秒）。
+# - LLM_STUB_OUTPUT_TOKENS: 每次模拟响应的 token 数。
+# - LLM_STUB_ERROR_RATE / LLM_STUB_RATE_LIMIT_RATE: 模拟调用返回 503 / 429 错误的比例（0~1），两者都会触发调用治理的重试。
+# - LLM_STUB_SEED: 模拟错误的随机数种子，相同的种子和调用顺序产生相同的错误；响应内容只由请求内容决定。
+LLM_BACKEND = "genai"
+LLM_STUB_LATENCY_SECONDS = 0.5
+LLM_STUB_TOKENS_PER_SECOND = 200
+LLM_STUB_OUTPUT_TOKENS = 400
+LLM_STUB_ERROR_RATE = 0.0
+LLM_STUB_RATE_LIMIT_RATE = 0.0
+LLM_STUB_SEED = 0
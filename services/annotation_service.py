@@ -0,0 +1,107 @@
+# services/annotation_service.py
+"""
+论文批注解析服务。
+
+编辑器中的批注语法为 `{{被批注的原文}}【修改意见：意见内容】`。
+这里用单遍扫描代替 `{{([\s\S]+?)}}【修改意见：[\s\S]+?】` 这样的惰性正则：
+正则在遇到没有闭合的 `{{` 或缺少 `】` 的意见时，会从每个起点向后搜索到文本末尾，
+在大量批注的长文档上退化为平方时间；扫描器只从左到右前进一次，耗时与文本长度成线性关系。
+
+解析规则：
+- `{{` 入栈，`}}【修改意见：` 与最近一个未闭合的 `{{` 配对，意见内容延伸到其后第一个 `】`；
+  因此嵌套的批注（原文中包含另一条批注）会被逐层还原。
+- 意见内容中的 `{{`、`}}` 不参与配对。
+- 没有配对的 `{{`、没有对应 `{{` 的 `}}【修改意见：`、以及缺少 `】` 的意见均保留为普通文本。
+"""
+import re
+
+OPEN_MARK = "{{"
+CLOSE_MARK = "}}【修改意见："
+COMMENT_END = "】"
+
+_MARKER_PATTERN = re.compile(re.escape(OPEN_MARK) + "|" + re.escape(CLOSE_MARK))
+
+
+def _scan_spans(text: str) -> list:
+    """单遍扫描，返回 (起点, 原文起点, 原文终点, 终点, 嵌套层数) 元组列表（按闭合顺序）。"""
+    spans = []
+    open_positions = []
+    has_comment_end = True  # 一旦找不到 】，之后也不会再找到，无需重复搜索
+    pos = 0
+    search = _MARKER_PATTERN.search
+    while True:
+        match = search(text, pos)
+        if match is None:
+            break
+        if match.group() == OPEN_MARK:
+            open_positions.append(match.start())
+            pos = match.end()
+            continue
+
+        comment_end = text.find(COMMENT_END, match.end()) if has_comment_end else -1
+        if comment_end < 0:
+            has_comment_end = False
+            pos = match.end()
+            continue
+        pos = comment_end + len(COMMENT_END)
+        if not open_positions:
+            # 孤立的意见标记：跳过整条意见，其中的内容不参与配对
+            continue
+        start = open_positions.pop()
+        spans.append((start, start + len(OPEN_MARK), match.start(), pos, len(open_positions)))
+    return spans
+
+
+def scan(text: str) -> list:
+    """
+    扫描文本中的所有批注，按起始位置排序返回。
+
+    Returns:
+        list: 每条批注为 {"start", "end", "original_start", "original_end", "comment", "depth"}，
+            start/end 为整条批注（含标记）在文本中的范围，original_start/original_end 为原文的范围，
+            depth 为嵌套层数（最外层为 0）。位置按 Unicode 字符计算。
+    """
+    return [{"start": start, "end": end, "original_start": original_start, "original_end": original_end,
+             "comment": text[original_end + len(CLOSE_MARK):end - len(COMMENT_END)], "depth": depth}
+            for start, original_start, original_end, end, depth in sorted(_scan_spans(text))]
+
+
+def strip(text: str) -> str:
+    """移除批注标记和意见，只保留原文（嵌套的批注会被全部移除）。"""
+    spans = _scan_spans(text)
+    if not spans:
+        return text
+    # 每条批注移除两段：开头的 {{，以及从 }} 到 】 的意见部分；这些片段互不重叠
+    removals = [(start, original_start) for start, original_start, _, _, _ in spans]
+    removals += [(original_end, end) for _, _, original_end, end, _ in spans]
+    removals.sort()
+    parts, cursor = [], 0
+    for start, end in removals:
+        parts.append(text[cursor:start])
+        cursor = end
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+
+def summarize(paper_data: dict, section_keys: list) -> dict:
+    """
+    统计论文各章节中的批注，供编辑器显示。
+
+    Returns:
+        dict: {"total": 批注总数, "sections": {章节key: {"count", "annotations": [
+            {"start", "end", "original", "comment", "depth"}, ...]}}}，没有批注的章节不出现。
+    """
+    sections, total = {}, 0
+    for key in section_keys:
+        content = (paper_data.get(key) or {}).get('content', '')
+        annotations = scan(content) if OPEN_MARK in content else []
+        if not annotations:
+            continue
+        sections[key] = {
+            "count": len(annotations),
+            "annotations": [{"start": a["start"], "end": a["end"],
+                             "original": content[a["original_start"]:a["original_end"]],
+                             "comment": a["comment"], "depth": a["depth"]} for a in annotations],
+        }
+        total += len(annotations)
+    return {"total": total, "sections": sections}
@@ -0,0 +1,313 @@
+# services/backend_service.py
+"""
+模型后端服务：决定 llm_service 连接池中的客户端由谁提供（见 config.LLM_BACKEND）。
+
+- genai: google-genai 的 genai.Client，调用 Google Gemini API；
+- stub: 本地模拟客户端，不需要网络和有效的 API Key。响应内容由请求内容决定（相同请求总是得到相同的文本），
+  首个 token 延迟、输出速度、响应长度以及 503 / 429 错误的比例可配置，用于压力测试和离线开发；
+- record: 调用 Gemini API，同时把每次生成的响应录制到 result/llm_recordings/；
+- replay: 只回放录制的响应，没有对应录制时报错。
+
+所有客户端都提供 llm_service 用到的 genai.Client 接口：models.generate_content / generate_content_stream、
+files.upload / delete、caches.create / update / delete、chats.create 和 close。
+录制按 (模型, 请求内容, temperature, 上下文缓存内容) 索引；请求中的文件句柄和上下文缓存按其内容的哈希计入，
+因此重新上传文件或重建缓存后仍能找到对应的录制。
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+
+from google import genai
+from google.genai import errors, types
+
+from config import (LLM_BACKEND, LLM_STUB_LATENCY_SECONDS, LLM_STUB_TOKENS_PER_SECOND, LLM_STUB_OUTPUT_TOKENS,
+                    LLM_STUB_ERROR_RATE, LLM_STUB_RATE_LIMIT_RATE, LLM_STUB_SEED)
+from services import context_service, file_service
+
+BACKENDS = ("genai", "stub", "record", "replay")
+RECORDINGS_DIR = file_service.RESULT_DIR / "llm_recordings"
+
+# 流式输出时每个片段包含的 token 数
+_STUB_CHUNK_TOKENS = 20
+_STUB_WORDS = ["research", "model", "data", "method", "result", "analysis", "effect", "sample", "evidence",
+               "framework", "研究", "模型", "数据", "方法", "结果", "分析", "机制", "样本", "证据", "框架"]
+
+# 文件句柄 / 上下文缓存的名称 -> 内容哈希，用于计算录制的索引键（客户端被连接池回收重建后仍然有效）
+_content_digests = {}
+_content_digests_lock = threading.Lock()
+
+# 模拟错误使用同一个随机序列，相同种子和相同的调用顺序产生相同的错误
+_stub_random = random.Random(LLM_STUB_SEED)
+_stub_random_lock = threading.Lock()
+
+
+def create_client(api_key: str):
+    """按 LLM_BACKEND 创建一个客户端。"""
+    if LLM_BACKEND == "genai":
+        return genai.Client(api_key=api_key)
+    if LLM_BACKEND == "stub":
+        return _StubClient()
+    if LLM_BACKEND == "record":
+        return _RecordingClient(genai.Client(api_key=api_key))
+    if LLM_BACKEND == "replay":
+        return _ReplayClient()
+    raise ValueError(f"未知的模型后端: {LLM_BACKEND}，可选值为 {', '.join(BACKENDS)}。")
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _remember_digest(name: str, digest: str):
+    with _content_digests_lock:
+        _content_digests[name] = digest
+
+
+def _normalize_contents(contents) -> list:
+    """将请求内容转换为可哈希的形式：文本保持不变，文件句柄替换为文件内容的哈希。"""
+    if not isinstance(contents, list):
+        contents = [contents]
+    normalized = []
+    for part in contents:
+        if isinstance(part, str):
+            normalized.append(part)
+        else:
+            name = getattr(part, "name", None)
+            with _content_digests_lock:
+                normalized.append({"file": _content_digests.get(name, name)})
+    return normalized
+
+
+def _request_key(model: str, contents, config) -> str:
+    cached_content = getattr(config, "cached_content", None)
+    with _content_digests_lock:
+        cache_digest = _content_digests.get(cached_content, cached_content)
+    return _digest([model, _normalize_contents(contents), getattr(config, "temperature", None), cache_digest])
+
+
+def _file_digest(file) -> str:
+    with open(file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class _Chat:
+    """stub / replay 后端的多轮对话：每条消息单独生成，不保留历史。"""
+
+    def __init__(self, models, model: str):
+        self._models, self._model = models, model
+
+    def send_message(self, message):
+        return self._models.generate_content(model=self._model, contents=[message])
+
+
+class _Chats:
+    def __init__(self, models):
+        self._models = models
+
+    def create(self, model: str, **kwargs):
+        return _Chat(self._models, model)
+
+
+class _LocalFiles:
+    """stub / replay 后端的文件接口：不上传，句柄名称由文件内容的哈希决定。"""
+
+    def __init__(self, prefix: str):
+        self._prefix = prefix
+
+    def upload(self, file, **kwargs):
+        digest = _file_digest(file)
+        name = f"files/{self._prefix}-{digest[:16]}"
+        _remember_digest(name, digest)
+        return types.File(name=name, mime_type="application/pdf")
+
+    def delete(self, name: str, **kwargs):
+        pass
+
+
+class _LocalCaches:
+    """stub / replay 后端的上下文缓存接口：只记录缓存内容的哈希。"""
+
+    def __init__(self, prefix: str):
+        self._prefix = prefix
+
+    def create(self, model: str, config, **kwargs):
+        digest = _digest(_normalize_contents(config.contents))
+        name = f"cachedContents/{self._prefix}-{digest[:16]}"
+        _remember_digest(name, digest)
+        return types.CachedContent(name=name, model=model)
+
+    def update(self, name: str, **kwargs):
+        return types.CachedContent(name=name)
+
+    def delete(self, name: str, **kwargs):
+        pass
+
+
+class _StubModels:
+    def _maybe_fail(self):
+        with _stub_random_lock:
+            roll = _stub_random.random()
+        if roll < LLM_STUB_RATE_LIMIT_RATE:
+            raise errors.ClientError(429, {"error": {"code": 429, "message": "模拟的限流错误",
+                                                     "status": "RESOURCE_EXHAUSTED"}})
+        if roll < LLM_STUB_RATE_LIMIT_RATE + LLM_STUB_ERROR_RATE:
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "模拟的服务端错误",
+                                                     "status": "UNAVAILABLE"}})
+
+    def _words(self, model: str, contents, config) -> list:
+        rng = random.Random(_request_key(model, contents, config))
+        return [rng.choice(_STUB_WORDS) for _ in range(LLM_STUB_OUTPUT_TOKENS)]
+
+    def _usage(self, contents, config, output_tokens: int):
+        prompt_tokens = sum(context_service.estimate_tokens(part) for part in _normalize_contents(contents)
+                            if isinstance(part, str))
+        return types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+
+    def generate_content(self, model: str, contents, config=None, **kwargs):
+        self._maybe_fail()
+        words = self._words(model, contents, config)
+        time.sleep(LLM_STUB_LATENCY_SECONDS + len(words) / LLM_STUB_TOKENS_PER_SECOND)
+        return _response(f"[stub {model}] " + " ".join(words), self._usage(contents, config, len(words)))
+
+    def generate_content_stream(self, model: str, contents, config=None, **kwargs):
+        self._maybe_fail()
+        words = self._words(model, contents, config)
+        time.sleep(LLM_STUB_LATENCY_SECONDS)
+        yield _response(f"[stub {model}] ")
+        for start in range(0, len(words), _STUB_CHUNK_TOKENS):
+            chunk = words[start:start + _STUB_CHUNK_TOKENS]
+            time.sleep(len(chunk) / LLM_STUB_TOKENS_PER_SECOND)
+            usage = self._usage(contents, config, len(words)) if start + _STUB_CHUNK_TOKENS >= len(words) else None
+            yield _response(" ".join(chunk) + " ", usage)
+
+
+def _response(text: str, usage=None):
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+        usage_metadata=usage,
+    )
+
+
+class _StubClient:
+    def __init__(self):
+        self.models = _StubModels()
+        self.files = _LocalFiles("stub")
+        self.caches = _LocalCaches("stub")
+        self.chats = _Chats(self.models)
+
+    def close(self):
+        pass
+
+
+def _recording_path(key: str):
+    return RECORDINGS_DIR / key[:2] / f"{key}.json"
+
+
+def _save_recording(key: str, model: str, responses: list, stream: bool):
+    path = _recording_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    record = {"model": model, "stream": stream,
+              "responses": [response.model_dump(mode="json", exclude_none=True) for response in responses]}
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    tmp_path.replace(path)
+
+
+class _RecordingModels:
+    def __init__(self, models):
+        self._models = models
+
+    def generate_content(self, model: str, contents, config=None, **kwargs):
+        response = self._models.generate_content(model=model, contents=contents, config=config, **kwargs)
+        _save_recording(_request_key(model, contents, config), model, [response], stream=False)
+        return response
+
+    def generate_content_stream(self, model: str, contents, config=None, **kwargs):
+        chunks = []
+        for chunk in self._models.generate_content_stream(model=model, contents=contents, config=config, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        # 只录制完整结束的流
+        _save_recording(_request_key(model, contents, config), model, chunks, stream=True)
+
+
+class _RecordingFiles:
+    def __init__(self, files):
+        self._files = files
+
+    def upload(self, file, **kwargs):
+        handle = self._files.upload(file=file, **kwargs)
+        _remember_digest(handle.name, _file_digest(file))
+        return handle
+
+    def delete(self, name: str, **kwargs):
+        return self._files.delete(name=name, **kwargs)
+
+
+class _RecordingCaches:
+    def __init__(self, caches):
+        self._caches = caches
+
+    def create(self, model: str, config, **kwargs):
+        cached = self._caches.create(model=model, config=config, **kwargs)
+        _remember_digest(cached.name, _digest(_normalize_contents(config.contents)))
+        return cached
+
+    def update(self, name: str, **kwargs):
+        return self._caches.update(name=name, **kwargs)
+
+    def delete(self, name: str, **kwargs):
+        return self._caches.delete(name=name, **kwargs)
+
+
+class _RecordingClient:
+    def __init__(self, client):
+        self._client = client
+        self.models = _RecordingModels(client.models)
+        self.files = _RecordingFiles(client.files)
+        self.caches = _RecordingCaches(client.caches)
+        self.chats = client.chats
+
+    def close(self):
+        self._client.close()
+
+
+class _ReplayModels:
+    def _load(self, model: str, contents, config) -> list:
+        key = _request_key(model, contents, config)
+        try:
+            with open(_recording_path(key), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"没有与该请求对应的录制响应（模型 '{model}'，索引 {key[:16]}），"
+                                    f"请先在 record 模式下运行一次。")
+        return [types.GenerateContentResponse.model_validate(response) for response in record["responses"]]
+
+    def generate_content(self, model: str, contents, config=None, **kwargs):
+        responses = self._load(model, contents, config)
+        if len(responses) == 1:
+            return responses[0]
+        # 录制的是流式响应：合并为一个完整响应
+        text = "".join(response.text or "" for response in responses)
+        return _response(text, responses[-1].usage_metadata)
+
+    def generate_content_stream(self, model: str, contents, config=None, **kwargs):
+        yield from self._load(model, contents, config)
+
+
+class _ReplayClient:
+    def __init__(self):
+        self.models = _ReplayModels()
+        self.files = _LocalFiles("replay")
+        self.caches = _LocalCaches("replay")
+        self.chats = _Chats(self.models)
+
+    def close(self):
+        pass
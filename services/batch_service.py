@@ -0,0 +1,104 @@
+# services/batch_service.py
+"""
+单篇文献分析的服务端批量处理服务。
+
+浏览器只需提交一次待处理的文件列表，每个文件作为一个后台任务（见 job_service）
+在有界线程池中并发执行 Markdown 转换与分析报告生成，进度可供前端轮询。
+"""
+import uuid
+from pathlib import Path
+
+from services import chunk_service, file_service, llm_service, job_service, pdf_service
+from services.prompt_service import PromptRegistry
+
+
+def process_paper(filename: str, prompts: PromptRegistry, model: str, temperature_markdown: float,
+                  temperature_analysis: float, api_key: str, use_cache: bool = True, report_progress=None):
+    """
+    处理单个PDF文件：生成 Markdown 原文和分析报告，已存在的结果会被跳过。
+    文件只上传一次，模型调用的限流与重试由 governor_service 统一处理。
+    页数较多的长文献按页码范围分段并行转换 Markdown（见 chunk_service），分析报告仍基于完整文件生成。
+
+    Args:
+        prompts (PromptRegistry): 提示词注册表（见 prompt_service），使用 single_analysis_markdown
+            和 single_analysis_report。
+    """
+    file_stem = Path(filename).stem
+    file_path = file_service.PAPERS_DIR / filename
+    if not file_path.exists():
+        raise FileNotFoundError(f"文件 {filename} 未在服务器上找到。")
+
+    # 只为尚未生成的结果安排分析，两轮分析共享同一次文件上传并行执行
+    pending = []
+    convert_in_chunks = False
+    if not (file_service.MARKDOWNS_DIR / f"{file_stem}.md").exists():
+        page_count = pdf_service.get_page_count(file_path)
+        if chunk_service.should_chunk(page_count):
+            convert_in_chunks = True
+        else:
+            pending.append((file_service.save_markdown_result,
+                            (prompts['single_analysis_markdown'], temperature_markdown)))
+    if not (file_service.ANALYSES_DIR / f"{file_stem}.md").exists():
+        pending.append((file_service.save_analysis_result,
+                        (prompts['single_analysis_report'], temperature_analysis)))
+
+    if pending:
+        results = llm_service.analyze_pdf_passes(file_path, [p for _, p in pending], model, api_key,
+                                                 use_cache=use_cache)
+        for (save_func, _), content in zip(pending, results):
+            save_func(file_stem, content)
+    if convert_in_chunks:
+        content = chunk_service.convert_markdown(file_path, prompts, model, temperature_markdown, api_key,
+                                                 use_cache=use_cache, page_count=page_count,
+                                                 report_progress=report_progress)
+        file_service.save_markdown_result(file_stem, content)
+
+
+def start_batch(filenames: list, params: dict, api_key: str) -> str:
+    """
+    为每个文件提交一个 `single_paper` 后台任务，这些任务共享同一个 batch_id 作为分组，立即返回 batch_id。
+
+    Args:
+        filenames (list): 待处理的PDF文件名列表。
+        params (dict): 所有文件共享的处理参数（model、temperature_markdown、temperature_analysis、use_cache）。
+        api_key (str): Google API Key，仅保存在内存中。
+    """
+    batch_id = uuid.uuid4().hex
+    for filename in filenames:
+        job_service.submit("single_paper", {**params, "filename": filename}, api_key, group_id=batch_id)
+    return batch_id
+
+
+# 后台任务状态到批处理文件状态的映射
+_STATUS_MAP = {
+    job_service.QUEUED: "pending",
+    job_service.RUNNING: "processing",
+    job_service.SUCCEEDED: "processed",
+    job_service.FAILED: "failed",
+    job_service.INTERRUPTED: "failed",
+}
+
+
+def get_batch_status(batch_id: str):
+    """
+    返回批处理任务的进度快照；batch_id 不存在时返回 None。
+    """
+    jobs = job_service.list_group(batch_id)
+    if not jobs:
+        return None
+    files = [{
+        "filename": job["params"]["filename"],
+        "job_id": job["id"],
+        "status": _STATUS_MAP[job["status"]],
+        "message": job["error"] or "",
+    } for job in jobs]
+
+    counts = {"pending": 0, "processing": 0, "processed": 0, "failed": 0}
+    for info in files:
+        counts[info["status"]] += 1
+    return {
+        "batch_id": batch_id,
+        "files": files,
+        "counts": counts,
+        "done": counts["pending"] == 0 and counts["processing"] == 0,
+    }
@@ -0,0 +1,112 @@
+# services/cache_service.py
+"""
+LLM 响应缓存服务。
+
+以内容寻址的方式将模型响应持久化到 SQLite 数据库中：相同的模型、temperature、
+提示词（以及PDF文件内容）总会得到相同的缓存键，重复调用可直接返回已有结果。
+缓存总大小超出上限时，按最近最少使用（LRU）顺序淘汰旧条目。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_TEMPERATURE
+from services.file_service import RESULT_DIR
+
+CACHE_DIR = RESULT_DIR / "cache"
+CACHE_DB_PATH = CACHE_DIR / "llm_responses.sqlite3"
+
+_conn = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+
+def _get_conn():
+    """延迟打开数据库连接（调用方需持有 _lock）。"""
+    global _conn
+    if _conn is None:
+        CACHE_DIR.mkdir(exist_ok=True)
+        _conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        _conn.commit()
+    return _conn
+
+
+def is_cacheable(temperature: float, use_cache: bool = True) -> bool:
+    """判断一次调用是否应当使用缓存。"""
+    return LLM_CACHE_ENABLED and use_cache and temperature <= LLM_CACHE_MAX_TEMPERATURE
+
+
+def make_key(model_name: str, temperature: float, contents: list, file_hash: str = None) -> str:
+    """根据模型、temperature、提示词内容和可选的文件哈希计算缓存键。"""
+    payload = json.dumps({
+        "model": model_name,
+        "temperature": temperature,
+        "contents": contents,
+        "file": file_hash,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str):
+    """读取缓存的响应，未命中时返回 None。命中的条目会刷新其最近访问时间。"""
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        _stats["hits"] += 1
+        return row[0]
+
+
+def put(key: str, response: str):
+    """写入一条缓存，并在总大小超出上限时淘汰最久未使用的条目。"""
+    size = len(response.encode("utf-8"))
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, response, size, now, now),
+        )
+        _stats["writes"] += 1
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > LLM_CACHE_MAX_BYTES:
+            for old_key, old_size in conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+                if total <= LLM_CACHE_MAX_BYTES:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                total -= old_size
+                _stats["evictions"] += 1
+        conn.commit()
+
+
+def get_stats() -> dict:
+    """返回缓存命中/未命中计数以及当前的条目数和总大小。"""
+    with _lock:
+        conn = _get_conn()
+        entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {**_stats, "entries": entries, "bytes": total_bytes, "max_bytes": LLM_CACHE_MAX_BYTES}
+
+
+def clear():
+    """清空所有缓存条目。"""
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM responses")
+        conn.commit()
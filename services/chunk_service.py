@@ -0,0 +1,266 @@
+# services/chunk_service.py
+"""
+长文献的分段 Markdown 转换服务。
+
+学位论文、会议论文集等长 PDF 通过一次 single_analysis_markdown 调用转换时，
+常常超出模型的输出 token 上限，且单个请求耗时很长。分段转换：
+1. 按页码范围将 PDF 拆分为若干片段（每段 PDF_CHUNK_PAGES 页）；
+2. 并行转换各片段，每个片段的结果按输入（页码范围、模型、temperature、提示词）保存到
+   result/markdown_chunks/<文件哈希>/，失败后重试时已完成的片段直接复用；
+3. 按顺序拼接：移除各片段中重复出现的页眉、页脚和页码，并根据章节编号统一各片段的标题层级。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PDF_CHUNK_MIN_PAGES, PDF_CHUNK_PAGES, PDF_CHUNK_MAX_WORKERS
+from services import file_service, llm_service, pdf_service
+from services.metrics_service import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+# 带编号的章节标题及其层级：1 / 1.2 / 1.2.3、Chapter 1、第一章、I. / II.、A.1（附录）
+_NUMBERED_HEADING_PATTERNS = [
+    (re.compile(r"^(\d+(?:\.\d+)*)\.?\s+\S"), lambda m: m.group(1).count(".") + 1),
+    (re.compile(r"^(?:Chapter|CHAPTER|Part|PART)\s+[\dIVXLC]+\b"), lambda m: 1),
+    (re.compile(r"^第[\d一二三四五六七八九十百]+[章部篇]"), lambda m: 1),
+    (re.compile(r"^第[\d一二三四五六七八九十百]+节"), lambda m: 2),
+    (re.compile(r"^[IVX]+\.\s+\S"), lambda m: 1),
+    (re.compile(r"^([A-Z](?:\.\d+)+)\.?\s+\S"), lambda m: m.group(1).count(".") + 1),
+]
+# 单独成行的页码：12、- 12 -、Page 12、Page 12 of 200、第 12 页
+_PAGE_NUMBER_PATTERN = re.compile(
+    r"^\s*(?:[-–—]\s*)?(?:page\s+)?\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?(?:\s*[-–—])?\s*$|^\s*第\s*\d{1,4}\s*页\s*$",
+    re.IGNORECASE)
+# 这些行是 Markdown 结构的一部分（表格、列表、代码、公式等），即使重复出现也不会被当作页眉页脚
+_STRUCTURAL_LINE_PATTERN = re.compile(r"^\s*(?:[|#>*\-+`$!\[]|\d+[.)]\s|<)")
+_RUNNING_LINE_MAX_CHARS = 80
+# 代码块（``` / ~~~）和公式块（$$）的边界行，块内的内容原样保留
+_FENCE_PATTERN = re.compile(r"^\s*(```|~~~|\$\$)")
+_CODE_FENCE_PATTERN = re.compile(r"^\s*```(?:markdown|md)?\s*\n(.*)\n\s*```\s*$", re.DOTALL | re.IGNORECASE)
+
+
+def should_chunk(page_count) -> bool:
+    return page_count is not None and page_count >= PDF_CHUNK_MIN_PAGES
+
+
+def plan_ranges(page_count: int, chunk_pages: int = PDF_CHUNK_PAGES) -> list:
+    """将页码 1..page_count 切分为 (起始页, 结束页) 范围；最后一段不足半段时并入前一段。"""
+    ranges = [(start, min(start + chunk_pages - 1, page_count)) for start in range(1, page_count + 1, chunk_pages)]
+    if len(ranges) > 1 and ranges[-1][1] - ranges[-1][0] + 1 < chunk_pages / 2:
+        last_start = ranges[-2][0]
+        ranges[-2:] = [(last_start, page_count)]
+    return ranges
+
+
+def _chunk_paths(file_hash: str, page_range: tuple, prompt: str, model_name: str, temperature: float):
+    """返回片段 PDF 和转换结果（检查点）的路径；检查点文件名包含输入的哈希，输入变化时不会复用旧结果。"""
+    chunk_dir = file_service.MARKDOWN_CHUNKS_DIR / file_hash
+    stem = f"pages-{page_range[0]:04d}-{page_range[1]:04d}"
+    key = hashlib.sha256(json.dumps([model_name, temperature, prompt], ensure_ascii=False).encode("utf-8"))
+    return chunk_dir / f"{stem}.pdf", chunk_dir / f"{stem}.{key.hexdigest()[:16]}.md"
+
+
+def _strip_code_fence(text: str) -> str:
+    """去掉模型有时包裹在整个输出外层的 ```markdown 代码块。"""
+    match = _CODE_FENCE_PATTERN.match(text)
+    return match.group(1) if match else text
+
+
+def _normalize_line(line: str) -> str:
+    """比较页眉页脚时忽略页码等数字和空白的差异。"""
+    return re.sub(r"\d+", "0", " ".join(line.split())).lower()
+
+
+def _mark_blocks(chunk: str) -> list:
+    """返回片段的 (行, 是否位于代码块或公式块内) 列表；块的边界行也视为块内。"""
+    marked, fence = [], None
+    for line in chunk.splitlines():
+        match = _FENCE_PATTERN.match(line)
+        if fence is None:
+            if match:
+                # 同一行内开始并结束的 $$...$$ 公式不构成块
+                closed = match.group(1) == "$$" and line.strip() != "$$" and line.strip().endswith("$$")
+                fence = None if closed else match.group(1)
+            marked.append((line, match is not None))
+        else:
+            if match and match.group(1) == fence:
+                fence = None
+            marked.append((line, True))
+    return marked
+
+
+def remove_running_lines(chunks: list, page_count: int) -> list:
+    """
+    移除单独成行的页码，以及在全文中反复出现的短行（页眉、页脚，如期刊名、论文题目、作者）。
+    重复次数不少于页数的三分之一（至少 3 次）且出现在至少一半片段中的短行视为页眉页脚；
+    表格、列表、标题等结构行以及代码块、公式块内的行不受影响。
+    """
+    counts, chunk_counts = Counter(), Counter()
+    for chunk in chunks:
+        seen = set()
+        for line, in_block in _mark_blocks(chunk):
+            stripped = line.strip()
+            if (not in_block and stripped and len(stripped) <= _RUNNING_LINE_MAX_CHARS
+                    and not _STRUCTURAL_LINE_PATTERN.match(stripped)):
+                seen.add(_normalize_line(stripped))
+                counts[_normalize_line(stripped)] += 1
+        chunk_counts.update(seen)
+    min_repeats = max(3, page_count // 3)
+    running = {line for line, count in counts.items()
+               if count >= min_repeats and chunk_counts[line] * 2 >= len(chunks)}
+
+    cleaned = []
+    for chunk in chunks:
+        lines = []
+        for line, in_block in _mark_blocks(chunk):
+            stripped = line.strip()
+            if in_block:
+                lines.append(line)
+                continue
+            if _PAGE_NUMBER_PATTERN.match(stripped):
+                continue
+            if stripped and _normalize_line(stripped) in running and not _STRUCTURAL_LINE_PATTERN.match(stripped):
+                continue
+            lines.append(line)
+        cleaned.append(re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip())
+    return cleaned
+
+
+def _numbered_level(title: str):
+    """按章节编号推断标题层级（论文题目为 1 级，一级章节为 2 级）；没有编号时返回 None。"""
+    for pattern, depth in _NUMBERED_HEADING_PATTERNS:
+        match = pattern.match(title)
+        if match:
+            return min(depth(match) + 1, 6)
+    return None
+
+
+def normalize_headings(chunks: list) -> list:
+    """
+    统一各片段的标题层级。带编号的标题按编号深度确定层级；
+    没有编号的标题（如“摘要”“参考文献”）按所在片段中编号标题最常见的层级偏移调整，片段中没有编号标题时沿用前一片段的偏移。
+    只有第一个片段可以包含 1 级标题（论文题目）。
+    """
+    normalized, offset = [], 0
+    for index, chunk in enumerate(chunks):
+        lines = chunk.split("\n")
+        headings = []
+        in_code = False
+        for i, line in enumerate(lines):
+            if line.lstrip().startswith("```"):
+                in_code = not in_code
+                continue
+            match = None if in_code else _HEADING_PATTERN.match(line)
+            if match:
+                headings.append((i, len(match.group(1)), match.group(2)))
+
+        offsets = Counter()
+        for _, current, title in headings:
+            level = _numbered_level(title)
+            if level is not None:
+                offsets[level - current] += 1
+        if offsets:
+            offset = offsets.most_common(1)[0][0]
+        min_level = 1 if index == 0 else 2
+        for i, current, title in headings:
+            level = _numbered_level(title)
+            if level is None:
+                level = current + offset
+            lines[i] = "#" * max(min_level, min(level, 6)) + " " + title
+        normalized.append("\n".join(lines))
+    return normalized
+
+
+def stitch(chunks: list, page_count: int) -> str:
+    """按顺序拼接各片段的 Markdown，移除页眉页脚并统一标题层级。"""
+    chunks = [_strip_code_fence(chunk.strip()) for chunk in chunks]
+    chunks = normalize_headings(remove_running_lines(chunks, page_count))
+    return "\n\n".join(chunk for chunk in chunks if chunk) + "\n"
+
+
+def convert_markdown(file_path, prompts, model_name: str, temperature: float, api_key: str,
+                     use_cache: bool = True, page_count: int = None, report_progress=None) -> str:
+    """
+    分段转换一篇长 PDF，返回拼接后的 Markdown。
+
+    Args:
+        prompts (PromptRegistry): 提示词注册表；每个片段的提示词为 single_analysis_markdown_chunk
+            （说明页码范围和标题层级）加上 single_analysis_markdown。
+        page_count (int, optional): 已知的页数，未提供时读取文件获得；无法读取页数时整篇一次转换。
+        report_progress (callable, optional): 接收 {"phase", "done", "total"} 进度字典的回调。
+
+    Raises:
+        Exception: 任一片段转换失败时抛出；已完成片段的结果已保存，重试时不会重新转换。
+    """
+    if page_count is None:
+        page_count = pdf_service.get_page_count(file_path)
+    if page_count is None:
+        logger.warning("无法读取 %s 的页数，整篇一次转换 Markdown。", file_path.name)
+        return llm_service.analyze_pdf_content(file_path, prompts['single_analysis_markdown'], model_name,
+                                               temperature, api_key, use_cache=use_cache)
+    file_hash = file_service.get_pdf_sha256(file_path)
+    ranges = plan_ranges(page_count)
+    chunk_prompts = [
+        prompts.render('single_analysis_markdown_chunk', start_page=start, end_page=end, page_count=page_count)
+        + "\n\n" + prompts['single_analysis_markdown']
+        for start, end in ranges
+    ]
+    paths = [_chunk_paths(file_hash, page_range, prompt, model_name, temperature)
+             for page_range, prompt in zip(ranges, chunk_prompts)]
+
+    results = [None] * len(ranges)
+    if use_cache:
+        for i, (_, checkpoint_path) in enumerate(paths):
+            if checkpoint_path.exists():
+                results[i] = checkpoint_path.read_text(encoding="utf-8")
+    pending = [i for i, result in enumerate(results) if result is None]
+    logger.info("%s: 共 %d 页，分为 %d 段转换（%d 段已有结果）。", file_path.name, page_count, len(ranges),
+                len(ranges) - len(pending), extra=SAMPLED)
+
+    progress = {"phase": "markdown-chunks", "done": len(ranges) - len(pending), "total": len(ranges)}
+    progress_lock = threading.Lock()
+    if report_progress is not None:
+        report_progress(dict(progress))
+
+    if pending:
+        (file_service.MARKDOWN_CHUNKS_DIR / file_hash).mkdir(parents=True, exist_ok=True)
+        pdf_service.split_pages(file_path, [ranges[i] for i in pending], [paths[i][0] for i in pending])
+
+        def convert(i):
+            chunk_path, checkpoint_path = paths[i]
+            content = llm_service.analyze_pdf_content(chunk_path, chunk_prompts[i], model_name, temperature,
+                                                      api_key, use_cache=use_cache)
+            # 先写入临时文件再替换，中途失败不会留下被当作已完成的半截结果
+            # 临时文件名各不相同，同一文件的两次转换同时进行时不会互相覆盖
+            tmp_path = checkpoint_path.with_name(f".{checkpoint_path.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                tmp_path.write_text(content, encoding="utf-8")
+                os.replace(tmp_path, checkpoint_path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            # 在锁内上报，保证上报的完成数单调递增
+            with progress_lock:
+                progress["done"] += 1
+                if report_progress is not None:
+                    report_progress(dict(progress))
+            return content
+
+        with ThreadPoolExecutor(max_workers=PDF_CHUNK_MAX_WORKERS) as executor:
+            futures = {i: executor.submit(convert, i) for i in pending}
+        # 等待所有片段结束后再抛出第一个错误，其余片段的结果都已保存
+        for i, future in futures.items():
+            results[i] = future.result()
+
+    # 全部片段完成后，拆分出的片段 PDF 不再需要，只保留各片段的转换结果
+    for chunk_path, _ in paths:
+        chunk_path.unlink(missing_ok=True)
+    return stitch(results, page_count)
+
@@ -0,0 +1,138 @@
+# services/context_service.py
+"""
+提示词上下文组装服务。
+
+在把大量资料（如所有单篇文献分析）拼入提示词之前，估算其 token 数量，
+并按模型的 token 预算对资料进行排序、取舍和截断，避免超出模型的上下文窗口；
+同时判断资料是否足够大，值得作为上下文缓存（见 llm_service）单独发送。
+"""
+import logging
+import math
+import re
+
+from config import DEFAULT_CONTEXT_BUDGET, MODEL_CONTEXT_BUDGETS, CONTEXT_CACHE_ENABLED, CONTEXT_CACHE_MIN_TOKENS
+from services import file_service
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+_WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9_-]{2,}")
+
+# 截断后剩余预算不足该值时，不再放入截断的文档
+MIN_TRUNCATED_TOKENS = 500
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数量：每个汉字约 1 个 token，其他字符约 4 个字符 1 个 token。
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+
+def get_budget(model_name: str) -> int:
+    """返回指定模型可用于输入资料的 token 预算。"""
+    return MODEL_CONTEXT_BUDGETS.get(model_name, DEFAULT_CONTEXT_BUDGET)
+
+
+def is_cacheable_context(text: str) -> bool:
+    """资料是否足够大，值得作为提示词的稳定前缀在远端缓存。"""
+    return CONTEXT_CACHE_ENABLED and estimate_tokens(text) >= CONTEXT_CACHE_MIN_TOKENS
+
+
+def _terms(text: str) -> set:
+    """提取用于相关性排序的词项：英文单词（小写）和相邻汉字组成的二元组。"""
+    terms = {word.lower() for word in _WORD_PATTERN.findall(text)}
+    for run in re.findall(r"[\u3400-\u9fff]+", text):
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按估算的 token 数从开头截取文本，尽量在段落边界处截断。"""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    truncated = text[:low]
+    paragraph_end = truncated.rfind("\n\n")
+    if paragraph_end > len(truncated) // 2:
+        truncated = truncated[:paragraph_end]
+    return truncated
+
+
+def fit_documents(documents: list, budget: int, query_text: str = ""):
+    """
+    在 token 预算内选择文档。
+
+    文档按与 `query_text` 的相关性（共享词项占比）从高到低排序后依次放入；
+    第一篇放不下的文档会被截断以用尽剩余预算，其后的文档被舍弃。
+
+    Args:
+        documents (list): (名称, 内容) 元组列表。
+        budget (int): 可用的 token 预算。
+        query_text (str): 用于相关性排序的参考文本；为空时保持原有顺序。
+
+    Returns:
+        tuple: (选中的 (名称, 内容) 列表, {"included", "truncated", "omitted"} 统计信息)
+    """
+    ranked = list(documents)
+    if query_text:
+        query_terms = _terms(query_text)
+
+        def relevance(document):
+            doc_terms = _terms(document[1])
+            if not doc_terms:
+                return 0.0
+            return len(doc_terms & query_terms) / math.sqrt(len(doc_terms))
+
+        ranked.sort(key=relevance, reverse=True)
+
+    selected, remaining = [], budget
+    stats = {"included": 0, "truncated": 0, "omitted": 0}
+    for i, (name, content) in enumerate(ranked):
+        tokens = estimate_tokens(content)
+        if tokens <= remaining:
+            selected.append((name, content))
+            remaining -= tokens
+            stats["included"] += 1
+            continue
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            selected.append((name, _truncate_to_tokens(content, remaining) + "\n\n（内容因篇幅限制已截断）"))
+            stats["truncated"] += 1
+            stats["omitted"] = len(ranked) - i - 1
+        else:
+            stats["omitted"] = len(ranked) - i
+        break
+    return selected, stats
+
+
+def get_brainstorming_source_text(model_name: str):
+    """
+    为头脑风暴准备数据源：综合分析报告（完整保留）加上在预算内尽可能多的单篇文献分析，
+    单篇分析按与综合报告的相关性排序。返回 (数据源文本, 错误信息)。
+    """
+    report_content = file_service.get_comprehensive_report_content()
+    if not report_content:
+        return None, "综合分析报告尚未生成，无法进行头脑风暴。"
+
+    budget = get_budget(model_name) - estimate_tokens(report_content)
+    analyses = file_service.get_analysis_contents(file_service.get_analyzed_papers())
+    selected, stats = fit_documents(analyses, max(budget, 0), query_text=report_content)
+    all_analyses_text = file_service.format_analysis_documents(selected)
+    if stats["truncated"] or stats["omitted"]:
+        logger.warning("头脑风暴数据源超出模型 '%s' 的预算: 完整纳入 %d 篇，截断 %d 篇，舍弃 %d 篇。",
+                       model_name, stats["included"], stats["truncated"], stats["omitted"])
+    if stats["omitted"]:
+        all_analyses_text += f"（因篇幅限制，另有 {stats['omitted']} 篇文献分析未纳入。）\n"
+
+    combined_source = (
+        f"--- 综合分析报告 (宏观视角) ---\n\n{report_content}\n\n"
+        f"--- 各单篇文献分析详情 (微观细节) ---\n\n{all_analyses_text}"
+    )
+    return combined_source, None
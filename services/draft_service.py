@@ -0,0 +1,182 @@
+# services/draft_service.py
+"""
+整篇论文草稿的批量生成服务。
+
+config.PAPER_STRUCTURE 中各章节的 dependencies 构成一张有向无环图。
+生成草稿时，一个章节的所有依赖都已有内容后立即开始生成，互不依赖的章节并行执行
+（例如 keywords、introduction 和 background 只依赖 idea/title/abstract），
+总耗时约等于依赖图中最长路径上各章节的生成时间之和。每个章节生成完成后立即写入论文。
+
+每次由 AI 生成章节时，会在章节中记录生成输入的指纹（依赖章节内容、提示词和模型的哈希）。
+之后若依赖章节被修改，指纹不再匹配，该章节以及依赖它的已生成章节（传递地）会被标记为过期，
+可以只重新生成这些章节。
+"""
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import PAPER_STRUCTURE, DRAFT_MAX_WORKERS
+from services import file_service, llm_service
+
+logger = logging.getLogger(__name__)
+
+
+def _dependencies():
+    return {section['key']: section['dependencies'] for section in PAPER_STRUCTURE}
+
+
+def topological_order(section_keys: list = None) -> list:
+    """
+    按依赖关系返回章节的拓扑顺序（依赖在前）；section_keys 为空时返回全部章节。
+    依赖中出现环或未知章节时抛出 ValueError。
+    """
+    sections = _dependencies()
+    order, visiting, visited = [], set(), set()
+
+    def visit(key):
+        if key in visited:
+            return
+        if key not in sections:
+            raise ValueError(f"未知的论文部分: {key}")
+        if key in visiting:
+            raise ValueError(f"论文结构的依赖关系中存在环: {key}")
+        visiting.add(key)
+        for dep in sections[key]:
+            visit(dep)
+        visiting.discard(key)
+        visited.add(key)
+        order.append(key)
+
+    for key in section_keys or sections:
+        visit(key)
+    return order
+
+
+def generation_record(contents: list, model_name: str, language: str) -> dict:
+    """
+    构造章节的生成记录，其中的指纹由生成提示词（已包含依赖章节的内容）和模型决定。
+    提示词是否被拆分为多段内容（见 prompt_service.build_section_contents）不影响指纹。
+    """
+    prompt = "\n".join(contents)
+    digest = hashlib.sha256(json.dumps([model_name, prompt], ensure_ascii=False).encode("utf-8")).hexdigest()
+    return {"fingerprint": digest, "model": model_name, "language": language}
+
+
+def find_stale_sections(paper_data: dict, build_prompt) -> list:
+    """
+    返回过期的章节（按拓扑顺序）。
+    只有带生成记录的章节会被检查：当前输入的指纹与记录不一致，或它依赖的章节已过期（将被重新生成）时，
+    该章节过期。手动撰写的章节不会被标记，但它们的修改会使依赖它们的已生成章节过期。
+
+    Args:
+        build_prompt (callable): (paper_data, section_key, language) -> 该章节的生成提示词内容列表。
+    """
+    dependencies = _dependencies()
+    stale = []
+    for key in topological_order():
+        section = paper_data.get(key) or {}
+        record = section.get('generation')
+        if not record or not section.get('content', '').strip():
+            continue
+        if any(dep in stale for dep in dependencies[key]):
+            stale.append(key)
+            continue
+        current = generation_record(build_prompt(paper_data, key, record['language']), record['model'],
+                                    record['language'])
+        if current['fingerprint'] != record['fingerprint']:
+            stale.append(key)
+    return stale
+
+
+def generate_draft(paper_name: str, build_prompt, model_name: str, temperature: float, api_key: str,
+                   language: str, section_keys: list = None, use_cache: bool = True, overwrite: bool = False,
+                   on_section_saved=None, report_progress=None):
+    """
+    按依赖图并行生成论文中尚无内容的章节（或 section_keys 指定的章节）。
+
+    Args:
+        paper_name (str): 论文名称。
+        build_prompt (callable): (paper_data, section_key, language) -> 提示词内容列表，
+            基于最新的论文内容构建指定章节的生成提示词。
+        language (str): 生成使用的语言。
+        section_keys (list, optional): 只生成这些章节（如过期的章节），与 overwrite 无关。
+        overwrite (bool): 为 True 时重新生成所有可生成的章节，否则只生成内容为空的章节。
+        on_section_saved (callable, optional): 章节写入论文后在论文锁内调用，
+            参数为 {章节key: (修改前内容, 修改后内容)}，例如用于记录修订历史。
+        report_progress (callable, optional): 接收进度字典的回调。
+
+    Returns:
+        dict: {"generated": [...], "failed": {章节key: 错误信息}, "skipped": [...]}
+    """
+    paper_data = file_service.get_paper_content(paper_name)
+    if paper_data is None:
+        raise FileNotFoundError(f"论文未找到: {paper_name}")
+
+    dependencies = _dependencies()
+
+    def has_content(data, key):
+        return bool(data.get(key, {}).get('content', '').strip())
+
+    # 没有依赖的章节（如 idea）是用户的输入，不自动生成
+    if section_keys is not None:
+        targets = [key for key in topological_order() if key in section_keys and dependencies[key]]
+    else:
+        targets = [key for key in topological_order()
+                   if dependencies[key] and (overwrite or not has_content(paper_data, key))]
+    completed = {key for key in dependencies if has_content(paper_data, key) and key not in targets}
+    missing_roots = [key for key, deps in dependencies.items() if not deps and key not in completed]
+    if missing_roots:
+        raise ValueError(f"请先填写以下部分的内容: {', '.join(missing_roots)}")
+
+    result = {"generated": [], "failed": {}, "skipped": []}
+    progress = {"done": 0, "total": len(targets), "running": [], "generated": result["generated"]}
+
+    def notify():
+        if report_progress is not None:
+            report_progress({**progress, "running": list(progress["running"]),
+                             "generated": list(progress["generated"])})
+
+    def generate_section(key):
+        contents = build_prompt(file_service.get_paper_content(paper_name), key, language)
+        content = llm_service.generate_text_from_prompt(contents, model_name, temperature, api_key,
+                                                        use_cache=use_cache,
+                                                        context_label=f"paper:{paper_name}:{key}").strip()
+        section = {"content": content, "status": "completed",
+                   "generation": generation_record(contents, model_name, language)}
+        file_service.patch_paper_sections(paper_name, {key: section}, base_version=None, on_saved=on_section_saved)
+        return key
+
+    pending = list(targets)
+    with ThreadPoolExecutor(max_workers=DRAFT_MAX_WORKERS) as executor:
+        running = {}
+        while pending or running:
+            # 提交所有依赖均已完成的章节
+            for key in [key for key in pending if all(dep in completed for dep in dependencies[key])]:
+                pending.remove(key)
+                running[executor.submit(generate_section, key)] = key
+                progress["running"].append(key)
+            if not running:
+                break
+            notify()
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                progress["running"].remove(key)
+                progress["done"] += 1
+                try:
+                    future.result()
+                    completed.add(key)
+                    result["generated"].append(key)
+                except Exception as e:
+                    logger.warning("生成论文 '%s' 的 %s 部分时出错: %s", paper_name, key, e)
+                    result["failed"][key] = str(e)
+
+    # 依赖生成失败的章节无法生成
+    result["skipped"] = pending
+    progress["done"] = len(targets)
+    notify()
+    if targets and not result["generated"]:
+        raise RuntimeError(f"所有章节生成失败: {result['failed']}")
+    return result
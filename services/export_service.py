@@ -2,31 +2,51 @@
 # -*- coding: utf-8 -*-
 
 """
-Markdown 导出服务
-================
+论文导出服务
+============
 
 本模块提供将平台内部存储的结构化论文数据（JSON格式）转换为
-一份格式严谨、符合学术规范的 Markdown 文件的核心功能。
+格式严谨、符合学术规范的 Markdown、HTML 和 Word (DOCX) 文件的功能，
+以及将多篇论文打包为 ZIP 流式导出的功能。
 
 设计哲学：
-- **单一职责**: 此模块的唯一目标是进行格式转换，不涉及任何业务逻辑或数据获取。
+- **单一职责**: 渲染函数只进行格式转换，不涉及任何业务逻辑或数据获取。
 - **配置驱动**: 转换过程严格遵循 `config.py` 中定义的 `PAPER_STRUCTURE` 列表，
   确保输出的章节顺序和编号规则与平台其他部分保持一致。
 - **高可读性**: 生成的 Markdown 文本力求简洁、清晰，并兼容主流的 Markdown 编辑器和渲染器。
+- **内存平稳**: 渲染结果按章节内容的哈希缓存在 result/exports/ 下，导出时从文件分块读取；
+  ZIP 包边生成边输出，一次只处理一篇论文，内存占用与论文数量无关。
 
 主要功能：
 - `create_markdown_from_paper`: 接收论文数据和结构配置，生成完整的 Markdown 字符串。
+- `create_html_from_paper` / `create_docx_from_paper`: 生成 HTML 文档和 DOCX 文件内容。
+- `render_cached`: 返回论文指定格式的渲染结果文件（内容未变化时直接复用）。
+- `stream_file` / `stream_zip`: 分块读取单个导出文件，或将多个导出文件流式打包为 ZIP。
 """
+import hashlib
+import html
+import io
+import json
+import os
 import re
-from config import PAPER_STRUCTURE_MAP
+import threading
+import time
+import uuid
+import zipfile
+from xml.sax.saxutils import escape as xml_escape
+
+from config import PAPER_STRUCTURE, PAPER_STRUCTURE_MAP, EXPORT_CACHE_MAX_BYTES, EXPORT_CHUNK_SIZE
+from services import annotation_service, file_service
 
 
 def _clean_content(text: str) -> str:
     """
-    使用正则表达式移除文本中的自定义批注标记，生成干净的文本。
+    移除文本中的自定义批注标记，生成干净的文本。
 
     此函数的目标是将编辑器中的批注格式（例如，`{{原文}}【修改意见：...】`）
     还原为最终的、不含任何标记的文本（即 `原文`）。
+    解析由 annotation_service 的单遍扫描器完成，耗时与文本长度成线性关系，
+    并能处理嵌套或不完整的批注标记。
 
     Args:
         text (str): 可能包含批注标记的原始字符串。
@@ -34,36 +54,16 @@ def _clean_content(text: str) -> str:
     Returns:
         str: 清理掉所有批注标记后的纯净字符串。
     """
-    # 正则表达式解析:
-    # - `{{([\s\S]+?)}}`: 这是一个捕获组 (由括号 `()` 定义)。
-    #   - `[\s\S]+?`: 非贪婪地匹配一个或多个任意字符（包括空格、换行符等）。
-    #   - 这部分会捕获被双大括号包裹的原始文本。
-    # - `【修改意见：[\s\S]+?】`: 匹配完整的修改意见部分，但由于没有括号，所以不捕获。
-    # `re.sub` 函数会找到所有匹配该模式的子字符串，并用第一个捕获组的内容 (`\1`) 替换整个匹配项。
-    pattern = r"{{([\s\S]+?)}}【修改意见：[\s\S]+?】"
-    return re.sub(pattern, r'\1', text)
+    return annotation_service.strip(text)
 
 
-def create_markdown_from_paper(paper_data: dict, paper_structure_list: list) -> str:
+def _iter_sections(paper_data: dict, paper_structure_list: list):
     """
-    根据论文数据和结构配置，生成一份完整的 Markdown 格式文本。
+    按结构顺序产出需要导出的章节 (key, 标题, 清理后的内容)。
 
-    此函数会遍历 `paper_structure_list` 来保证章节的正确顺序。
-    它会根据每个章节的 `numbered` 属性来决定是否添加数字前缀，
-    并使用标准的 Markdown 语法（如 H1、H2 标题）来构建文档。
-    在处理每个章节时，它会首先调用 `_clean_content` 函数移除所有批注。
-
-    Args:
-        paper_data (dict): 包含论文所有章节内容的字典。
-                           键为章节的唯一标识符（如 'title', 'abstract'），
-                           值为包含 'content' 字段的字典。
-        paper_structure_list (list): 从 `config.py` 导入的 `PAPER_STRUCTURE` 列表，
-                                     定义了论文的完整结构和元数据。
-
-    Returns:
-        str: 格式化后的完整、干净的 Markdown 文本。
+    它会根据每个章节的 `numbered` 属性来决定是否添加数字前缀；
+    标题部分的“标题”即论文标题本身。内容为空（或清理批注后为空）的章节会被跳过。
     """
-    markdown_parts = []
     numbered_section_counter = 1
 
     for section_config in paper_structure_list:
@@ -82,23 +82,380 @@ def create_markdown_from_paper(paper_data: dict, paper_structure_list: list) ->
                 continue
 
             name = section_config['name']
-
-            # 根据章节类型应用不同的 Markdown 标题级别
             if key == 'title':
-                markdown_parts.append(f"# {cleaned_content}")
-            elif key in ['abstract', 'keywords']:
-                markdown_parts.append(f"## {name}\n\n{cleaned_content}")
+                yield key, cleaned_content, ''
+            elif key not in ['abstract', 'keywords'] and section_config.get('numbered', False):
+                # 处理需要编号的章节
+                yield key, f"{numbered_section_counter}. {name}", cleaned_content
+                numbered_section_counter += 1
             else:
-                if section_config.get('numbered', False):
-                    # 处理需要编号的章节
-                    markdown_parts.append(f"## {numbered_section_counter}. {name}\n\n{cleaned_content}")
-                    numbered_section_counter += 1
-                else:
-                    # 处理不需要编号的章节（例如 '核心想法'）
-                    markdown_parts.append(f"## {name}\n\n{cleaned_content}")
+                # 处理不需要编号的章节（例如 '摘要'、'核心想法'）
+                yield key, name, cleaned_content
+
+
+def create_markdown_from_paper(paper_data: dict, paper_structure_list: list) -> str:
+    """
+    根据论文数据和结构配置，生成一份完整的 Markdown 格式文本。
+
+    此函数会遍历 `paper_structure_list` 来保证章节的正确顺序，
+    并使用标准的 Markdown 语法（如 H1、H2 标题）来构建文档。
+    在处理每个章节时，会首先调用 `_clean_content` 函数移除所有批注。
+
+    Args:
+        paper_data (dict): 包含论文所有章节内容的字典。
+                           键为章节的唯一标识符（如 'title', 'abstract'），
+                           值为包含 'content' 字段的字典。
+        paper_structure_list (list): 从 `config.py` 导入的 `PAPER_STRUCTURE` 列表，
+                                     定义了论文的完整结构和元数据。
 
-            # 在各章节之间添加额外的换行以增强可读性
-            markdown_parts.append("\n")
+    Returns:
+        str: 格式化后的完整、干净的 Markdown 文本。
+    """
+    markdown_parts = []
+    for key, heading, content in _iter_sections(paper_data, paper_structure_list):
+        # 根据章节类型应用不同的 Markdown 标题级别
+        if key == 'title':
+            markdown_parts.append(f"# {heading}")
+        else:
+            markdown_parts.append(f"## {heading}\n\n{content}")
+        # 在各章节之间添加额外的换行以增强可读性
+        markdown_parts.append("\n")
 
     # 使用两个换行符连接所有部分，形成最终的文档
-    return "\n".join(markdown_parts)
\ No newline at end of file
+    return "\n".join(markdown_parts)
+
+
+# --- HTML 导出 ---
+# 不依赖第三方 Markdown 库，只处理 AI 生成内容中常见的语法：标题、段落、有序/无序列表、
+# 粗体、斜体和行内代码。数学公式（$...$ 和 $$...$$）原样保留，由页面中的 MathJax 渲染。
+
+_MATH_PATTERN = re.compile(r"(\$\$[\s\S]+?\$\$|\$[^$\n]+?\$)")
+_LIST_ITEM_PATTERN = re.compile(r"^\s*(?:([-*+])|(\d+)[.)])\s+(.*)$")
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*)$")
+
+_HTML_HEAD = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script>MathJax = {{ tex: {{ inlineMath: [['$', '$']], displayMath: [['$$', '$$']] }} }};</script>
+<script async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js"></script>
+<style>
+body {{ max-width: 860px; margin: 2rem auto; padding: 0 1rem; font-family: "Times New Roman", "SimSun", serif; line-height: 1.8; }}
+h1 {{ text-align: center; }}
+</style>
+</head>
+<body>
+"""
+
+
+def _inline_html(text: str) -> str:
+    """转换行内格式；公式片段只做 HTML 转义，避免其中的 * 和 _ 被误当作强调标记。"""
+    parts = []
+    for i, part in enumerate(_MATH_PATTERN.split(text)):
+        part = html.escape(part, quote=False)
+        if i % 2 == 0:
+            part = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", part)
+            part = re.sub(r"(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?![*\w])", r"<em>\1</em>", part)
+            part = re.sub(r"`([^`]+)`", r"<code>\1</code>", part)
+        parts.append(part)
+    return "".join(parts)
+
+
+def _blocks(content: str):
+    """将章节内容切分为块：("heading", 级别, 文本)、("list", 是否有序, [条目]) 或 ("paragraph", None, [行])。"""
+    current = None
+    for line in content.splitlines():
+        heading, item = _HEADING_PATTERN.match(line), _LIST_ITEM_PATTERN.match(line)
+        if not line.strip():
+            if current:
+                yield current
+            current = None
+        elif heading:
+            if current:
+                yield current
+            current = None
+            yield "heading", len(heading.group(1)), heading.group(2)
+        elif item:
+            ordered = item.group(2) is not None
+            if not current or current[0] != "list" or current[1] != ordered:
+                if current:
+                    yield current
+                current = ("list", ordered, [])
+            current[2].append(item.group(3))
+        elif current and current[0] == "list" and line.startswith((" ", "\t")):
+            current[2][-1] += " " + line.strip()  # 列表条目的续行
+        else:
+            if not current or current[0] != "paragraph":
+                if current:
+                    yield current
+                current = ("paragraph", None, [])
+            current[2].append(line)
+    if current:
+        yield current
+
+
+def _markdown_to_html(content: str) -> str:
+    html_parts = []
+    for kind, arg, value in _blocks(content):
+        if kind == "heading":
+            level = min(arg + 2, 6)  # 章节标题为 h2，内容中的标题依次下移
+            html_parts.append(f"<h{level}>{_inline_html(value)}</h{level}>")
+        elif kind == "list":
+            tag = "ol" if arg else "ul"
+            items = "".join(f"<li>{_inline_html(item)}</li>" for item in value)
+            html_parts.append(f"<{tag}>{items}</{tag}>")
+        else:
+            html_parts.append(f"<p>{'<br>'.join(_inline_html(line) for line in value)}</p>")
+    return "\n".join(html_parts)
+
+
+def create_html_from_paper(paper_data: dict, paper_structure_list: list, document_title: str = "") -> str:
+    """
+    生成可独立打开的 HTML 文档，章节顺序和编号规则与 Markdown 导出一致。
+    页面标题优先使用论文的标题部分，没有标题时使用 document_title。
+    """
+    body_parts = []
+    for key, heading, content in _iter_sections(paper_data, paper_structure_list):
+        if key == 'title':
+            body_parts.append(f"<h1>{_inline_html(heading)}</h1>")
+            document_title = heading
+        else:
+            body_parts.append(f"<h2>{_inline_html(heading)}</h2>\n{_markdown_to_html(content)}")
+    head = _HTML_HEAD.format(title=html.escape(document_title))
+    return head + "\n".join(body_parts) + "\n</body>\n</html>\n"
+
+
+# --- DOCX 导出 ---
+# 不依赖 python-docx：DOCX 是包含若干 XML 部件的 ZIP 包，这里只写入最小必需的部件，
+# 使用内置的标题样式，Word 的导航窗格可以正确显示章节结构。公式以 LaTeX 源码形式保留。
+
+_DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+_DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+_DOCX_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+
+def _docx_style(style_id: str, name: str, size: int, bold: bool = True, center: bool = False,
+                outline_level: int = None) -> str:
+    paragraph = ('<w:jc w:val="center"/>' if center else '') + \
+        (f'<w:outlineLvl w:val="{outline_level}"/>' if outline_level is not None else '')
+    return (f'<w:style w:type="paragraph" w:styleId="{style_id}"><w:name w:val="{name}"/>'
+            f'<w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:qFormat/>'
+            f'<w:pPr><w:spacing w:before="240" w:after="120"/>{paragraph}</w:pPr>'
+            f'<w:rPr>{"<w:b/>" if bold else ""}<w:sz w:val="{size}"/></w:rPr></w:style>')
+
+
+_DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" '
+    'w:eastAsia="SimSun"/><w:sz w:val="24"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="120" w:line="360" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    + _docx_style("Title", "Title", 36, center=True)
+    + _docx_style("Heading1", "heading 1", 30, outline_level=0)
+    + _docx_style("Heading2", "heading 2", 26, outline_level=1)
+    + _docx_style("Heading3", "heading 3", 24, outline_level=2)
+    + '</w:styles>'
+)
+
+# XML 1.0 不允许出现的控制字符
+_XML_INVALID_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _docx_runs(text: str) -> str:
+    """将文本转换为 w:r 序列，**粗体** 转换为粗体文字，其余 Markdown 标记原样保留。"""
+    runs = []
+    for i, part in enumerate(re.split(r"\*\*(.+?)\*\*", _XML_INVALID_CHARS.sub("", text))):
+        if part:
+            bold = "<w:rPr><w:b/></w:rPr>" if i % 2 else ""
+            runs.append(f'<w:r>{bold}<w:t xml:space="preserve">{xml_escape(part)}</w:t></w:r>')
+    return "".join(runs)
+
+
+def _docx_paragraph(text: str, style: str = None) -> str:
+    style_xml = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f"<w:p>{style_xml}{_docx_runs(text)}</w:p>"
+
+
+def create_docx_from_paper(paper_data: dict, paper_structure_list: list) -> bytes:
+    """生成 DOCX 文件内容：论文标题使用 Title 样式，章节标题使用 Heading 1，列表条目带编号或项目符号前缀。"""
+    paragraphs = []
+    for key, heading, content in _iter_sections(paper_data, paper_structure_list):
+        if key == 'title':
+            paragraphs.append(_docx_paragraph(heading, "Title"))
+            continue
+        paragraphs.append(_docx_paragraph(heading, "Heading1"))
+        for kind, arg, value in _blocks(content):
+            if kind == "heading":
+                paragraphs.append(_docx_paragraph(value, f"Heading{min(arg + 1, 3)}"))
+            elif kind == "list":
+                paragraphs.extend(_docx_paragraph(f"{f'{n}.' if arg else '•'} {item}")
+                                  for n, item in enumerate(value, 1))
+            else:
+                paragraphs.append(_docx_paragraph(" ".join(line.strip() for line in value)))
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                + "".join(paragraphs) +
+                '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+                '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800"/></w:sectPr>'
+                '</w:body></w:document>')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        docx.writestr("_rels/.rels", _DOCX_RELS)
+        docx.writestr("word/_rels/document.xml.rels", _DOCX_DOCUMENT_RELS)
+        docx.writestr("word/styles.xml", _DOCX_STYLES)
+        docx.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+# --- 导出格式、渲染缓存与流式输出 ---
+
+# 格式名 -> (扩展名, MIME 类型, 打包进 ZIP 时是否压缩)
+EXPORT_FORMATS = {
+    'markdown': ('.md', 'text/markdown; charset=utf-8', True),
+    'html': ('.html', 'text/html; charset=utf-8', True),
+    'docx': ('.docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', False),
+}
+
+# 渲染逻辑变化时递增，使旧的缓存结果失效
+_RENDER_VERSION = 2
+
+# 最近这段时间内返回过的缓存文件可能仍在被下载，淘汰时跳过
+_PRUNE_MIN_AGE_SECONDS = 600
+# 保证“更新使用时间并返回路径”与淘汰时的“检查使用时间并删除”不会交错执行
+_cache_lock = threading.Lock()
+
+
+def _render(paper_data: dict, export_format: str, document_title: str) -> bytes:
+    if export_format == 'markdown':
+        return create_markdown_from_paper(paper_data, PAPER_STRUCTURE).encode("utf-8")
+    if export_format == 'html':
+        return create_html_from_paper(paper_data, PAPER_STRUCTURE, document_title).encode("utf-8")
+    return create_docx_from_paper(paper_data, PAPER_STRUCTURE)
+
+
+def _prune_cache():
+    """
+    渲染缓存超过 EXPORT_CACHE_MAX_BYTES 时，按最近使用时间删除最旧的文件。
+    _PRUNE_MIN_AGE_SECONDS 内使用过的文件不会被删除，即使缓存因此暂时超出上限。
+    """
+    with _cache_lock:
+        entries = []
+        for path in file_service.EXPORT_CACHE_DIR.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - _PRUNE_MIN_AGE_SECONDS
+        for mtime, size, path in sorted(entries):
+            if total <= EXPORT_CACHE_MAX_BYTES or mtime > cutoff:
+                break
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:  # Windows 上正在被读取的文件无法删除
+                continue
+            total -= size
+
+
+def render_cached(paper_data: dict, export_format: str, document_title: str = ""):
+    """
+    返回论文指定格式的渲染结果文件路径。
+    缓存键由章节内容、论文结构和格式决定（保存状态、版本号等字段的变化不会使缓存失效），
+    内容未变化的论文直接复用之前的渲染结果。document_title 仅用于没有标题部分的 HTML 页面标题。
+    """
+    if export_format != 'html':
+        document_title = ""
+    sections = [[config['key'], config['name'], config.get('numbered', False),
+                 (paper_data.get(config['key']) or {}).get('content', '')] for config in PAPER_STRUCTURE]
+    digest = hashlib.sha256(json.dumps([_RENDER_VERSION, export_format, document_title, sections],
+                                       ensure_ascii=False).encode("utf-8")).hexdigest()
+    path = file_service.EXPORT_CACHE_DIR / f"{digest}{EXPORT_FORMATS[export_format][0]}"
+    with _cache_lock:
+        try:
+            os.utime(path)  # 更新最近使用时间，用于淘汰
+            return path
+        except FileNotFoundError:
+            pass
+
+    file_service.EXPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp_path.write_bytes(_render(paper_data, export_format, document_title))
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    _prune_cache()
+    return path
+
+
+def stream_file(path):
+    """按 EXPORT_CHUNK_SIZE 分块读取文件。"""
+    with open(path, "rb") as f:
+        while chunk := f.read(EXPORT_CHUNK_SIZE):
+            yield chunk
+
+
+class _ZipStream(io.RawIOBase):
+    """只追加的写入缓冲区，zipfile 写入的数据在每个数据块之后被取出并输出。"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries):
+    """
+    将文件流式打包为 ZIP，边写入边产出字节块。
+
+    Args:
+        entries (iterable): (包内文件名, 文件路径, 是否压缩) 的可迭代对象，可以是惰性的生成器，
+            这样每篇论文在即将写入时才被读取和渲染。
+    """
+    buffer = _ZipStream()
+    # 输出流不可 seek，zipfile 会在每个文件的数据之后写入数据描述符
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for arcname, path, compress in entries:
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            with archive.open(info, "w") as dest:
+                for chunk in stream_file(path):
+                    dest.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
@@ -3,11 +3,16 @@ import os
 import json
 import uuid
 import re
+import hashlib
+import threading
+import time
+import atexit
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
 
 # 导入配置
-from config import PAPER_STRUCTURE
+from config import PAPER_STRUCTURE, PAPER_STRUCTURE_MAP, PAPER_CACHE_MAX_ENTRIES, PAPER_FLUSH_DELAY_SECONDS
 
 # 定义项目中的关键目录
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -15,10 +20,14 @@ PAPERS_DIR = BASE_DIR / "papers"
 RESULT_DIR = BASE_DIR / "result"
 PROMPTS_DIR = BASE_DIR / "prompts"
 MARKDOWNS_DIR = RESULT_DIR / "markdowns"
+MARKDOWN_CHUNKS_DIR = RESULT_DIR / "markdown_chunks"
 ANALYSES_DIR = RESULT_DIR / "analyses"
 REPORTS_DIR = RESULT_DIR / "reports"
+PARTIAL_REPORTS_DIR = REPORTS_DIR / "partials"
 BRAINSTORMS_DIR = RESULT_DIR / "brainstorms"
 PAPER_WRITING_DIR = RESULT_DIR / "paper_writing"
+PAPER_REVISIONS_DIR = PAPER_WRITING_DIR / "revisions"
+EXPORT_CACHE_DIR = RESULT_DIR / "exports"
 
 # 确保所有目录都存在
 for dir_path in [
@@ -31,60 +40,208 @@ for dir_path in [
 COMPREHENSIVE_REPORT_PATH = REPORTS_DIR / "Comprehensive_Report.md"
 BRAINSTORMING_RESULTS_PATH = BRAINSTORMS_DIR / "Brainstorming_Results.md"
 PROMPTS_FILE_PATH = PROMPTS_DIR / "prompts.json"
+PAPER_INDEX_PATH = RESULT_DIR / "paper_index.json"
 
 
-def load_prompts():
-    """从JSON文件加载所有提示词"""
-    if not PROMPTS_FILE_PATH.exists():
-        raise FileNotFoundError(f"提示词文件未找到: {PROMPTS_FILE_PATH}")
-    with open(PROMPTS_FILE_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+def _write_json_atomic(file_path: Path, data, **dump_kwargs):
+    """先写入同目录下的临时文件再原子替换目标文件，写入中途崩溃不会留下损坏的 JSON。"""
+    tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        os.replace(tmp_path, file_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+# --- 文献状态索引 ---
+# 索引记录每个PDF的哈希、大小、修改时间，以及已生成的 Markdown 和分析报告，持久化在 PAPER_INDEX_PATH。
+# 每次查询只需 stat 三个目录：目录的修改时间未变化时直接使用内存中的索引，
+# 变化时才重新列出该目录，并且只为大小或修改时间发生变化的PDF重新计算哈希。
+_paper_index = None
+_paper_index_lock = threading.RLock()
+
+# 目录修改时间距今不足该值（纳秒）时不记录，下次查询时再扫描一次，避免文件系统时间精度导致漏掉同一时刻的变更
+_DIR_MTIME_SETTLE_NS = 2 * 10**9
+
+
+def _compute_sha256(file_path: Path) -> str:
+    """计算文件内容的 SHA-256 哈希"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_paper_index():
+    """从磁盘加载索引；文件不存在或损坏时返回空索引（下次刷新时会完整扫描）"""
+    empty_index = {"dir_mtimes": {}, "pdfs": {}, "markdowns": [], "analyses": []}
+    if not PAPER_INDEX_PATH.exists():
+        return empty_index
+    try:
+        with open(PAPER_INDEX_PATH, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return empty_index
+    index["markdowns"] = set(index.get("markdowns", []))
+    index["analyses"] = set(index.get("analyses", []))
+    return {**empty_index, **index}
+
+
+def _save_paper_index(index: dict):
+    """将索引原子地写入磁盘"""
+    data = {**index, "markdowns": sorted(index["markdowns"]), "analyses": sorted(index["analyses"])}
+    _write_json_atomic(PAPER_INDEX_PATH, data)
+
+
+def _scan_pdfs(index: dict):
+    """重新列出 papers 目录，沿用大小和修改时间未变化的PDF的哈希"""
+    old_pdfs = index["pdfs"]
+    pdfs = {}
+    with os.scandir(PAPERS_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".pdf") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            old = old_pdfs.get(entry.name)
+            if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+                pdfs[entry.name] = old
+            else:
+                pdfs[entry.name] = {
+                    "sha256": _compute_sha256(Path(entry.path)),
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                }
+    index["pdfs"] = pdfs
+
+
+def _scan_stems(dir_path: Path) -> set:
+    """列出目录中所有 .md 文件的文件名（不含扩展名）"""
+    with os.scandir(dir_path) as entries:
+        return {entry.name[:-3] for entry in entries if entry.name.endswith(".md")}
+
+
+def _refresh_paper_index():
+    """按目录修改时间增量刷新索引，返回最新的索引；有变化时持久化到磁盘"""
+    global _paper_index
+    with _paper_index_lock:
+        if _paper_index is None:
+            _paper_index = _load_paper_index()
+        index = _paper_index
+
+        scanners = {
+            "papers": (PAPERS_DIR, lambda: _scan_pdfs(index)),
+            "markdowns": (MARKDOWNS_DIR, lambda: index.update(markdowns=_scan_stems(MARKDOWNS_DIR))),
+            "analyses": (ANALYSES_DIR, lambda: index.update(analyses=_scan_stems(ANALYSES_DIR))),
+        }
+        changed = False
+        now_ns = time.time_ns()
+        for name, (dir_path, scan) in scanners.items():
+            dir_mtime = dir_path.stat().st_mtime_ns
+            recorded = index["dir_mtimes"].get(name)
+            if recorded is not None and recorded == dir_mtime:
+                continue
+            scan()
+            index["dir_mtimes"][name] = dir_mtime if now_ns - dir_mtime > _DIR_MTIME_SETTLE_NS else None
+            changed = True
+        if changed:
+            _save_paper_index(index)
+        return index
 
 
 def get_paper_status_list():
     """获取papers目录下所有PDF文件的状态"""
-    pdf_files = [f for f in PAPERS_DIR.glob("*.pdf")]
+    index = _refresh_paper_index()
     status_list = []
-    for pdf_path in pdf_files:
-        file_name_stem = pdf_path.stem
-        markdown_path = MARKDOWNS_DIR / f"{file_name_stem}.md"
-        analysis_path = ANALYSES_DIR / f"{file_name_stem}.md"
+    for filename in sorted(index["pdfs"]):
+        file_name_stem = Path(filename).stem
+        markdown_exists = file_name_stem in index["markdowns"]
+        analysis_exists = file_name_stem in index["analyses"]
         status_list.append({
-            "filename": pdf_path.name,
-            "markdown_exists": markdown_path.exists(),
-            "analysis_exists": analysis_path.exists(),
-            "processed": markdown_path.exists() and analysis_path.exists()
+            "filename": filename,
+            "markdown_exists": markdown_exists,
+            "analysis_exists": analysis_exists,
+            "processed": markdown_exists and analysis_exists
         })
     return status_list
 
 
+def get_pdf_sha256(file_path: Path) -> str:
+    """
+    返回PDF文件内容的 SHA-256 哈希。
+    若索引中的记录与文件当前的大小和修改时间一致，直接使用索引中的哈希，否则重新计算。
+    """
+    stat = file_path.stat()
+    with _paper_index_lock:
+        if _paper_index is not None:
+            record = _paper_index["pdfs"].get(file_path.name)
+            if (record and file_path.parent == PAPERS_DIR and record["size"] == stat.st_size
+                    and record["mtime_ns"] == stat.st_mtime_ns):
+                return record["sha256"]
+    return _compute_sha256(file_path)
+
+
+def _update_search_index(kind: str, name: str, content):
+    """通知全文检索索引在后台更新（延迟导入，search_service 依赖本模块）"""
+    from services import search_service
+    search_service.schedule_update(kind, name, content)
+
+
 def save_markdown_result(filename_stem: str, content: str):
     """保存Markdown转换结果"""
     with open(MARKDOWNS_DIR / f"{filename_stem}.md", "w", encoding="utf-8") as f:
         f.write(content)
+    _update_search_index("markdown", filename_stem, content)
 
 
 def save_analysis_result(filename_stem: str, content: str):
     """保存单篇分析结果"""
     with open(ANALYSES_DIR / f"{filename_stem}.md", "w", encoding="utf-8") as f:
         f.write(content)
+    _update_search_index("analysis", filename_stem, content)
 
 
 def get_analyzed_papers():
     """获取所有已分析的文章列表"""
-    return [f.stem for f in ANALYSES_DIR.glob("*.md")]
+    return sorted(_refresh_paper_index()["analyses"])
 
 
-def get_combined_analysis_text(filenames_stems: list):
-    """读取并合并多个分析文件的内容"""
-    combined_text = ""
+# 文件内容缓存：路径 -> (修改时间, 文件大小, 内容)，文件未变化时无需再次读取磁盘
+_text_cache = {}
+
+
+def read_text_cached(file_path: Path):
+    """读取文本文件内容；文件的修改时间和大小未变化时直接返回缓存内容"""
+    stat = file_path.stat()
+    cached = _text_cache.get(file_path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    with open(file_path, "r", encoding="utf-8") as f:
+        content = f.read()
+    _text_cache[file_path] = (stat.st_mtime_ns, stat.st_size, content)
+    return content
+
+
+def get_analysis_contents(filenames_stems: list):
+    """读取多个分析文件的内容，返回 (文件名, 内容) 列表，不存在的文件会被跳过"""
+    contents = []
     for stem in filenames_stems:
         file_path = ANALYSES_DIR / f"{stem}.md"
         if file_path.exists():
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                combined_text += f"--- 分析文档: {stem} ---\n\n{content}\n\n"
-    return combined_text
+            contents.append((stem, read_text_cached(file_path)))
+    return contents
+
+
+def format_analysis_documents(contents: list):
+    """将 (文件名, 内容) 列表格式化为带分隔标题的合并文本"""
+    return "".join(f"--- 分析文档: {stem} ---\n\n{content}\n\n" for stem, content in contents)
+
+
+def get_combined_analysis_text(filenames_stems: list):
+    """读取并合并多个分析文件的内容"""
+    return format_analysis_documents(get_analysis_contents(filenames_stems))
 
 
 def save_comprehensive_report(content: str):
@@ -97,22 +254,7 @@ def get_comprehensive_report_content():
     """获取综合分析报告内容"""
     if not COMPREHENSIVE_REPORT_PATH.exists():
         return ""
-    with open(COMPREHENSIVE_REPORT_PATH, "r", encoding="utf-8") as f:
-        return f.read()
-
-
-def get_brainstorming_source_text():
-    """为头脑风暴准备数据源"""
-    report_content = get_comprehensive_report_content()
-    if not report_content:
-        return None, "综合分析报告尚未生成，无法进行头脑风暴。"
-
-    all_analyses_text = get_combined_analysis_text(get_analyzed_papers())
-    combined_source = (
-        f"--- 综合分析报告 (宏观视角) ---\n\n{report_content}\n\n"
-        f"--- 各单篇文献分析详情 (微观细节) ---\n\n{all_analyses_text}"
-    )
-    return combined_source, None
+    return read_text_cached(COMPREHENSIVE_REPORT_PATH)
 
 
 def save_brainstorming_result(content: str):
@@ -179,25 +321,28 @@ def create_new_paper():
     new_paper_data['documentName'] = document_name
 
     # 关键步骤：调用保存函数，实际地创建文件并写入初始内容
-    save_paper_content(document_name, new_paper_data)
+    save_paper_content(document_name, new_paper_data, flush=True)
 
     return {"id": document_name, "documentName": document_name}
 
 
-def get_paper_content(paper_name: str):
-    """
-    只读操作：根据论文名称（文件名）读取并返回其JSON内容。
-    - 如果文件不存在，明确返回 None。
-    - 如果文件存在但格式损坏，返回一个默认结构以防止前端崩溃。
-    - 此函数不再有创建文件的副作用。
-    """
-    paper_path = PAPER_WRITING_DIR / f"{paper_name}.json"
-    if not paper_path.exists():
-        return None
+# --- 论文文档缓存（写回式） ---
+# 解析后的论文保存在内存中（LRU），读取时只需 stat 一次文件以发现外部修改；
+# 保存只更新内存并标记为脏，在 PAPER_FLUSH_DELAY_SECONDS 秒后、被淘汰时或进程退出时统一写回磁盘。
+_paper_cache = OrderedDict()  # 论文名 -> {"data": 论文字典, "mtime_ns": 文件修改时间, "dirty": 是否未写回}
+_paper_cache_lock = threading.RLock()
+_flush_timer = None
+
+
+def _copy_paper(data: dict) -> dict:
+    """复制论文字典（含各章节字典），避免调用方修改缓存中的对象"""
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in data.items()}
+
 
+def _read_paper_file(paper_path: Path) -> dict:
+    """读取并解析论文文件；文件为空或格式损坏时返回一个默认结构以防止前端崩溃"""
     try:
         with open(paper_path, "r", encoding="utf-8") as f:
-            # 确保即使文件为空也能正常处理
             content = f.read()
             if not content:
                 return get_default_paper_structure()
@@ -206,17 +351,168 @@ def get_paper_content(paper_name: str):
         return get_default_paper_structure()
 
 
-def save_paper_content(paper_name: str, data: dict):
+def _write_paper_file(paper_name: str, data: dict) -> int:
+    """原子地写入论文文件，返回写入后的文件修改时间"""
+    paper_path = PAPER_WRITING_DIR / f"{paper_name}.json"
+    _write_json_atomic(paper_path, data, indent=4)
+    return paper_path.stat().st_mtime_ns
+
+
+def _cache_paper(paper_name: str, data: dict, mtime_ns, dirty: bool):
+    """放入缓存并按 LRU 淘汰超出上限的论文，被淘汰的脏论文先写回磁盘"""
+    _paper_cache[paper_name] = {"data": data, "mtime_ns": mtime_ns, "dirty": dirty}
+    _paper_cache.move_to_end(paper_name)
+    while len(_paper_cache) > PAPER_CACHE_MAX_ENTRIES:
+        name, entry = _paper_cache.popitem(last=False)
+        if entry["dirty"]:
+            _write_paper_file(name, entry["data"])
+
+
+def flush_papers(paper_names: list = None):
+    """将缓存中未写回的论文写入磁盘；paper_names 为空时写回全部"""
+    with _paper_cache_lock:
+        for name, entry in _paper_cache.items():
+            if entry["dirty"] and (paper_names is None or name in paper_names):
+                entry["mtime_ns"] = _write_paper_file(name, entry["data"])
+                entry["dirty"] = False
+
+
+def _on_flush_timer():
+    global _flush_timer
+    with _paper_cache_lock:
+        _flush_timer = None
+    flush_papers()
+
+
+def _schedule_flush():
+    global _flush_timer
+    with _paper_cache_lock:
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(PAPER_FLUSH_DELAY_SECONDS, _on_flush_timer)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+atexit.register(flush_papers)
+
+
+def get_paper_content(paper_name: str):
+    """
+    只读操作：根据论文名称（文件名）读取并返回其JSON内容。
+    - 如果文件不存在，明确返回 None。
+    - 如果文件存在但格式损坏，返回一个默认结构以防止前端崩溃。
+    - 此函数不再有创建文件的副作用。
+    - 内容来自文档缓存，返回的是副本，修改后需通过 save_paper_content 保存。
+    """
+    paper_path = PAPER_WRITING_DIR / f"{paper_name}.json"
+    with _paper_cache_lock:
+        entry = _paper_cache.get(paper_name)
+        if entry is not None and not entry["dirty"]:
+            # 文件在外部被修改或删除时丢弃缓存
+            try:
+                if paper_path.stat().st_mtime_ns != entry["mtime_ns"]:
+                    entry = None
+            except FileNotFoundError:
+                del _paper_cache[paper_name]
+                return None
+        if entry is not None:
+            _paper_cache.move_to_end(paper_name)
+            return _copy_paper(entry["data"])
+
+        if not paper_path.exists():
+            return None
+        mtime_ns = paper_path.stat().st_mtime_ns
+        data = _read_paper_file(paper_path)
+        _cache_paper(paper_name, data, mtime_ns, dirty=False)
+        return _copy_paper(data)
+
+
+def save_paper_content(paper_name: str, data: dict, flush: bool = False):
     """
     核心保存函数：将给定的论文数据（字典）写入到指定的 .json 文件中。
-    此函数用于创建新文件和更新现有文件。
+    此函数用于创建新文件和更新现有文件。每次保存都会将版本号加一。
+    数据先写入文档缓存，稍后再原子地写回磁盘；flush 为 True 时立即写回。
     """
     data['documentName'] = paper_name
     data['id'] = paper_name
+    data['version'] = data.get('version', 0) + 1
+
+    with _paper_cache_lock:
+        _cache_paper(paper_name, _copy_paper(data), None, dirty=True)
+        if flush:
+            flush_papers([paper_name])
+    if not flush:
+        _schedule_flush()
+    _update_search_index("paper", paper_name,
+                         {key: (data.get(key) or {}).get('content', '') for key in PAPER_STRUCTURE_MAP})
+
+
+class PaperVersionConflict(Exception):
+    """增量保存时，要保存的章节在客户端所基于的版本之后已被修改。"""
+
+    def __init__(self, current_version: int, sections: list):
+        names = "、".join(PAPER_STRUCTURE_MAP[key]['name'] for key in sections)
+        super().__init__(f"以下章节已被修改（当前版本 {current_version}）: {names}，请重新加载后再编辑。")
+        self.current_version = current_version
+        self.sections = sections
+
+
+# 每篇论文一把锁，保证增量保存的“读取-合并-写入”不会交错执行
+_paper_locks = {}
+_paper_locks_guard = threading.Lock()
 
-    paper_path = PAPER_WRITING_DIR / f"{paper_name}.json"
-    with open(paper_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+
+def _get_paper_lock(paper_name: str):
+    with _paper_locks_guard:
+        return _paper_locks.setdefault(paper_name, threading.Lock())
+
+
+def patch_paper_sections(paper_name: str, sections: dict, base_version: int, on_saved=None,
+                         section_base_versions: dict = None) -> int:
+    """
+    增量保存：只更新发生变化的章节，返回保存后的新版本号。
+    冲突按章节检测：论文中 section_versions 记录了每个章节最后一次增量保存时的版本号，
+    只有要保存的章节在客户端所基于的版本之后被修改过时才拒绝保存，
+    因此草稿生成等写入其他章节时不会影响正在编辑的章节。
+
+    Args:
+        paper_name (str): 论文名称。
+        sections (dict): 章节 key -> 需要更新的字段（如 content、status）。
+        base_version (int): 客户端修改所基于的版本号；为 None 时不检查冲突（用于服务端自身的写入，如草稿生成）。
+        on_saved (callable, optional): 保存后在同一把锁内调用，参数为 {章节key: (修改前内容, 修改后内容)}，
+            用于按保存顺序记录修订历史；调用期间其他保存需要等待，因此只应做轻量操作（如放入队列）。
+        section_base_versions (dict, optional): 章节 key -> 该章节所基于的版本号，未提供的章节使用 base_version。
+
+    Raises:
+        FileNotFoundError: 论文不存在。
+        PaperVersionConflict: 要保存的章节已被其他写入修改。
+        ValueError: 包含未知的章节 key。
+    """
+    unknown_keys = [key for key in sections if key not in PAPER_STRUCTURE_MAP]
+    if unknown_keys:
+        raise ValueError(f"未知的论文部分: {', '.join(unknown_keys)}")
+
+    with _get_paper_lock(paper_name):
+        data = get_paper_content(paper_name)
+        if data is None:
+            raise FileNotFoundError(f"论文未找到: {paper_name}")
+        current_version = data.get('version', 0)
+        section_versions = data.setdefault('section_versions', {})
+        if base_version is not None:
+            section_base_versions = section_base_versions or {}
+            conflicts = [key for key in sections
+                         if section_versions.get(key, 0) > section_base_versions.get(key, base_version)]
+            if conflicts:
+                raise PaperVersionConflict(current_version, conflicts)
+        previous_contents = {key: data.get(key, {}).get('content', '') for key in sections}
+        for key, fields in sections.items():
+            data.setdefault(key, {"content": "", "status": "empty"}).update(fields)
+            # save_paper_content 会将版本号加一
+            section_versions[key] = current_version + 1
+        save_paper_content(paper_name, data)
+        if on_saved is not None:
+            on_saved({key: (previous_contents[key], data[key]['content']) for key in sections})
+        return data['version']
 
 
 def delete_paper(paper_name: str) -> bool:
@@ -225,19 +521,29 @@ def delete_paper(paper_name: str) -> bool:
     如果文件存在并成功删除，返回 True，否则返回 False。
     """
     paper_path = PAPER_WRITING_DIR / f"{paper_name}.json"
-    if paper_path.exists():
-        paper_path.unlink()
-        return True
+    # 持有论文锁，避免并发的增量保存在删除之后把缓存中的论文写回磁盘
+    with _get_paper_lock(paper_name), _paper_cache_lock:
+        # 同时丢弃尚未写回的修改
+        cached = _paper_cache.pop(paper_name, None)
+        if paper_path.exists() or (cached is not None and cached["dirty"]):
+            paper_path.unlink(missing_ok=True)
+            _update_search_index("paper", paper_name, None)
+            return True
     return False
 
 
+def sanitize_paper_name(name: str) -> str:
+    """去除论文名称中不能用于文件名的字符"""
+    return re.sub(r'[\\/*?:"<>|]', "", name).strip()
+
+
 def rename_paper(old_name: str, new_name: str) -> (bool, str):
     """
     重命名一篇论文，这包括：
     1. 物理重命名 .json 文件。
     2. 更新文件内部的 'id' 和 'documentName' 字段以保持一致。
     """
-    safe_new_name = re.sub(r'[\\/*?:"<>|]', "", new_name).strip()
+    safe_new_name = sanitize_paper_name(new_name)
     if not safe_new_name:
         return False, "新名称无效"
 
@@ -259,8 +565,11 @@ def rename_paper(old_name: str, new_name: str) -> (bool, str):
         data['documentName'] = safe_new_name
         data['id'] = safe_new_name
 
-        save_paper_content(safe_new_name, data)
-        old_path.unlink()
+        save_paper_content(safe_new_name, data, flush=True)
+        with _paper_cache_lock:
+            _paper_cache.pop(old_name, None)
+            old_path.unlink()
+        _update_search_index("paper", old_name, None)
 
         return True, "重命名成功"
     except Exception as e:
@@ -0,0 +1,217 @@
+# services/governor_service.py
+"""
+Gemini 调用治理服务：所有模型调用都经过这里。
+
+- 限流：每个 (API Key, 模型) 一个令牌桶，调用前取得令牌，超出速率时阻塞等待；
+  收到 429 时清空令牌桶，使同一配额下的其他调用也暂停，而不是继续撞上限。
+- 重试：429、5xx 和网络错误按指数退避（带随机抖动）重试，其余错误直接抛出。
+- 熔断：连续失败达到阈值后断路器打开，冷却期内的调用立即失败；
+  冷却结束后放行一次试探调用，成功则恢复，失败则继续熔断。
+"""
+import logging
+import random
+import threading
+import time
+
+import httpx
+from google.genai import errors
+
+from config import (
+    GOVERNOR_RATE_LIMIT_PER_MINUTE, GOVERNOR_MODEL_RATE_LIMITS, GOVERNOR_BURST,
+    GOVERNOR_MAX_RETRIES, GOVERNOR_BACKOFF_BASE_SECONDS, GOVERNOR_BACKOFF_MAX_SECONDS,
+    GOVERNOR_BREAKER_FAILURE_THRESHOLD, GOVERNOR_BREAKER_COOLDOWN_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """断路器处于打开状态时拒绝调用。"""
+
+
+class TokenBucket:
+    """
+    令牌桶限流器：以每分钟 `rate_per_minute` 个的速率补充令牌，最多积累 `capacity` 个。
+    `acquire` 在没有令牌时阻塞，返回实际等待的秒数。
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+            waited += wait_time
+
+    def drain(self):
+        """清空令牌（收到 429 时调用）。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
+
+
+class CircuitBreaker:
+    """连续失败计数的断路器，状态为 closed / open / half_open。"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            # 冷却结束后放行一次试探调用；试探调用未能结束（如线程被中断）时，再过一个冷却期放行下一次
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回断路器是否因此打开。"""
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                opened = self.state != "open"
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                return opened
+            return False
+
+
+# 每个 (API Key, 模型) 对应一个令牌桶和一个断路器
+_buckets = {}
+_breakers = {}
+_registry_lock = threading.Lock()
+
+_metrics = {
+    "calls": 0,
+    "successes": 0,
+    "failures": 0,
+    "retries": 0,
+    "throttled_calls": 0,
+    "throttle_wait_seconds": 0.0,
+    "backoff_wait_seconds": 0.0,
+    "rate_limited_responses": 0,
+    "circuit_opened": 0,
+    "circuit_rejections": 0,
+}
+_metrics_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _metrics_lock:
+        for name, value in increments.items():
+            _metrics[name] += value
+
+
+def _get_governors(api_key: str, model_name: str):
+    key = (api_key, model_name)
+    with _registry_lock:
+        if key not in _buckets:
+            rate = GOVERNOR_MODEL_RATE_LIMITS.get(model_name, GOVERNOR_RATE_LIMIT_PER_MINUTE)
+            _buckets[key] = TokenBucket(rate, GOVERNOR_BURST)
+            _breakers[key] = CircuitBreaker(GOVERNOR_BREAKER_FAILURE_THRESHOLD, GOVERNOR_BREAKER_COOLDOWN_SECONDS)
+        return _buckets[key], _breakers[key]
+
+
+def is_retryable(error: Exception) -> bool:
+    """429、5xx 和网络传输错误被视为暂时性错误，可以重试。"""
+    if isinstance(error, errors.APIError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """第 attempt 次重试前的等待时间：指数增长的上限内均匀随机（full jitter）。"""
+    return random.uniform(0, min(GOVERNOR_BACKOFF_MAX_SECONDS, GOVERNOR_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def call(api_key: str, model_name: str, func):
+    """
+    在限流、重试和熔断的保护下执行一次模型调用。
+
+    Args:
+        api_key (str): Google API Key。
+        model_name (str): 模型名称，与 API Key 一起决定使用哪个令牌桶和断路器。
+        func (callable): 无参数的调用函数，每次重试都会重新执行。
+
+    Returns:
+        func 的返回值。
+
+    Raises:
+        CircuitOpenError: 断路器处于打开状态。
+        Exception: 不可重试的错误，或重试次数用尽后的最后一次错误。
+    """
+    bucket, breaker = _get_governors(api_key, model_name)
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            _count(circuit_rejections=1)
+            raise CircuitOpenError(
+                f"模型 '{model_name}' 的调用连续失败，已暂停 {GOVERNOR_BREAKER_COOLDOWN_SECONDS} 秒，请稍后重试。")
+
+        waited = bucket.acquire()
+        _count(calls=1, throttled_calls=1 if waited else 0, throttle_wait_seconds=waited)
+        try:
+            result = func()
+        except Exception as e:
+            if not is_retryable(e):
+                # 请求本身的错误（如参数错误）不代表服务不可用，按成功结束试探并重置连续失败计数
+                breaker.record_success()
+                _count(failures=1)
+                raise
+            if isinstance(e, errors.APIError) and e.code == 429:
+                bucket.drain()
+                _count(rate_limited_responses=1)
+            if breaker.record_failure():
+                _count(circuit_opened=1)
+            if attempt >= GOVERNOR_MAX_RETRIES or breaker.state == "open":
+                _count(failures=1)
+                raise
+            delay = _backoff_delay(attempt)
+            attempt += 1
+            logger.warning("模型 '%s' 调用失败 (%s)，%.1f 秒后进行第 %d 次重试...", model_name, e, delay, attempt)
+            _count(retries=1, backoff_wait_seconds=delay)
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        _count(successes=1)
+        return result
+
+
+def get_metrics() -> dict:
+    """返回调用治理的统计信息以及当前处于非闭合状态的断路器。"""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["throttle_wait_seconds"] = round(metrics["throttle_wait_seconds"], 3)
+    metrics["backoff_wait_seconds"] = round(metrics["backoff_wait_seconds"], 3)
+    with _registry_lock:
+        metrics["open_circuits"] = [model for (_, model), breaker in _breakers.items() if breaker.state != "closed"]
+    return metrics
@@ -0,0 +1,229 @@
+# services/job_service.py
+"""
+后台任务服务。
+
+所有耗时的 LLM 工作都可以作为任务提交：接口立即返回任务ID，任务在后台线程中执行，
+状态与结果持久化在 SQLite 数据库中，可通过轮询或 SSE 获取，浏览器刷新或服务重启后不会丢失。
+
+出于安全考虑，API Key 只保存在内存中。服务重启时尚未完成的任务会被标记为 `interrupted`，
+需要调用方重新提供 API Key 后恢复执行。
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOB_MAX_WORKERS
+from services.file_service import RESULT_DIR
+
+JOBS_DIR = RESULT_DIR / "jobs"
+JOBS_DB_PATH = JOBS_DIR / "jobs.sqlite3"
+
+# 任务状态
+QUEUED, RUNNING, SUCCEEDED, FAILED, INTERRUPTED = "queued", "running", "succeeded", "failed", "interrupted"
+FINISHED_STATUSES = {SUCCEEDED, FAILED, INTERRUPTED}
+
+_conn = None
+_lock = threading.Lock()
+
+# 任务类型 -> (处理函数, 执行器)
+_handlers = {}
+_default_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="job")
+
+# 仅保存在内存中的 API Key，任务结束后立即移除
+_api_keys = {}
+
+
+def _get_conn():
+    """延迟打开数据库连接，并将上次运行遗留的未完成任务标记为中断（调用方需持有 _lock）。"""
+    global _conn
+    if _conn is None:
+        JOBS_DIR.mkdir(exist_ok=True)
+        _conn = sqlite3.connect(JOBS_DB_PATH, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " type TEXT NOT NULL,"
+            " group_id TEXT,"
+            " status TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " progress TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_group ON jobs(group_id)")
+        _conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status IN (?, ?)",
+            (INTERRUPTED, "服务重启导致任务中断，请重新提供 API Key 以恢复执行。", time.time(), QUEUED, RUNNING),
+        )
+        _conn.commit()
+    return _conn
+
+
+def _row_to_job(row) -> dict:
+    return {
+        "id": row["id"],
+        "type": row["type"],
+        "group_id": row["group_id"],
+        "status": row["status"],
+        "params": json.loads(row["params"]),
+        "progress": json.loads(row["progress"]) if row["progress"] else None,
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+def _update_job(job_id: str, **fields):
+    fields["updated_at"] = time.time()
+    for name in ("progress", "result"):
+        if name in fields and fields[name] is not None:
+            fields[name] = json.dumps(fields[name], ensure_ascii=False)
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with _lock:
+        conn = _get_conn()
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        conn.commit()
+
+
+def register_handler(job_type: str, handler, max_workers: int = None):
+    """
+    注册一种任务类型的处理函数。
+
+    Args:
+        job_type (str): 任务类型名称。
+        handler (callable): 签名为 `handler(params, api_key, report_progress)` 的函数，
+                            返回值（可 JSON 序列化）将作为任务结果保存。
+                            `report_progress(dict)` 可用于上报中间进度。
+        max_workers (int, optional): 指定时为该任务类型创建独立的线程池，
+                                     避免大批量任务占满通用线程池。
+    """
+    executor = _default_executor
+    if max_workers is not None:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"job-{job_type}")
+    _handlers[job_type] = (handler, executor)
+
+
+def is_registered(job_type: str) -> bool:
+    return job_type in _handlers
+
+
+def _run_job(job_id: str, job_type: str, params: dict):
+    handler, _ = _handlers[job_type]
+    api_key = _api_keys.get(job_id)
+    _update_job(job_id, status=RUNNING)
+    try:
+        result = handler(params, api_key, lambda progress: _update_job(job_id, progress=progress))
+        _update_job(job_id, status=SUCCEEDED, result=result, error=None)
+    except Exception as e:
+        _update_job(job_id, status=FAILED, error=str(e))
+    finally:
+        _api_keys.pop(job_id, None)
+
+
+def _enqueue(job_id: str, job_type: str, params: dict, api_key: str):
+    _api_keys[job_id] = api_key
+    _, executor = _handlers[job_type]
+    executor.submit(_run_job, job_id, job_type, params)
+
+
+def submit(job_type: str, params: dict, api_key: str, group_id: str = None) -> str:
+    """
+    提交一个任务并立即返回任务ID。`params` 会被持久化，因此不应包含 API Key。
+    """
+    if job_type not in _handlers:
+        raise ValueError(f"未知的任务类型: {job_type}")
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT INTO jobs (id, type, group_id, status, params, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, job_type, group_id, QUEUED, json.dumps(params, ensure_ascii=False), now, now),
+        )
+        conn.commit()
+    _enqueue(job_id, job_type, params, api_key)
+    return job_id
+
+
+def resume(job_id: str, api_key: str):
+    """
+    重新执行一个已中断或失败的任务。
+    返回 (是否成功, 提示信息)。
+    """
+    job = get_job(job_id)
+    if job is None:
+        return False, "任务未找到"
+    if job["status"] not in (INTERRUPTED, FAILED):
+        return False, f"任务当前状态为 {job['status']}，无法恢复"
+    if job["type"] not in _handlers:
+        return False, f"未知的任务类型: {job['type']}"
+    # 状态检查与更新在同一条语句中完成，同一任务被并发恢复时只有一个请求会重新提交
+    with _lock:
+        conn = _get_conn()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, error = NULL, progress = NULL, updated_at = ?"
+            " WHERE id = ? AND status IN (?, ?)",
+            (QUEUED, time.time(), job_id, INTERRUPTED, FAILED))
+        conn.commit()
+    if cursor.rowcount == 0:
+        return False, "任务状态已改变，无法恢复"
+    _enqueue(job_id, job["type"], job["params"], api_key)
+    return True, "任务已重新提交"
+
+
+def get_job(job_id: str):
+    """返回任务详情；任务不存在时返回 None。"""
+    with _lock:
+        row = _get_conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(job_type: str = None, group_id: str = None, limit: int = 50) -> list:
+    """按创建时间倒序列出任务，可按类型或分组过滤。"""
+    conditions, args = [], []
+    if job_type:
+        conditions.append("type = ?")
+        args.append(job_type)
+    if group_id:
+        conditions.append("group_id = ?")
+        args.append(group_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with _lock:
+        rows = _get_conn().execute(
+            f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?", (*args, limit)).fetchall()
+    return [_row_to_job(row) for row in rows]
+
+
+def list_group(group_id: str) -> list:
+    """按提交顺序列出同一分组（例如同一批处理）下的所有任务。"""
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT * FROM jobs WHERE group_id = ? ORDER BY created_at ASC, rowid ASC", (group_id,)).fetchall()
+    return [_row_to_job(row) for row in rows]
+
+
+def iter_job_updates(job_id: str, poll_interval: float = 1.0):
+    """
+    持续产出任务的最新状态，仅在状态、进度或结果变化时产出，任务结束后停止。
+    用于 SSE 推送任务进度。
+    """
+    last_updated_at = None
+    while True:
+        job = get_job(job_id)
+        if job is None:
+            return
+        if job["updated_at"] != last_updated_at:
+            last_updated_at = job["updated_at"]
+            yield job
+        if job["status"] in FINISHED_STATUSES:
+            return
+        time.sleep(poll_interval)
@@ -1,90 +1,550 @@
 # services/llm_service.py
+import atexit
+import hashlib
+import itertools
+import logging
 import pathlib
-from google import genai
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 from google.genai import types
 
+from config import CLIENT_POOL_IDLE_SECONDS, PDF_UPLOAD_TTL_SECONDS, CONTEXT_CACHE_TTL_SECONDS
+from services import backend_service, cache_service, file_service, governor_service, metrics_service, pdf_service
+from services.metrics_service import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledClient:
+    """连接池中的一个客户端及其使用情况。"""
+
+    def __init__(self, client):
+        self.client = client
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+# 模型客户端（默认为 genai.Client，见 backend_service）连接池，按 API Key 索引，复用底层的 HTTP 长连接
+_client_pool = {}
+_client_pool_lock = threading.Lock()
+
+
+def _evict_idle_clients():
+    """关闭并移除空闲时间超过 CLIENT_POOL_IDLE_SECONDS 且未被占用的客户端。"""
+    now = time.monotonic()
+    with _client_pool_lock:
+        idle_keys = [key for key, pooled in _client_pool.items()
+                     if pooled.in_use == 0 and now - pooled.last_used > CLIENT_POOL_IDLE_SECONDS]
+        evicted = [_client_pool.pop(key) for key in idle_keys]
+    for pooled in evicted:
+        try:
+            pooled.client.close()
+        except Exception as e:
+            logger.warning("关闭空闲的 GenAI Client 时出错: %s", e)
+
+
+def _checkout(api_key: str) -> _PooledClient:
+    if not api_key:
+        raise ValueError("API Key 不能为空。请在首页配置API Key。")
+    _evict_idle_clients()
+    with _client_pool_lock:
+        pooled = _client_pool.get(api_key)
+        if pooled is None:
+            try:
+                pooled = _PooledClient(backend_service.create_client(api_key))
+            except Exception as e:
+                # 捕获可能的初始化错误，例如无效的密钥格式
+                raise ConnectionError(f"初始化Google GenAI Client时出错: {e}")
+            _client_pool[api_key] = pooled
+        pooled.in_use += 1
+        pooled.last_used = time.monotonic()
+        return pooled
+
+
+def _checkin(pooled: _PooledClient):
+    with _client_pool_lock:
+        pooled.in_use -= 1
+        pooled.last_used = time.monotonic()
+
+
+@contextmanager
+def checkout_client(api_key: str):
+    """
+    从连接池中借出指定 API Key 的 genai.Client，使用期间不会被空闲回收。
+    同一个 API Key 的所有调用共享一个客户端，从而复用 HTTP 长连接和认证配置。
+    """
+    pooled = _checkout(api_key)
+    try:
+        yield pooled.client
+    finally:
+        _checkin(pooled)
+
 
 def get_client(api_key: str):
     """
-    根据传入的API Key动态创建并返回一个genai.Client实例。
+    返回连接池中指定 API Key 的 genai.Client 实例，不存在时创建。
     严格遵循官方文档的密钥配置方式。
+    适用于返回值会脱离调用范围的场景（例如多轮对话）；其他场景请使用 `checkout_client`。
     """
-    if not api_key:
-        raise ValueError("API Key 不能为空。请在首页配置API Key。")
+    pooled = _checkout(api_key)
+    _checkin(pooled)
+    return pooled.client
+
+
+class _UploadedFile:
+    """记录一个已上传到远端的PDF文件句柄及其使用情况。"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.handle = None
+        self.refs = 0
+        self.expire_timer = None
+        self.lock = threading.Lock()
+
+
+# 已上传文件的缓存，按 (API Key, 文件内容哈希) 索引
+_uploaded_files = {}
+_uploaded_files_lock = threading.Lock()
+
+
+def _delete_uploaded_file(entry: _UploadedFile):
+    """删除远端文件句柄，删除失败时仅记录警告（远端文件最终也会自动过期）。"""
     try:
-        return genai.Client(api_key=api_key)
+        with checkout_client(entry.api_key) as client, metrics_service.span("delete_file", "files"):
+            client.files.delete(name=entry.handle.name)
+        logger.info("已清理上传的文件: %s", entry.handle.name)
     except Exception as e:
-        # 捕获可能的初始化错误，例如无效的密钥格式
-        raise ConnectionError(f"初始化Google GenAI Client时出错: {e}")
+        logger.warning("清理上传的文件 %s 时出错: %s", entry.handle.name, e)
 
 
-def analyze_pdf_content(file_path: pathlib.Path, prompt: str, model_name: str, temperature: float, api_key: str):
+def _expire_uploaded_file(key, entry: _UploadedFile):
+    """TTL 到期回调：仅当句柄仍处于空闲状态时才将其删除。"""
+    with _uploaded_files_lock:
+        if entry.refs > 0 or _uploaded_files.get(key) is not entry:
+            return
+        del _uploaded_files[key]
+    if entry.handle is not None:
+        _delete_uploaded_file(entry)
+
+
+def _acquire_uploaded_file(client, file_path: pathlib.Path, api_key: str, file_hash: str = None):
     """
-    严格按照官方文档，分析单个PDF文件。
+    获取PDF文件的远端句柄。同一内容的文件只会上传一次，
+    并发的多次分析共享同一个句柄。返回 (缓存键, 句柄)。
     """
-    client = get_client(api_key)  # 动态获取客户端
+    key = (api_key, file_hash or file_service.get_pdf_sha256(file_path))
+    with _uploaded_files_lock:
+        entry = _uploaded_files.get(key)
+        if entry is None:
+            entry = _UploadedFile(api_key)
+            _uploaded_files[key] = entry
+        entry.refs += 1
+        if entry.expire_timer is not None:
+            entry.expire_timer.cancel()
+            entry.expire_timer = None
+
+    try:
+        with entry.lock:
+            if entry.handle is None:
+                logger.info("正在上传文件: %s...", file_path.name)
+                with metrics_service.span("upload", "files", bytes=file_path.stat().st_size):
+                    entry.handle = governor_service.call(api_key, "files",
+                                                         lambda: client.files.upload(file=file_path))
+                logger.info("文件上传成功: %s", entry.handle.name)
+            else:
+                logger.info("复用已上传的文件: %s", entry.handle.name, extra=SAMPLED)
+    except Exception:
+        _release_uploaded_file(key)
+        raise
+    return key, entry.handle
+
+
+def _release_uploaded_file(key):
+    """
+    释放对远端句柄的引用。当没有任何分析在使用该句柄时，
+    在 PDF_UPLOAD_TTL_SECONDS 秒后删除它（TTL 为 0 时立即删除）。
+    """
+    with _uploaded_files_lock:
+        entry = _uploaded_files[key]
+        entry.refs -= 1
+        if entry.refs > 0:
+            return
+        if entry.handle is None:
+            del _uploaded_files[key]
+            return
+        if PDF_UPLOAD_TTL_SECONDS > 0:
+            entry.expire_timer = threading.Timer(PDF_UPLOAD_TTL_SECONDS, _expire_uploaded_file, args=(key, entry))
+            entry.expire_timer.daemon = True
+            entry.expire_timer.start()
+            return
+    _expire_uploaded_file(key, entry)
+
+
+@atexit.register
+def _cleanup_uploaded_files():
+    """进程退出前清理所有空闲的远端文件句柄。"""
+    with _uploaded_files_lock:
+        idle = [(key, entry) for key, entry in _uploaded_files.items() if entry.refs == 0]
+    for key, entry in idle:
+        if entry.expire_timer is not None:
+            entry.expire_timer.cancel()
+        _expire_uploaded_file(key, entry)
+
+
+class _ContextCache:
+    """记录一个远端上下文缓存（CachedContent）及引用它的标签。"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.name = None
+        self.expires_at = 0.0
+        self.labels = set()
+        self.lock = threading.Lock()
+        self.discarded = False
+
+
+# 上下文缓存按 (API Key, 模型, 资料内容哈希) 索引，内容相同的资料共享同一个远端缓存；
+# 标签 (API Key, 模型, 标签) -> 内容哈希 记录每个资料来源（如某篇论文的某个章节）当前使用的缓存，
+# 来源的资料变化后旧缓存不再被任何标签引用，会被立即删除，而不是等到过期
+_context_caches = {}
+_context_labels = {}
+_context_caches_lock = threading.Lock()
+
+
+def _delete_context_cache(entry: _ContextCache):
+    """删除远端上下文缓存，删除失败时仅记录警告（远端缓存到期后也会自动删除）。"""
+    try:
+        with checkout_client(entry.api_key) as client, metrics_service.span("delete_cache"):
+            client.caches.delete(name=entry.name)
+        logger.info("已删除上下文缓存: %s", entry.name)
+    except Exception as e:
+        logger.warning("删除上下文缓存 %s 时出错: %s", entry.name, e)
+
+
+def _unlink_label(label_key) -> list:
+    """解除标签与缓存的关联，返回因此不再被引用、需要删除的缓存（调用方需持有 _context_caches_lock）。"""
+    digest = _context_labels.pop(label_key, None)
+    if digest is None:
+        return []
+    key = (*label_key[:2], digest)
+    entry = _context_caches.get(key)
+    if entry is None:
+        return []
+    entry.labels.discard(label_key[2])
+    if entry.labels:
+        return []
+    del _context_caches[key]
+    return [entry] if entry.name is not None else []
+
 
+def _discard_context_cache(key, entry: _ContextCache):
+    """移除创建失败、没有对应远端缓存的记录及其标签，下次请求时重新创建。"""
+    with _context_caches_lock:
+        entry.discarded = True
+        if _context_caches.get(key) is entry:
+            del _context_caches[key]
+        for label in entry.labels:
+            label_key = (*key[:2], label)
+            if _context_labels.get(label_key) == key[2]:
+                del _context_labels[label_key]
+
+
+def _acquire_context_cache(client, api_key: str, model_name: str, context: str, label: str = None) -> str:
+    """
+    返回包含 context 的远端上下文缓存名称，必要时创建缓存或延长其有效期。
+    label 标识资料的来源，同一来源的资料变化后，旧的缓存会被删除。
+    """
+    digest = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    key = (api_key, model_name, digest)
+    stale = []
+    with _context_caches_lock:
+        now = time.monotonic()
+        # 清理已过期的本地记录（远端缓存到期后已被自动删除）
+        for expired_key in [k for k, e in _context_caches.items() if e.name is not None and e.expires_at <= now]:
+            expired = _context_caches.pop(expired_key)
+            for expired_label in expired.labels:
+                _context_labels.pop((*expired_key[:2], expired_label), None)
+        entry = _context_caches.setdefault(key, _ContextCache(api_key))
+        if label is not None:
+            label_key = (api_key, model_name, label)
+            if _context_labels.get(label_key) != digest:
+                stale = _unlink_label(label_key)
+                _context_labels[label_key] = digest
+                entry.labels.add(label)
+    for old_entry in stale:
+        _delete_context_cache(old_entry)
+
+    with entry.lock:
+        if entry.discarded:
+            # 等待期间其他请求创建该缓存失败，记录已被移除
+            return _acquire_context_cache(client, api_key, model_name, context, label)
+        remaining = entry.expires_at - time.monotonic()
+        ttl = f"{CONTEXT_CACHE_TTL_SECONDS}s"
+        if entry.name is None or remaining < 30:
+            try:
+                with metrics_service.span("create_cache", model_name, context_chars=len(context)):
+                    cached = governor_service.call(api_key, model_name, lambda: client.caches.create(
+                        model=model_name,
+                        config=types.CreateCachedContentConfig(
+                            contents=[context],
+                            tools=[types.Tool(google_search=types.GoogleSearch())],
+                            ttl=ttl,
+                            display_name=label or digest[:16],
+                        )
+                    ))
+            except Exception:
+                if entry.name is None:
+                    _discard_context_cache(key, entry)
+                raise
+            entry.name = cached.name
+            logger.info("已创建上下文缓存: %s", entry.name)
+        elif remaining < CONTEXT_CACHE_TTL_SECONDS / 2:
+            governor_service.call(api_key, model_name, lambda: client.caches.update(
+                name=entry.name, config=types.UpdateCachedContentConfig(ttl=ttl)))
+        else:
+            return entry.name
+        entry.expires_at = time.monotonic() + CONTEXT_CACHE_TTL_SECONDS
+        return entry.name
+
+
+def release_context_caches(label_prefix: str):
+    """删除标签以 label_prefix 开头的来源所使用的上下文缓存（如论文被删除或重命名时）。"""
+    with _context_caches_lock:
+        stale = [entry for label_key in list(_context_labels) if label_key[2].startswith(label_prefix)
+                 for entry in _unlink_label(label_key)]
+    for entry in stale:
+        _delete_context_cache(entry)
+
+
+@atexit.register
+def _cleanup_context_caches():
+    """进程退出前删除所有远端上下文缓存。"""
+    with _context_caches_lock:
+        entries = [entry for entry in _context_caches.values() if entry.name is not None]
+        _context_caches.clear()
+        _context_labels.clear()
+    for entry in entries:
+        _delete_context_cache(entry)
+
+
+def _prepare_request(client, content_list: list, model_name: str, temperature: float, api_key: str,
+                     context_label: str = None):
+    """
+    构造生成请求的内容和配置。context_label 不为空且 content_list 包含多段内容时，
+    第一段被视为可复用的稳定资料：放入远端上下文缓存，请求只发送其余内容。
+    创建缓存失败时退回到发送完整内容。
+    """
     # 用于调用谷歌搜索
     grounding_tool = types.Tool(
         google_search=types.GoogleSearch()
     )
+    if context_label is not None and len(content_list) > 1:
+        try:
+            cache_name = _acquire_context_cache(client, api_key, model_name, content_list[0], context_label)
+            # 使用上下文缓存时，工具只能在创建缓存时指定
+            return content_list[1:], types.GenerateContentConfig(cached_content=cache_name, temperature=temperature)
+        except Exception as e:
+            logger.warning("使用上下文缓存失败，改为发送完整内容: %s", e)
+    return content_list, types.GenerateContentConfig(tools=[grounding_tool], temperature=temperature)
 
-    if not file_path.exists():
-        raise FileNotFoundError(f"文件未找到: {file_path}")
 
-    print(f"正在上传文件: {file_path.name}...")
-    # 1. 上传文件
-    uploaded_file = client.files.upload(file=file_path)
-    print(f"文件上传成功: {uploaded_file.name}")
+def _generate_from_document(client, document_contents: list, prompt: str, model_name: str, temperature: float,
+                           api_key: str):
+    """使用文献内容（已上传的文件句柄和/或本地提取的文本）调用模型生成内容。"""
+    # 用于调用谷歌搜索
+    grounding_tool = types.Tool(
+        google_search=types.GoogleSearch()
+    )
 
-    # 2. 调用模型生成内容
-    print(f"使用模型 '{model_name}' (temperature={temperature}) 分析文件...")
-    try:
-        response = client.models.generate_content(
+    logger.info("使用模型 '%s' (temperature=%s) 分析文件...", model_name, temperature, extra=SAMPLED)
+    contents = [*document_contents, prompt]
+    with metrics_service.span("generate", model_name, source="document") as span:
+        span.record_prompt(contents)
+        response = governor_service.call(api_key, model_name, lambda: client.models.generate_content(
             model=model_name,
-            contents=[uploaded_file, prompt],
+            contents=contents,
             config=types.GenerateContentConfig(
                 tools=[grounding_tool],
                 temperature=temperature
             )
-        )
-        return response.text
-    finally:
-        # 3. 确保无论成功与否都清理上传的文件
-        client.files.delete(name=uploaded_file.name)
-        print(f"已清理上传的文件: {uploaded_file.name}")
+        ))
+        span.record_response(response.text, response.usage_metadata)
+    return response.text
 
 
-def generate_text_from_prompt(content_list: list, model_name: str, temperature: float, api_key: str):
+def analyze_pdf_content(file_path: pathlib.Path, prompt: str, model_name: str, temperature: float, api_key: str,
+                        use_cache: bool = True):
     """
-    严格按照官方文档，根据文本提示生成内容（单轮对话）。
+    严格按照官方文档，分析单个PDF文件。
     """
-    client = get_client(api_key)  # 动态获取客户端
+    return analyze_pdf_passes(file_path, [(prompt, temperature)], model_name, api_key, use_cache=use_cache)[0]
 
-    # 用于调用谷歌搜索
-    grounding_tool = types.Tool(
-        google_search=types.GoogleSearch()
-    )
 
-    print(f"使用模型 '{model_name}' (temperature={temperature}) 生成文本...")
-    print(content_list)
-    response = client.models.generate_content(
-        model=model_name,
-        contents=content_list,
-        config=types.GenerateContentConfig(
-            tools=[grounding_tool],
-            temperature=temperature
-        )
-    )
+def analyze_pdf_passes(file_path: pathlib.Path, passes: list, model_name: str, api_key: str,
+                       use_cache: bool = True):
+    """
+    对同一个PDF文件执行多轮分析（例如 Markdown 转换和分析报告）。
+    文件先在本地预处理（见 pdf_service）：纯文字页面以文本发送，只上传包含表格、插图或公式的页面；
+    不适合拆分时上传完整文件。文件只上传一次，各轮分析基于同一份内容并行执行；
+    命中响应缓存的轮次直接返回缓存结果，全部命中时不会解析或上传文件。
+
+    Args:
+        file_path (pathlib.Path): PDF文件路径。
+        passes (list): 由 (prompt, temperature) 元组组成的列表。
+        model_name (str): 模型名称。
+        api_key (str): Google API Key。
+        use_cache (bool): 是否使用响应缓存。
+
+    Returns:
+        list: 与 passes 顺序一致的生成结果。
+    """
+    if not file_path.exists():
+        raise FileNotFoundError(f"文件未找到: {file_path}")
+
+    file_hash = file_service.get_pdf_sha256(file_path)
+    results = [None] * len(passes)
+    cache_keys = [None] * len(passes)
+    for i, (prompt, temperature) in enumerate(passes):
+        if cache_service.is_cacheable(temperature, use_cache):
+            cache_keys[i] = cache_service.make_key(model_name, temperature, [prompt], file_hash)
+            results[i] = cache_service.get(cache_keys[i])
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        logger.info("文件 %s 的所有分析均命中缓存。", file_path.name, extra=SAMPLED)
+        return results
+
+    # 1. 本地预处理：纯文字页面以文本发送，只有包含表格、插图或公式的页面组成精简的 PDF 上传
+    document = pdf_service.prepare_document(file_path, file_hash)
+    if document is not None:
+        upload_path = document["pdf_path"]
+        logger.info("%s: %d 页以文本发送，%d 页以 PDF 发送。", file_path.name,
+                    document['page_count'] - len(document['pdf_pages']), len(document['pdf_pages']))
+    else:
+        upload_path = file_path
+
+    with checkout_client(api_key) as client:  # 从连接池借出客户端
+        # 2. 上传文件（内容相同的文件只上传一次）
+        key = None
+        document_contents = [document["text"]] if document is not None else []
+        if upload_path is not None:
+            upload_hash = document["pdf_sha256"] if document is not None else file_hash
+            key, uploaded_file = _acquire_uploaded_file(client, upload_path, api_key, upload_hash)
+            document_contents.insert(0, uploaded_file)
+
+        # 3. 基于同一份内容并行执行每一轮分析
+        def run_pass(i):
+            prompt, temperature = passes[i]
+            text = _generate_from_document(client, document_contents, prompt, model_name, temperature, api_key)
+            if cache_keys[i] is not None and text:
+                cache_service.put(cache_keys[i], text)
+            return text
+
+        try:
+            if len(pending) == 1:
+                results[pending[0]] = run_pass(pending[0])
+            else:
+                with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                    for i, text in zip(pending, executor.map(run_pass, pending)):
+                        results[i] = text
+            return results
+        finally:
+            # 4. 所有分析结束后释放句柄，空闲超时后由后台清理
+            if key is not None:
+                _release_uploaded_file(key)
+
+
+def generate_text_from_prompt(content_list: list, model_name: str, temperature: float, api_key: str,
+                              use_cache: bool = True, context_label: str = None):
+    """
+    严格按照官方文档，根据文本提示生成内容（单轮对话）。
+    低温度调用的结果会写入响应缓存，相同输入的重复调用直接返回缓存结果。
+    指定 context_label 时，content_list 的第一段作为可复用的稳定资料放入远端上下文缓存（见 _prepare_request）。
+    """
+    cache_key = None
+    if cache_service.is_cacheable(temperature, use_cache):
+        cache_key = cache_service.make_key(model_name, temperature, content_list)
+        cached = cache_service.get(cache_key)
+        if cached is not None:
+            logger.info("模型 '%s' (temperature=%s) 的响应命中缓存。", model_name, temperature, extra=SAMPLED)
+            return cached
+
+    logger.info("使用模型 '%s' (temperature=%s) 生成文本...", model_name, temperature, extra=SAMPLED)
+    with checkout_client(api_key) as client:  # 从连接池借出客户端
+        contents, config = _prepare_request(client, content_list, model_name, temperature, api_key, context_label)
+        with metrics_service.span("generate", model_name, source="prompt",
+                                  context_cached=config.cached_content is not None) as span:
+            span.record_prompt(contents)
+            response = governor_service.call(api_key, model_name, lambda: client.models.generate_content(
+                model=model_name,
+                contents=contents,
+                config=config
+            ))
+            span.record_response(response.text, response.usage_metadata)
+    if cache_key is not None and response.text:
+        cache_service.put(cache_key, response.text)
     return response.text
 
 
+def stream_text_from_prompt(content_list: list, model_name: str, temperature: float, api_key: str,
+                            use_cache: bool = True, context_label: str = None):
+    """
+    根据文本提示流式生成内容（单轮对话），逐段产出模型返回的文本片段。
+    命中响应缓存时一次性产出完整结果；流式结束后完整结果同样会写入缓存。
+    context_label 的含义与 generate_text_from_prompt 相同。
+    """
+    cache_key = None
+    if cache_service.is_cacheable(temperature, use_cache):
+        cache_key = cache_service.make_key(model_name, temperature, content_list)
+        cached = cache_service.get(cache_key)
+        if cached is not None:
+            logger.info("模型 '%s' (temperature=%s) 的响应命中缓存。", model_name, temperature, extra=SAMPLED)
+            yield cached
+            return
+
+    logger.info("使用模型 '%s' (temperature=%s) 流式生成文本...", model_name, temperature, extra=SAMPLED)
+    parts = []
+    with checkout_client(api_key) as client:  # 从连接池借出客户端
+        contents, config = _prepare_request(client, content_list, model_name, temperature, api_key, context_label)
+
+        def open_stream():
+            # 请求在取第一个片段时才真正发出，因此连同第一个片段一起交给调用治理，
+            # 已开始输出后的错误无法重试，直接抛出
+            stream = iter(client.models.generate_content_stream(
+                model=model_name,
+                contents=contents,
+                config=config
+            ))
+            return next(stream, None), stream
+
+        with metrics_service.span("stream", model_name, context_cached=config.cached_content is not None) as span:
+            span.record_prompt(contents)
+            start = time.perf_counter()
+            first_chunk, stream = governor_service.call(api_key, model_name, open_stream)
+            span.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 1))
+            usage = None
+            if first_chunk is not None:
+                for chunk in itertools.chain([first_chunk], stream):
+                    # 用量信息随最后一个片段返回
+                    usage = chunk.usage_metadata or usage
+                    if chunk.text:
+                        parts.append(chunk.text)
+                        yield chunk.text
+            span.record_response("".join(parts), usage)
+        if first_chunk is None:
+            return
+    if cache_key is not None and parts:
+        cache_service.put(cache_key, "".join(parts))
+
+
 # 多轮对话API的封装（当前未使用，但按要求备用）
 def start_chat_session(model_name: str, api_key: str):
     """
     严格按照官方文档，创建一个多轮对话会话。
     """
-    client = get_client(api_key)  # 动态获取客户端
+    client = get_client(api_key)  # 从连接池获取客户端
 
     chat = client.chats.create(model=model_name)
     return chat
\ No newline at end of file
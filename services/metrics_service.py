@@ -0,0 +1,250 @@
+# services/metrics_service.py
+"""
+指标与追踪服务。
+
+- 指标：进程内的计数器和直方图，按标签分组，由 /metrics 接口以 Prometheus 文本格式输出；
+  响应缓存、调用治理等模块已有的统计通过 register_collector 注册的回调在输出时一并读取。
+- 追踪：span() 记录一次操作（上传、生成、删除等）的耗时和属性，写入耗时直方图，
+  并以 key=value 形式输出一行结构化日志。
+- 日志：configure_logging() 配置日志级别和格式；以 extra=SAMPLED 记录的常规日志按
+  LOG_SAMPLE_RATE 采样输出，警告和错误总是输出。
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from config import LOG_LEVEL, LOG_SAMPLE_RATE, METRICS_LATENCY_BUCKETS, METRICS_SIZE_BUCKETS
+
+# 需要采样的常规日志使用 logger.info(..., extra=SAMPLED)
+SAMPLED = {"sampled": True}
+
+_logger = logging.getLogger(__name__)
+
+
+class _SamplingFilter(logging.Filter):
+    """按 LOG_SAMPLE_RATE 丢弃标记为可采样的 INFO 及以下级别的日志。"""
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False) or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < LOG_SAMPLE_RATE
+
+
+def configure_logging():
+    """配置根日志记录器的级别、格式和采样过滤器（重复调用不会重复添加处理器）。"""
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, _SamplingFilter) for f in handler.filters):
+            handler.addFilter(_SamplingFilter())
+
+
+class _Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name, self.help, self.label_names = name, help_text, label_names
+        self.values = {}
+
+    def inc(self, labels: tuple, value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        return [(self.name, dict(zip(self.label_names, labels)), value) for labels, value in self.values.items()]
+
+
+class _Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: list):
+        self.name, self.help, self.label_names = name, help_text, label_names
+        self.buckets = sorted(buckets)
+        self.values = {}  # 标签 -> [各桶计数..., 总和, 次数]
+
+    def observe(self, labels: tuple, value: float):
+        state = self.values.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def samples(self):
+        samples = []
+        for labels, state in self.values.items():
+            base = dict(zip(self.label_names, labels))
+            for bound, count in zip(self.buckets, state):
+                samples.append((f"{self.name}_bucket", {**base, "le": _format_value(bound)}, count))
+            samples.append((f"{self.name}_bucket", {**base, "le": "+Inf"}, state[-1]))
+            samples.append((f"{self.name}_sum", base, state[-2]))
+            samples.append((f"{self.name}_count", base, state[-1]))
+        return samples
+
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+
+def _counter(name: str, help_text: str, *label_names):
+    _metrics[name] = _Counter(name, help_text, label_names)
+    return _metrics[name]
+
+
+def _histogram(name: str, help_text: str, buckets: list, *label_names):
+    _metrics[name] = _Histogram(name, help_text, label_names, buckets)
+    return _metrics[name]
+
+
+_http_duration = _histogram("http_request_duration_seconds", "API 请求的处理耗时（流式响应只计到开始输出）",
+                            METRICS_LATENCY_BUCKETS, "method", "route", "status")
+_span_duration = _histogram("llm_operation_duration_seconds", "模型相关操作的耗时（含限流等待和重试）",
+                            METRICS_LATENCY_BUCKETS, "operation", "model")
+_span_errors = _counter("llm_operation_errors_total", "模型相关操作的失败次数", "operation", "model")
+_prompt_chars = _histogram("llm_prompt_chars", "每次生成请求中文本内容的字符数",
+                           METRICS_SIZE_BUCKETS, "operation", "model")
+_response_chars = _histogram("llm_response_chars", "每次生成的响应字符数", METRICS_SIZE_BUCKETS, "operation", "model")
+_tokens = _counter("llm_tokens_total", "模型返回的 usage_metadata 中的 token 用量", "model", "type")
+
+# usage_metadata 字段 -> llm_tokens_total 的 type 标签
+_USAGE_FIELDS = {
+    "prompt_token_count": "prompt",
+    "cached_content_token_count": "cached",
+    "candidates_token_count": "candidates",
+    "thoughts_token_count": "thoughts",
+    "tool_use_prompt_token_count": "tool_use_prompt",
+    "total_token_count": "total",
+}
+
+
+def register_collector(collect):
+    """
+    注册一个在输出指标时调用的回调，用于导出其他模块已有的统计信息。
+    collect() 返回 (指标名, 类型, 说明, 数值) 的列表，类型为 "counter" 或 "gauge"。
+    """
+    _collectors.append(collect)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    with _lock:
+        _http_duration.observe((method, route, str(status)), seconds)
+
+
+def record_usage(model_name: str, usage):
+    """累计一次响应的 usage_metadata 中的各项 token 数；usage 为 None 时忽略。"""
+    if usage is None:
+        return {}
+    counts = {}
+    for field, token_type in _USAGE_FIELDS.items():
+        value = getattr(usage, field, None)
+        if value:
+            counts[token_type] = value
+    with _lock:
+        for token_type, value in counts.items():
+            _tokens.inc((model_name, token_type), value)
+    return counts
+
+
+class Span:
+    """一次被追踪的操作。attributes 中的属性会出现在结束时的日志中。"""
+
+    def __init__(self, operation: str, model: str, attributes: dict):
+        self.operation, self.model = operation, model
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_prompt(self, contents: list):
+        """记录请求中文本内容的字符数（已上传的文件句柄等非文本内容不计入）。"""
+        chars = sum(len(part) for part in contents if isinstance(part, str))
+        self.attributes["prompt_chars"] = chars
+        with _lock:
+            _prompt_chars.observe((self.operation, self.model), chars)
+
+    def record_response(self, text: str, usage=None):
+        """记录响应的字符数和 token 用量。"""
+        chars = len(text or "")
+        self.attributes["response_chars"] = chars
+        with _lock:
+            _response_chars.observe((self.operation, self.model), chars)
+        for token_type, value in record_usage(self.model, usage).items():
+            self.attributes[f"{token_type}_tokens"] = value
+
+
+@contextmanager
+def span(operation: str, model: str = "", **attributes):
+    """
+    追踪一次操作：记录耗时（成功和失败都记录）和失败次数，结束时输出一行结构化日志。
+
+    用法:
+        with metrics_service.span("generate", model=model_name) as s:
+            s.record_prompt(contents)
+            ...
+            s.record_response(response.text, response.usage_metadata)
+    """
+    current = Span(operation, model, attributes)
+    start = time.perf_counter()
+    try:
+        yield current
+    except GeneratorExit:
+        # 流式输出被调用方提前关闭（如客户端断开连接），不计为失败
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _span_duration.observe((operation, model), elapsed)
+        _logger.info("span=%s model=%s status=cancelled duration_ms=%.1f %s", operation, model, elapsed * 1000,
+                     _format_attributes(current.attributes), extra=SAMPLED)
+        raise
+    except BaseException as e:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _span_duration.observe((operation, model), elapsed)
+            _span_errors.inc((operation, model))
+        _logger.warning("span=%s model=%s status=error duration_ms=%.1f %s error=%r", operation, model,
+                        elapsed * 1000, _format_attributes(current.attributes), e)
+        raise
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _span_duration.observe((operation, model), elapsed)
+    _logger.info("span=%s model=%s status=ok duration_ms=%.1f %s", operation, model, elapsed * 1000,
+                 _format_attributes(current.attributes), extra=SAMPLED)
+
+
+def _format_attributes(attributes: dict) -> str:
+    return " ".join(f"{key}={value}" for key, value in attributes.items())
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name: str, labels: dict, value) -> str:
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{label_text}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+def render_prometheus() -> str:
+    """以 Prometheus 文本格式（0.0.4）输出所有指标。"""
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            metric_type = "histogram" if isinstance(metric, _Histogram) else "counter"
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric_type}")
+            lines.extend(_format_sample(*sample) for sample in metric.samples())
+    for collect in _collectors:
+        try:
+            collected = collect()
+        except Exception as e:
+            _logger.warning("读取指标时出错: %s", e)
+            continue
+        for name, metric_type, help_text, value in collected:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(_format_sample(name, {}, value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,248 @@
+# services/pdf_service.py
+"""
+PDF 本地预处理服务。
+
+单篇文献分析原本每次都把完整的 PDF 上传给模型。多数论文的大部分页面只有正文文字，
+这些文字在本地提取只需几十毫秒，以文本发送也比 PDF 页面占用更少的模型输入。
+
+prepare_document 逐页检测：
+- 插图：页面（或其引用的表单对象）中有足够大的图片，或有大量绘图路径操作（矢量图）；
+- 表格：有以 "Table N" / "表 N" 开头的表题；
+- 公式：使用数学字体排版的字符较多；
+- 扫描页：提取不到足够的文字。
+命中任一项的页面按原顺序组成一份精简的 PDF，其余页面以带页码标记的文本发送。
+复杂页面过多、未安装 pypdf 或解析失败时返回 None，调用方应上传完整 PDF。
+
+预处理结果按原文件内容哈希缓存在 result/pdf_extracts/ 中，同一文件的重试和多轮分析无需重复解析。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+
+from config import (PDF_HYBRID_ENABLED, PDF_HYBRID_MAX_COMPLEX_RATIO, PDF_MIN_TEXT_CHARS, PDF_MIN_IMAGE_PIXELS,
+                    PDF_FIGURE_PATH_OPERATORS, PDF_MATH_CHARS)
+from services import file_service
+from services.metrics_service import SAMPLED
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    # pypdf 会对缺少的字体解析依赖（如 fontTools）输出大量警告，不影响文字提取
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+except ImportError:
+    PdfReader = PdfWriter = None
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACTS_DIR = file_service.RESULT_DIR / "pdf_extracts"
+
+# 预处理逻辑或检测阈值变化时，缓存的结果失效
+_EXTRACT_VERSION = 1
+_SETTINGS = (_EXTRACT_VERSION, PDF_HYBRID_MAX_COMPLEX_RATIO, PDF_MIN_TEXT_CHARS, PDF_MIN_IMAGE_PIXELS,
+             PDF_FIGURE_PATH_OPERATORS, PDF_MATH_CHARS)
+
+# 页面特征
+FIGURE, TABLE, EQUATION, SCANNED = "figure", "table", "equation", "scanned"
+_FEATURE_NAMES = {FIGURE: "插图", TABLE: "表格", EQUATION: "公式", SCANNED: "扫描页"}
+
+# 内容流中的路径构造操作：直线 l、贝塞尔曲线 c/v/y、矩形 re
+_PATH_OPERATOR_PATTERN = re.compile(rb"(?<![A-Za-z])(?:l|c|v|y|re)(?=\s)")
+_MATH_FONT_PATTERN = re.compile(r"CM(?:MI|SY|EX)|MSBM|MSAM|Math|Symbol|stmary|rsfs|eufm|esint", re.IGNORECASE)
+_TABLE_CAPTION_PATTERN = re.compile(r"^\s*(?:Table|TABLE|表)\s*\d+", re.MULTILINE)
+
+# 表单对象的最大嵌套检查深度
+_MAX_FORM_DEPTH = 3
+
+
+def is_available() -> bool:
+    """本地预处理是否可用（已启用且安装了 pypdf）。"""
+    return PDF_HYBRID_ENABLED and PdfReader is not None
+
+
+def _scan_graphics(resources, depth: int = 0) -> (int, int):
+    """统计资源中（含嵌套的表单对象）足够大的图片数量和路径操作数量。"""
+    images, path_operators = 0, 0
+    if resources is None or "/XObject" not in resources:
+        return images, path_operators
+    for xobject in resources["/XObject"].values():
+        xobject = xobject.get_object()
+        subtype = xobject.get("/Subtype")
+        if subtype == "/Image":
+            if int(xobject.get("/Width", 0)) * int(xobject.get("/Height", 0)) >= PDF_MIN_IMAGE_PIXELS:
+                images += 1
+        elif subtype == "/Form" and depth < _MAX_FORM_DEPTH:
+            path_operators += len(_PATH_OPERATOR_PATTERN.findall(xobject.get_data()))
+            nested_images, nested_operators = _scan_graphics(xobject.get("/Resources"), depth + 1)
+            images += nested_images
+            path_operators += nested_operators
+    return images, path_operators
+
+
+def analyze_page(page) -> (str, list):
+    """
+    检测一页的特征，返回 (提取的文字, 特征列表)。
+    检测到插图的页面会整页以 PDF 发送，不再提取文字（复杂的矢量图提取文字可能很慢）。
+    """
+    resources = page["/Resources"] if "/Resources" in page else None
+    images, path_operators = _scan_graphics(resources)
+    contents = page.get_contents()
+    if contents is not None:
+        path_operators += len(_PATH_OPERATOR_PATTERN.findall(contents.get_data()))
+    if images or path_operators >= PDF_FIGURE_PATH_OPERATORS:
+        return "", [FIGURE]
+
+    math_chars = 0
+
+    def count_math(text, cm, tm, font_dict, font_size):
+        nonlocal math_chars
+        if font_dict and _MATH_FONT_PATTERN.search(str(font_dict.get("/BaseFont", ""))):
+            math_chars += len(text.strip())
+
+    text = page.extract_text(visitor_text=count_math) or ""
+    features = []
+    if _TABLE_CAPTION_PATTERN.search(text):
+        features.append(TABLE)
+    if math_chars >= PDF_MATH_CHARS:
+        features.append(EQUATION)
+    if len(text.strip()) < PDF_MIN_TEXT_CHARS:
+        features.append(SCANNED)
+    return text, features
+
+
+def _build_text(file_name: str, pages: list, pdf_pages: list) -> str:
+    """将文本页和复杂页的位置说明按页码顺序组合为发送给模型的文本。"""
+    attachment_index = {page: i + 1 for i, page in enumerate(pdf_pages)}
+    lines = [f"以下是论文《{file_name}》的内容，共 {len(pages)} 页。"]
+    if pdf_pages:
+        lines.append(f"其中第 {', '.join(str(page) for page in pdf_pages)} 页包含表格、插图或公式，"
+                     f"以附带的 PDF 文件给出（附件按原页码顺序排列），其余页面的文字从原文中提取，按页给出。"
+                     f"请按页码顺序将两部分合并，如同阅读完整的原文。")
+    for number, (text, features) in enumerate(pages, start=1):
+        if number in attachment_index:
+            names = "、".join(_FEATURE_NAMES[feature] for feature in features)
+            lines.append(f"\n=== 第 {number} 页（{names}，见附件 PDF 第 {attachment_index[number]} 页） ===")
+        else:
+            lines.append(f"\n=== 第 {number} 页 ===\n{text.strip()}")
+    return "\n".join(lines)
+
+
+def _write_atomic(target_path, write):
+    """先写入同目录下的临时文件再原子替换目标文件；write 接收以二进制模式打开的文件对象。"""
+    tmp_path = target_path.with_name(f".{target_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, target_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _write_pages(reader, page_numbers: list, target_path) -> str:
+    """将指定页面写入新的 PDF 文件并返回其 SHA256。"""
+    writer = PdfWriter()
+    for number in page_numbers:
+        writer.add_page(reader.pages[number - 1])
+    _write_atomic(target_path, writer.write)
+    with open(target_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_page_count(file_path):
+    """返回 PDF 的页数；未安装 pypdf 或解析失败时返回 None。"""
+    if PdfReader is None:
+        return None
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception as e:
+        logger.warning("读取 %s 的页数失败: %s", file_path.name, e)
+        return None
+
+
+def split_pages(file_path, page_ranges: list, target_paths: list):
+    """
+    将 PDF 按页码范围拆分为多个文件，已存在的目标文件会被跳过。
+
+    Args:
+        page_ranges (list): (起始页, 结束页) 元组的列表，页码从 1 开始，包含两端。
+        target_paths (list): 与 page_ranges 对应的输出路径。
+    """
+    reader = None
+    for (start, end), target_path in zip(page_ranges, target_paths):
+        if target_path.exists():
+            continue
+        if reader is None:
+            reader = PdfReader(file_path)
+        _write_pages(reader, list(range(start, end + 1)), target_path)
+
+
+def _extract(file_path, file_hash: str):
+    reader = PdfReader(file_path)
+    pages = [analyze_page(page) for page in reader.pages]
+    pdf_pages = [number for number, (_, features) in enumerate(pages, start=1) if features]
+    document = {
+        "hybrid": bool(pages) and len(pdf_pages) / len(pages) <= PDF_HYBRID_MAX_COMPLEX_RATIO,
+        "page_count": len(pages),
+        "pdf_pages": pdf_pages,
+        "features": {str(number): features for number, (_, features) in enumerate(pages, start=1) if features},
+        "text": None,
+        "pdf_sha256": None,
+    }
+    if not document["hybrid"]:
+        return document
+    document["text"] = _build_text(file_path.stem, pages, pdf_pages)
+    if pdf_pages:
+        document["pdf_sha256"] = _write_pages(reader, pdf_pages, PDF_EXTRACTS_DIR / f"{file_hash}.pdf")
+    return document
+
+
+def prepare_document(file_path, file_hash: str):
+    """
+    对 PDF 做本地预处理，决定以何种方式发送给模型。
+
+    Args:
+        file_path (Path): PDF 文件路径。
+        file_hash (str): 文件内容的 SHA256，用作预处理结果的缓存键。
+
+    Returns:
+        dict | None: 适合拆分时返回 {"text": 文本页及页码说明, "pdf_path": 复杂页组成的精简 PDF（没有时为 None）,
+            "pdf_sha256", "page_count", "pdf_pages": 以 PDF 发送的页码列表}；
+            应上传完整 PDF 时返回 None。
+    """
+    if not is_available():
+        return None
+    PDF_EXTRACTS_DIR.mkdir(parents=True, exist_ok=True)
+    record_path = PDF_EXTRACTS_DIR / f"{file_hash}.json"
+    pdf_path = PDF_EXTRACTS_DIR / f"{file_hash}.pdf"
+
+    document = None
+    try:
+        with open(record_path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        if document.get("settings") != list(_SETTINGS) or (document.get("pdf_sha256") and not pdf_path.exists()):
+            document = None
+    except (OSError, json.JSONDecodeError):
+        document = None
+
+    if document is None:
+        try:
+            document = _extract(file_path, file_hash)
+        except Exception as e:
+            logger.warning("本地解析 %s 失败，将上传完整 PDF: %s", file_path.name, e)
+            return None
+        document["settings"] = list(_SETTINGS)
+        _write_atomic(record_path, lambda f: f.write(json.dumps(document, ensure_ascii=False).encode("utf-8")))
+
+    if not document["hybrid"]:
+        logger.info("%s: %d/%d 页包含表格、插图或公式，上传完整 PDF。", file_path.name, len(document["pdf_pages"]),
+                    document["page_count"], extra=SAMPLED)
+        return None
+    return {
+        "text": document["text"],
+        "pdf_path": pdf_path if document["pdf_sha256"] else None,
+        "pdf_sha256": document["pdf_sha256"],
+        "page_count": document["page_count"],
+        "pdf_pages": document["pdf_pages"],
+    }
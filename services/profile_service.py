@@ -0,0 +1,182 @@
+# services/profile_service.py
+"""
+按需的请求性能剖析服务。
+
+对单个请求开启剖析后，后台线程每隔 PROFILE_SAMPLE_INTERVAL_MS 毫秒采样一次处理该请求的线程的调用栈，
+按栈中最内层能识别的模块把两次采样之间的墙钟时间归入以下阶段：
+- serialization: JSON 编码与解析；
+- llm_wait: llm_service / governor_service / backend_service 及 Gemini SDK、HTTP 客户端（网络等待、限流与重试退避）；
+- file_io: file_service、cache_service、search_service、revision_service 的文件与数据库读写；
+- prompt_build: prompt_service、context_service 以及 app 中的 _build_* / _prepare_* 函数（提示词组装）；
+- thread_wait: 等待线程池中的并行任务（如分层综合、多轮分析），这部分时间花在其他线程中；
+- other: 其余 Python 代码。
+
+每次剖析在 result/profiles/ 下保存两个文件：
+- <名称>.folded：折叠栈格式（每行 "帧;帧;帧 采样次数"，第一帧为阶段名），
+  可直接用 speedscope、flamegraph.pl 等工具生成火焰图；
+- <名称>.json：各阶段耗时、采样次数和自身耗时最多的函数。
+流式响应只剖析到开始输出为止。
+"""
+import json
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import PROFILE_SAMPLE_INTERVAL_MS, PROFILE_MAX_REPORTS
+from services import file_service
+
+PROFILES_DIR = file_service.RESULT_DIR / "profiles"
+
+PHASES = ("serialization", "llm_wait", "file_io", "prompt_build", "thread_wait", "other")
+
+# (阶段, 文件路径模式, 函数名模式)；从最内层的帧开始匹配，第一个命中的规则决定阶段
+_PHASE_RULES = [
+    ("serialization", re.compile(r"/json/"), None),
+    ("llm_wait", re.compile(r"/services/(?:llm|governor|backend)_service\.py$|/google/genai/|/httpx/|/httpcore/"
+                            r"|/(?:ssl|socket)\.py$"), None),
+    ("file_io", re.compile(r"/services/(?:file|cache|search|revision)_service\.py$"), None),
+    ("prompt_build", re.compile(r"/services/(?:prompt|context)_service\.py$"), None),
+    ("prompt_build", re.compile(r"/app\.py$"), re.compile(r"^_(?:build|prepare)_")),
+    ("thread_wait", re.compile(r"/concurrent/futures/|/threading\.py$"), None),
+]
+
+_APP_FILE = str(file_service.BASE_DIR / "app.py").replace("\\", "/")
+_BASE_PREFIX = str(file_service.BASE_DIR).replace("\\", "/") + "/"
+_MAX_STACK_DEPTH = 128
+
+
+def _frame_label(filename: str, function: str, line: int) -> str:
+    """火焰图中帧的名称：函数名和相对于项目目录（或 site-packages）的文件位置。"""
+    if filename.startswith(_BASE_PREFIX):
+        filename = filename[len(_BASE_PREFIX):]
+    elif "/site-packages/" in filename:
+        filename = filename.rsplit("/site-packages/", 1)[1]
+    else:
+        filename = filename.rsplit("/", 1)[-1]
+    return f"{function} ({filename}:{line})".replace(";", ":")
+
+
+def _extract_stack(frame) -> list:
+    """返回 (文件路径, 函数名, 首行号) 的列表，由外向内排列；从 app.py 的最外层帧开始，省略 Flask 的调度部分。"""
+    stack = []
+    while frame is not None and len(stack) < _MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append((code.co_filename.replace("\\", "/"), code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    for i, (filename, _, _) in enumerate(stack):
+        if filename == _APP_FILE:
+            return stack[i:]
+    return stack
+
+
+def _classify(stack: list) -> str:
+    for filename, function, _ in reversed(stack):
+        for phase, path_pattern, function_pattern in _PHASE_RULES:
+            if path_pattern.search(filename) and (function_pattern is None or function_pattern.match(function)):
+                return phase
+    return "other"
+
+
+class Profiler:
+    """采样一个线程的调用栈，直到 stop() 被调用。"""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.phase_seconds = Counter()
+        self.self_seconds = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.wall_seconds = 0.0
+        self._start = time.perf_counter()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last = self._start
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            if frame is None:
+                break
+            stack = _extract_stack(frame)
+            del frame
+            phase = _classify(stack)
+            labels = [_frame_label(*entry) for entry in stack]
+            self.stacks[";".join([phase, *labels])] += 1
+            self.phase_seconds[phase] += elapsed
+            if labels:
+                self.self_seconds[labels[-1]] += elapsed
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def summary(self) -> dict:
+        wall_ms = self.wall_seconds * 1000
+        phases = {}
+        for phase in PHASES:
+            ms = self.phase_seconds.get(phase, 0.0) * 1000
+            phases[phase] = {"ms": round(ms, 1), "percent": round(ms / wall_ms * 100, 1) if wall_ms else 0.0}
+        return {
+            "wall_ms": round(wall_ms, 1),
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            # 最后一次采样之后（不足一个采样间隔）的时间
+            "unsampled_ms": round(wall_ms - sum(self.phase_seconds.values()) * 1000, 1),
+            "phases": phases,
+            "top_functions": [{"frame": label, "ms": round(seconds * 1000, 1)}
+                              for label, seconds in self.self_seconds.most_common(15)],
+        }
+
+
+def start() -> Profiler:
+    """开始剖析当前线程。"""
+    return Profiler(threading.get_ident())
+
+
+def save(profiler: Profiler, method: str, route: str, path: str) -> dict:
+    """
+    停止剖析并将火焰图数据和阶段耗时保存到 result/profiles/，返回阶段耗时报告。
+    保存的报告超过 PROFILE_MAX_REPORTS 份时删除最早的。
+    """
+    profiler.stop()
+    report = {"method": method, "route": route, "path": path,
+              "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(profiler.started_at)),
+              **profiler.summary()}
+
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(profiler.started_at))
+    name = f"{stamp}-{int(profiler.started_at * 1000) % 1000:03d}-{method.lower()}-{slug}"
+    report["flamegraph"] = f"{name}.folded"
+    with open(PROFILES_DIR / f"{name}.folded", "w", encoding="utf-8") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in profiler.stacks.items())
+    with open(PROFILES_DIR / f"{name}.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    report["report"] = f"{name}.json"
+
+    _prune()
+    return report
+
+
+def _prune():
+    reports = sorted(PROFILES_DIR.glob("*.json"))
+    for old in reports[:max(0, len(reports) - PROFILE_MAX_REPORTS)]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".folded").unlink(missing_ok=True)
+
+
+def server_timing(report: dict) -> str:
+    """将阶段耗时格式化为 Server-Timing 响应头，浏览器开发者工具的网络面板中可直接查看。"""
+    entries = [f"{phase};dur={values['ms']}" for phase, values in report["phases"].items() if values["ms"]]
+    entries.append(f"total;dur={report['wall_ms']}")
+    return ", ".join(entries)
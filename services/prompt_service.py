@@ -0,0 +1,258 @@
+# services/prompt_service.py
+"""
+提示词注册表服务。
+
+加载 prompts/prompts.json 时把每个模板预先解析为 PromptTemplate，并检查占位符：
+模板缺少必需的占位符（如综述提示词中的 {combined_text}）或使用了调用方不会提供的占位符时，
+加载失败，而不是等到某个请求调用 format 时才抛出 KeyError。
+
+论文章节提示词中只取决于语言、章节和操作类型的部分（基础说明、代入章节名和语言后的指令模板、输出格式）
+在注册表中按组合缓存，每次请求只需代入依赖章节和当前章节的内容。
+
+修改 prompts.json 后无需重启：get_prompts() 每隔 PROMPT_RELOAD_CHECK_SECONDS 秒检查一次文件的修改时间，
+变化时加载并校验新文件，成功后整体替换注册表（请求在开始时取得的注册表不受影响）；
+新文件无效时保留原注册表并输出错误。
+
+render_contents / build_section_contents 在资料足够大时把提示词拆成 [稳定资料, 其余部分] 两段内容，
+第一段可以在远端作为上下文缓存复用（见 llm_service）。
+"""
+import json
+import logging
+import string
+import threading
+import time
+
+from config import PROMPT_RELOAD_CHECK_SECONDS
+from services import context_service, file_service
+
+logger = logging.getLogger(__name__)
+
+_formatter = string.Formatter()
+
+# 每个提示词允许的占位符：(必需的占位符, 可选的占位符)。
+# 值为 None 的提示词会原样发送给模型（与 PDF 一起），不做格式化，其中的花括号无需转义。
+PROMPT_FIELDS = {
+    'single_analysis_markdown': None,
+    'single_analysis_markdown_chunk': ({'start_page', 'end_page', 'page_count'}, set()),
+    'single_analysis_report': None,
+    'comprehensive_analysis': ({'combined_text'}, set()),
+    'comprehensive_analysis_map': ({'combined_text'}, set()),
+    'comprehensive_analysis_merge': ({'partial_reports'}, set()),
+    'comprehensive_analysis_reduce': ({'partial_reports'}, set()),
+    'brainstorming_generate': ({'source_text'}, set()),
+    'brainstorming_modify': ({'existing_results', 'modification_prompt'}, set()),
+    'paper_section_base': (set(), {'language'}),
+    'paper_section_context_header': ({'context_string'}, set()),
+    'paper_section_instruction_generate': (set(), {'language', 'target_name'}),
+    'paper_section_instruction_modify': ({'current_content', 'user_prompt'}, {'language', 'target_name'}),
+    'paper_section_instruction_ai_annotate': ({'current_content'}, {'language', 'target_name'}),
+    'paper_section_instruction_modify_annotated': ({'current_content'}, {'language', 'target_name'}),
+    'paper_section_instruction_expand': ({'current_content'}, {'language', 'target_name'}),
+    'paper_section_instruction_polish': ({'current_content'}, {'language', 'target_name'}),
+    'paper_section_output_format': (set(), set()),
+}
+
+# 论文章节的操作类型 -> 指令提示词
+SECTION_ACTIONS = {
+    'generate': 'paper_section_instruction_generate',
+    'modify': 'paper_section_instruction_modify',
+    'ai_annotate': 'paper_section_instruction_ai_annotate',
+    'modify_annotated': 'paper_section_instruction_modify_annotated',
+    'expand': 'paper_section_instruction_expand',
+    'polish': 'paper_section_instruction_polish',
+}
+
+
+# 资料被拆出为单独的内容时，模板中原占位符的位置改为引用上文
+CONTEXT_REFERENCE = "（见上文提供的材料）"
+
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class PromptError(ValueError):
+    """提示词文件缺少提示词、模板语法错误或占位符不符合要求。"""
+
+
+class PromptTemplate:
+    """
+    预先解析的提示词模板。`fields` 为模板中的占位符名称；
+    `partial` 代入部分占位符，返回只剩其余占位符的新模板。
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._segments = list(_formatter.parse(text))
+        self.fields = frozenset(name for _, name, _, _ in self._segments if name is not None)
+        for _, name, _, _ in self._segments:
+            if name is not None and not name.isidentifier():
+                raise PromptError(f"占位符必须是简单的名称: {{{name}}}")
+
+    def render(self, **values) -> str:
+        # 没有占位符的模板同样需要格式化，把转义的 {{ 和 }} 还原为花括号
+        return self.text.format_map(values)
+
+    def check_partial(self):
+        """
+        逐个用 partial 代入占位符后再 render 的结果应与一次性 render 相同（render_contents 依赖这一点），
+        不同时抛出 PromptError。代入的值包含花括号，以检查转义是否一致。
+        """
+        values = {name: f"<{name} {{}}>" for name in self.fields}
+        expected = self.render(**values)
+        for name in self.fields:
+            rest = {other: value for other, value in values.items() if other != name}
+            if self.partial(**{name: values[name]}).render(**rest) != expected:
+                raise PromptError(f"代入占位符 {{{name}}} 后的模板与直接格式化的结果不一致")
+
+    def partial(self, **values) -> "PromptTemplate":
+        parts = []
+        for literal, name, format_spec, conversion in self._segments:
+            parts.append(_escape(literal))
+            if name is None:
+                continue
+            field = (f"!{conversion}" if conversion else "") + (f":{format_spec}" if format_spec else "")
+            if name in values:
+                parts.append(_escape(("{0" + field + "}").format(values[name])))
+            else:
+                parts.append("{" + name + field + "}")
+        return PromptTemplate("".join(parts))
+
+
+class PromptRegistry:
+    """
+    一份已校验的提示词集合。`registry[key]` 返回原始提示词文本，
+    `render(key, **values)` 使用预解析的模板进行格式化。
+    """
+
+    def __init__(self, prompts: dict, mtime_ns: int = 0):
+        self.mtime_ns = mtime_ns
+        self._texts = {}
+        self._templates = {}
+        errors = []
+        for key, fields in PROMPT_FIELDS.items():
+            text = prompts.get(key)
+            if not isinstance(text, str):
+                errors.append(f"缺少提示词 '{key}'")
+                continue
+            self._texts[key] = text
+            if fields is None:
+                continue
+            try:
+                template = PromptTemplate(text)
+            except ValueError as e:
+                errors.append(f"提示词 '{key}' 的模板语法错误: {e}")
+                continue
+            required, optional = fields
+            if required - template.fields:
+                errors.append(f"提示词 '{key}' 缺少占位符: {', '.join(sorted(required - template.fields))}")
+            if template.fields - required - optional:
+                errors.append(f"提示词 '{key}' 包含未知的占位符: {', '.join(sorted(template.fields - required - optional))}"
+                              f"（如需输出花括号请写作 {{{{ 和 }}}}）")
+            try:
+                template.check_partial()
+            except PromptError as e:
+                errors.append(f"提示词 '{key}': {e}")
+            self._templates[key] = template
+        if errors:
+            raise PromptError("；".join(errors))
+        # 静态部分缓存，随注册表一起被替换
+        self._section_cache = {}
+        self._cache_lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> str:
+        return self._texts[key]
+
+    def render(self, key: str, **values) -> str:
+        return self._templates[key].render(**values)
+
+    def render_contents(self, key: str, context_field: str, **values) -> list:
+        """
+        渲染提示词并返回内容列表。context_field 对应的资料足够大时返回 [资料, 引用资料的提示词]，
+        使资料可以作为上下文缓存复用；否则返回 [完整提示词]。
+        """
+        context = values[context_field]
+        if not context_service.is_cacheable_context(context):
+            return [self.render(key, **values)]
+        template = self._templates[key].partial(**{context_field: CONTEXT_REFERENCE})
+        return [context, template.render(**{name: values[name] for name in template.fields})]
+
+    def _section_parts(self, language: str, action_type: str, target_name: str):
+        """返回 (基础说明, 代入语言和章节名后的指令模板, 输出格式)，按组合缓存。"""
+        cache_key = (language, action_type, target_name)
+        parts = self._section_cache.get(cache_key)
+        if parts is None:
+            parts = (self.render('paper_section_base', language=language),
+                     self._templates[SECTION_ACTIONS[action_type]].partial(language=language, target_name=target_name),
+                     self.render('paper_section_output_format'))
+            with self._cache_lock:
+                self._section_cache[cache_key] = parts
+        return parts
+
+    def build_section_contents(self, language: str, action_type: str, target_name: str, context_string: str,
+                               current_content: str, user_prompt: str = '') -> list:
+        """
+        组装论文章节的提示词：基础说明、背景信息（context_string 为空时省略）、操作指令和输出格式。
+        背景信息足够大时返回 [基础说明和背景信息, 操作指令和输出格式]，前一段可以作为上下文缓存复用；
+        否则返回 [完整提示词]。两种情况下用换行连接各段得到的提示词相同。action_type 无效时抛出 KeyError。
+        """
+        base, instruction, output_format = self._section_parts(language, action_type, target_name)
+        prefix_parts = [base]
+        if context_string:
+            prefix_parts.append(self.render('paper_section_context_header', context_string=context_string))
+        values = {'current_content': current_content, 'user_prompt': user_prompt}
+        suffix_parts = [instruction.render(**{name: values[name] for name in instruction.fields}), output_format]
+        if context_service.is_cacheable_context(context_string):
+            return ["\n".join(prefix_parts), "\n".join(suffix_parts)]
+        return ["\n".join(prefix_parts + suffix_parts)]
+
+
+_registry = None
+_last_check = 0.0
+_reload_lock = threading.Lock()
+
+
+def load() -> PromptRegistry:
+    """从 prompts.json 加载并校验提示词，替换当前注册表。文件不存在或无效时抛出异常。"""
+    global _registry
+    path = file_service.PROMPTS_FILE_PATH
+    if not path.exists():
+        raise FileNotFoundError(f"提示词文件未找到: {path}")
+    mtime_ns = path.stat().st_mtime_ns
+    with open(path, "r", encoding="utf-8") as f:
+        prompts = json.load(f)
+    if not isinstance(prompts, dict):
+        raise PromptError("提示词文件的顶层必须是 JSON 对象。")
+    _registry = PromptRegistry(prompts, mtime_ns)
+    return _registry
+
+
+def get_prompts() -> PromptRegistry:
+    """
+    返回当前的提示词注册表；提示词文件被修改后会自动重新加载。
+    调用方应在一次请求中只调用一次并使用同一个注册表，保证所用提示词版本一致。
+    """
+    global _last_check
+    if _registry is None:
+        with _reload_lock:
+            return _registry or load()
+    now = time.monotonic()
+    if now - _last_check < PROMPT_RELOAD_CHECK_SECONDS:
+        return _registry
+    with _reload_lock:
+        if now - _last_check < PROMPT_RELOAD_CHECK_SECONDS:
+            return _registry
+        _last_check = now
+        try:
+            mtime_ns = file_service.PROMPTS_FILE_PATH.stat().st_mtime_ns
+        except OSError:
+            return _registry
+        if mtime_ns != _registry.mtime_ns:
+            try:
+                load()
+                logger.info("提示词文件已更新，已重新加载提示词。")
+            except (OSError, ValueError) as e:
+                # json.JSONDecodeError 和 PromptError 都是 ValueError；文件再次修改前不再重试
+                logger.warning("重新加载提示词失败，继续使用之前的版本: %s", e)
+                _registry.mtime_ns = mtime_ns
+    return _registry
@@ -0,0 +1,332 @@
+# services/revision_service.py
+"""
+论文修订历史服务。
+
+每篇论文对应 result/paper_writing/revisions/ 下的一个只追加的 JSONL 日志，每行是一个章节的一次修订：
+    {"rev": 修订号, "section": 章节key, "ts": 时间, "action": 操作类型,
+     "snapshot": true, "content": 完整内容}            # 快照
+    {"rev": ..., "snapshot": false, "ops": [[起点, 终点, 替换文本], ...]}  # 相对上一修订的差异
+
+每个章节的第一条修订以及之后每隔 REVISION_SNAPSHOT_INTERVAL 条修订保存一次快照。
+内存中为每篇论文维护按章节划分的修订号和文件偏移量索引：恢复某个版本时，
+先二分查找目标修订和它之前最近的快照，再从快照开始回放至多 REVISION_SNAPSHOT_INTERVAL 条差异，
+无需回放整个历史。某个章节的修订数超过 REVISION_MAX_PER_SECTION 时，日志会被压缩重写。
+
+record_changes 只把修改按保存顺序放入队列（可以在论文锁内调用而不拖慢保存），
+由后台线程计算差异并写入日志；读取修订历史前会先写入该论文尚未处理的修改。
+"""
+import bisect
+import difflib
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import REVISION_SNAPSHOT_INTERVAL, REVISION_MAX_PER_SECTION
+from services import file_service
+
+logger = logging.getLogger(__name__)
+
+# 论文名 -> 日志索引（见 _build_index）
+_indexes = {}
+# 每篇论文一把锁，保护日志文件和索引
+_locks = {}
+_locks_guard = threading.Lock()
+
+# 论文名 -> 尚未写入日志的修改 [(changes, actions, 时间), ...]，按保存顺序排列
+_pending = {}
+_pending_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="revisions")
+
+# 行内差异按词比较：连续的字母数字、连续的空白、单个汉字或标点各为一个词；
+# 需要比较的行数或词数超过此数量时不再细分，整段替换
+_TOKEN_PATTERN = re.compile(r"\s+|[^\W\u4e00-\u9fff]+|.", re.DOTALL)
+_MAX_DIFF_TOKENS = 10000
+
+
+def _get_lock(paper_name: str):
+    with _locks_guard:
+        return _locks.setdefault(paper_name, threading.RLock())
+
+
+def _log_path(paper_name: str):
+    return file_service.PAPER_REVISIONS_DIR / f"{paper_name}.jsonl"
+
+
+def _diff_parts(old_parts: list, new_parts: list, start: int) -> list:
+    """比较两个片段序列，返回编辑操作；start 为 old_parts 在原文中的起始位置。"""
+    offsets = [start]
+    for part in old_parts:
+        offsets.append(offsets[-1] + len(part))
+    matcher = difflib.SequenceMatcher(None, old_parts, new_parts, autojunk=False)
+    return [[offsets[i1], offsets[i2], "".join(new_parts[j1:j2])]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+
+def _make_ops(old: str, new: str) -> list:
+    """
+    计算把 old 变为 new 的编辑操作，只记录发生变化的片段。
+    先去掉相同的开头和结尾，中间部分先按行比较，再对变化的行按词比较，避免对整个章节逐字符比较。
+    """
+    if old == new:
+        return []
+    prefix = len(os.path.commonprefix([old, new]))
+    suffix = min(len(os.path.commonprefix([old[::-1], new[::-1]])), min(len(old), len(new)) - prefix)
+    old_end, new_end = len(old) - suffix, len(new) - suffix
+    old_lines = old[prefix:old_end].splitlines(keepends=True)
+    new_lines = new[prefix:new_end].splitlines(keepends=True)
+    if not old_lines or not new_lines or len(old_lines) + len(new_lines) > _MAX_DIFF_TOKENS:
+        return [[prefix, old_end, new[prefix:new_end]]]
+
+    ops = []
+    for start, end, replacement in _diff_parts(old_lines, new_lines, prefix):
+        old_tokens = _TOKEN_PATTERN.findall(old, start, end)
+        new_tokens = _TOKEN_PATTERN.findall(replacement)
+        if old_tokens and new_tokens and len(old_tokens) + len(new_tokens) <= _MAX_DIFF_TOKENS:
+            ops.extend(_diff_parts(old_tokens, new_tokens, start))
+        else:
+            ops.append([start, end, replacement])
+    return ops
+
+
+def _apply_ops(text: str, ops: list) -> str:
+    parts, cursor = [], 0
+    for start, end, replacement in ops:
+        parts.append(text[cursor:start])
+        parts.append(replacement)
+        cursor = end
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+
+def _new_section_index():
+    return {"revs": [], "entries": [], "snapshots": [], "latest": None}
+
+
+def _add_to_index(index: dict, entry: dict, offset: int):
+    section = index["sections"].setdefault(entry["section"], _new_section_index())
+    section["revs"].append(entry["rev"])
+    section["entries"].append({"rev": entry["rev"], "offset": offset, "ts": entry["ts"],
+                               "action": entry["action"], "snapshot": entry["snapshot"]})
+    if entry["snapshot"]:
+        section["snapshots"].append(len(section["revs"]) - 1)
+    index["next_rev"] = max(index["next_rev"], entry["rev"] + 1)
+
+
+def _build_index(paper_name: str) -> dict:
+    """扫描日志文件，建立按章节划分的修订号与文件偏移量索引。"""
+    index = {"size": 0, "next_rev": 1, "sections": {}}
+    log_path = _log_path(paper_name)
+    if log_path.exists():
+        with open(log_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    _add_to_index(index, json.loads(line), offset)
+                offset += len(line)
+        index["size"] = offset
+    return index
+
+
+def _get_index(paper_name: str) -> dict:
+    """返回论文的日志索引；日志文件大小与索引记录不一致（如被外部修改）时重建索引。"""
+    log_path = _log_path(paper_name)
+    size = log_path.stat().st_size if log_path.exists() else 0
+    index = _indexes.get(paper_name)
+    if index is None or index["size"] != size:
+        index = _build_index(paper_name)
+        _indexes[paper_name] = index
+    return index
+
+
+def _read_entries(paper_name: str, offsets: list) -> list:
+    with open(_log_path(paper_name), "rb") as f:
+        entries = []
+        for offset in offsets:
+            f.seek(offset)
+            entries.append(json.loads(f.readline()))
+        return entries
+
+
+def _content_at(paper_name: str, section: dict, position: int) -> str:
+    """重建章节第 position 条修订的内容：从最近的快照开始回放差异。"""
+    snapshot_position = section["snapshots"][bisect.bisect_right(section["snapshots"], position) - 1]
+    offsets = [entry["offset"] for entry in section["entries"][snapshot_position:position + 1]]
+    entries = _read_entries(paper_name, offsets)
+    content = entries[0]["content"]
+    for entry in entries[1:]:
+        content = _apply_ops(content, entry["ops"])
+    return content
+
+
+def _latest_content(paper_name: str, section: dict) -> str:
+    if section["latest"] is None:
+        section["latest"] = _content_at(paper_name, section, len(section["revs"]) - 1)
+    return section["latest"]
+
+
+def _make_entry(section, rev: int, section_key: str, timestamp: str, action: str, content: str, get_previous):
+    """构造一条修订：章节的第一条以及距上次快照满 REVISION_SNAPSHOT_INTERVAL 条时保存快照，否则保存差异。"""
+    entry = {"rev": rev, "section": section_key, "ts": timestamp, "action": action}
+    if section is None or len(section["revs"]) - section["snapshots"][-1] >= REVISION_SNAPSHOT_INTERVAL:
+        entry.update(snapshot=True, content=content)
+    else:
+        entry.update(snapshot=False, ops=_make_ops(get_previous(), content))
+    return entry
+
+
+def _write_entry(f, index: dict, entry: dict, content: str):
+    """将修订写入已打开的日志文件并更新索引。"""
+    line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+    f.write(line)
+    _add_to_index(index, entry, index["size"])
+    index["size"] += len(line)
+    index["sections"][entry["section"]]["latest"] = content
+
+
+def _append(paper_name: str, index: dict, section_key: str, content: str, action: str, timestamp: str):
+    """为章节追加一条修订。"""
+    section = index["sections"].get(section_key)
+    entry = _make_entry(section, index["next_rev"], section_key, timestamp, action, content,
+                        lambda: _latest_content(paper_name, section))
+    file_service.PAPER_REVISIONS_DIR.mkdir(exist_ok=True)
+    with open(_log_path(paper_name), "ab") as f:
+        _write_entry(f, index, entry, content)
+
+
+def record_changes(paper_name: str, changes: dict, actions: dict = None):
+    """
+    记录论文章节的修改：按调用顺序放入队列，由后台线程写入日志。
+
+    Args:
+        paper_name (str): 论文名称。
+        changes (dict): 章节key -> (修改前内容, 修改后内容)。
+        actions (dict, optional): 章节key -> 操作类型（如 edit、polish、expand、restore），默认为 edit。
+    """
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    with _pending_lock:
+        _pending.setdefault(paper_name, []).append((changes, actions or {}, timestamp))
+    _executor.submit(_drain, paper_name)
+
+
+def _drain(paper_name: str):
+    """按保存顺序写入论文尚未处理的修改。"""
+    with _get_lock(paper_name):
+        with _pending_lock:
+            batches = _pending.pop(paper_name, [])
+        for changes, actions, timestamp in batches:
+            try:
+                _record(paper_name, changes, actions, timestamp)
+            except Exception as e:
+                logger.warning("记录论文 '%s' 的修订时出错: %s", paper_name, e)
+
+
+def _record(paper_name: str, changes: dict, actions: dict, timestamp: str):
+    """将一次保存的修改写入日志，调用方需持有该论文的锁。"""
+    index = _get_index(paper_name)
+    for section_key, (old_content, new_content) in changes.items():
+        section = index["sections"].get(section_key)
+        if section is None:
+            if old_content == new_content:
+                continue
+            # 首次记录该章节时，先保存修改前的内容，使其也能被恢复
+            if old_content:
+                _append(paper_name, index, section_key, old_content, "initial", timestamp)
+        elif _latest_content(paper_name, section) == new_content:
+            continue
+        _append(paper_name, index, section_key, new_content, actions.get(section_key, "edit"), timestamp)
+
+    if any(len(section["revs"]) > REVISION_MAX_PER_SECTION + REVISION_SNAPSHOT_INTERVAL
+           for section in index["sections"].values()):
+        compact(paper_name)
+
+
+def list_revisions(paper_name: str, section_key: str = None, limit: int = 100) -> list:
+    """按时间倒序列出修订的元数据（不含内容），可按章节过滤。"""
+    with _get_lock(paper_name):
+        _drain(paper_name)
+        index = _get_index(paper_name)
+        revisions = [
+            {"rev": entry["rev"], "section": key, "ts": entry["ts"], "action": entry["action"]}
+            for key, section in index["sections"].items()
+            if section_key is None or key == section_key
+            for entry in section["entries"]
+        ]
+    revisions.sort(key=lambda revision: revision["rev"], reverse=True)
+    return revisions[:limit]
+
+
+def get_section_content(paper_name: str, section_key: str, rev: int):
+    """返回章节在修订号 rev 时的内容（即不晚于 rev 的最后一次修订）；没有对应修订时返回 None。"""
+    with _get_lock(paper_name):
+        _drain(paper_name)
+        section = _get_index(paper_name)["sections"].get(section_key)
+        if section is None:
+            return None
+        position = bisect.bisect_right(section["revs"], rev) - 1
+        if position < 0:
+            return None
+        return _content_at(paper_name, section, position)
+
+
+def compact(paper_name: str, keep_per_section: int = None):
+    """
+    压缩修订日志：每个章节只保留最近 keep_per_section 条修订（默认 REVISION_MAX_PER_SECTION），
+    并以新的快照间隔重写整个日志（原子替换），修订号、时间和操作类型保持不变。
+    """
+    keep_per_section = keep_per_section or REVISION_MAX_PER_SECTION
+    with _get_lock(paper_name):
+        index = _get_index(paper_name)
+        kept = []
+        for section_key, section in index["sections"].items():
+            start = max(0, len(section["revs"]) - keep_per_section)
+            content = _content_at(paper_name, section, start)
+            offsets = [entry["offset"] for entry in section["entries"][start:]]
+            for i, entry in enumerate(_read_entries(paper_name, offsets)):
+                if i > 0:
+                    content = entry["content"] if entry["snapshot"] else _apply_ops(content, entry["ops"])
+                kept.append((entry["rev"], section_key, entry["ts"], entry["action"], content))
+        kept.sort()
+
+        new_index = {"size": 0, "next_rev": index["next_rev"], "sections": {}}
+        tmp_path = _log_path(paper_name).with_name(f".{paper_name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for rev, section_key, timestamp, action, content in kept:
+                    section = new_index["sections"].get(section_key)
+                    entry = _make_entry(section, rev, section_key, timestamp, action, content,
+                                        lambda: section["latest"])
+                    _write_entry(f, new_index, entry, content)
+            os.replace(tmp_path, _log_path(paper_name))
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        _indexes[paper_name] = new_index
+
+
+def rename_log(old_name: str, new_name: str):
+    """论文重命名时同步重命名其修订日志。"""
+    # 按固定顺序获取两把锁，避免同时进行的 A→B 和 B→A 重命名互相等待
+    first, second = sorted((old_name, new_name))
+    with _get_lock(first), _get_lock(second):
+        _drain(old_name)
+        old_path = _log_path(old_name)
+        if old_path.exists():
+            os.replace(old_path, _log_path(new_name))
+        _indexes.pop(old_name, None)
+        _indexes.pop(new_name, None)
+
+
+def delete_log(paper_name: str):
+    """论文删除时同时删除其修订日志。"""
+    with _get_lock(paper_name):
+        with _pending_lock:
+            _pending.pop(paper_name, None)
+        log_path = _log_path(paper_name)
+        if log_path.exists():
+            log_path.unlink()
+        _indexes.pop(paper_name, None)
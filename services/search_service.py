@@ -0,0 +1,347 @@
+# services/search_service.py
+"""
+全文检索服务。
+
+文献的 Markdown 转换结果、单篇分析和论文各章节保存在 result/search/ 下的 SQLite FTS5 索引中，
+搜索时按 BM25 排序并返回带高亮位置的摘要。
+
+FTS5 自带的分词器不会切分连续的中日韩文字，这里在写入索引前自行分词：
+中日韩文字按相邻两字切分为重叠的二元词（每段文字的最后一个字单独作为一个词），其余文字按单词切分。
+查询使用同样的切分方式并作为短语匹配，因此任意长度的中文片段都能按子串命中。
+
+索引增量更新：file_service 在保存时调用 schedule_update，由单个后台线程合并同一文档的多次更新后写入，
+只有内容发生变化的文档才会重写索引。start_background_sync 在启动时比对文件的修改时间，
+补录在服务之外新增、修改或删除的文件。
+"""
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (PAPER_STRUCTURE_MAP, SEARCH_INDEX_ENABLED, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT,
+                    SEARCH_SNIPPET_CHARS)
+from services import annotation_service, file_service
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DIR = file_service.RESULT_DIR / "search"
+SEARCH_DB_PATH = SEARCH_DIR / "index.sqlite3"
+
+# 文档类型 -> 所在目录（论文为 JSON 文件，按章节分别索引）
+KIND_MARKDOWN, KIND_ANALYSIS, KIND_PAPER = "markdown", "analysis", "paper"
+KINDS = (KIND_MARKDOWN, KIND_ANALYSIS, KIND_PAPER)
+
+# 标题与正文在 BM25 排序中的权重
+_TITLE_WEIGHT, _BODY_WEIGHT = 5.0, 1.0
+
+_CJK = "぀-ヿ㐀-䶿一-鿿豈-﫿가-힯"
+_TOKEN_PATTERN = re.compile(f"([{_CJK}]+)|([^\\W{_CJK}]+)")
+
+_conn = None
+_lock = threading.Lock()
+
+# 待写入索引的更新：(类型, 名称) -> 内容（None 表示从索引中移除），同一文档只保留最新的内容
+_pending = OrderedDict()
+_pending_lock = threading.Lock()
+_drain_scheduled = False
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+
+def _get_conn():
+    """延迟打开数据库连接（调用方需持有 _lock）。"""
+    global _conn
+    if _conn is None:
+        SEARCH_DIR.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(SEARCH_DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " id INTEGER PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " section TEXT NOT NULL,"
+            " title TEXT NOT NULL,"
+            " body TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " UNIQUE (kind, name, section))"
+        )
+        # 记录每个源文件索引时的修改时间，用于启动时找出需要补录的文件
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " kind TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " mtime_ns INTEGER,"
+            " PRIMARY KEY (kind, name))"
+        )
+        _conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(title, body)")
+        _conn.commit()
+    return _conn
+
+
+def _tokens(text: str, for_query: bool = False) -> list:
+    """
+    将文本切分为索引词。中日韩文字切分为重叠的二元词，并在每段末尾追加最后一个字，
+    使单字查询也能命中；查询时省略最后一段的末字，因为文档中该段可能还未结束。
+    """
+    tokens = []
+    last_run = None
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        last_run, word = match.groups()
+        if word is not None:
+            tokens.append(word)
+            continue
+        tokens.extend(last_run[i:i + 2] for i in range(len(last_run) - 1))
+        tokens.append(last_run[-1])
+    if for_query and last_run is not None and len(last_run) > 1:
+        tokens.pop()
+    return tokens
+
+
+def _index_text(text: str) -> str:
+    return " ".join(_tokens(text))
+
+
+def _match_expression(query: str):
+    """将用户输入转换为 FTS5 查询：每个空白分隔的词作为一个前缀短语，词之间为 AND。没有可检索的词时返回 None。"""
+    phrases = []
+    for term in query.split():
+        tokens = _tokens(term, for_query=True)
+        if tokens:
+            phrases.append('"' + " ".join(tokens) + '" *')
+    return " AND ".join(phrases) if phrases else None
+
+
+def _source_documents(kind: str, name: str, content) -> list:
+    """返回一个源文件对应的 (章节, 标题, 正文) 列表；论文按章节拆分，正文中的批注标记会被移除。"""
+    if kind != KIND_PAPER:
+        return [("", name, content)]
+    documents = []
+    for key, text in content.items():
+        if text and text.strip() and key in PAPER_STRUCTURE_MAP:
+            documents.append((key, f"{name} · {PAPER_STRUCTURE_MAP[key]['name']}", annotation_service.strip(text)))
+    return documents
+
+
+def _apply(kind: str, name: str, content, mtime_ns=None):
+    """将一个源文件的最新内容写入索引，只重写内容发生变化的文档；content 为 None 时移除该文件（调用方需持有 _lock）。"""
+    conn = _get_conn()
+    existing = {section: (doc_id, digest) for doc_id, section, digest in conn.execute(
+        "SELECT id, section, digest FROM documents WHERE kind = ? AND name = ?", (kind, name))}
+    documents = _source_documents(kind, name, content) if content is not None else []
+    for section, title, body in documents:
+        digest = hashlib.sha256(f"{title}\n{body}".encode("utf-8")).hexdigest()
+        doc_id, old_digest = existing.pop(section, (None, None))
+        if old_digest == digest:
+            continue
+        if doc_id is not None:
+            conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+            conn.execute("UPDATE documents SET title = ?, body = ?, digest = ? WHERE id = ?",
+                         (title, body, digest, doc_id))
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO documents (kind, name, section, title, body, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, name, section, title, body, digest)).lastrowid
+        conn.execute("INSERT INTO documents_fts (rowid, title, body) VALUES (?, ?, ?)",
+                     (doc_id, _index_text(title), _index_text(body)))
+    for doc_id, _ in existing.values():
+        conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+        conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+    if content is None:
+        conn.execute("DELETE FROM sources WHERE kind = ? AND name = ?", (kind, name))
+    else:
+        conn.execute("INSERT OR REPLACE INTO sources (kind, name, mtime_ns) VALUES (?, ?, ?)", (kind, name, mtime_ns))
+    conn.commit()
+
+
+def _drain():
+    """后台线程：依次写入所有待更新的文档。"""
+    global _drain_scheduled
+    while True:
+        with _pending_lock:
+            if not _pending:
+                _drain_scheduled = False
+                return
+            (kind, name), content = _pending.popitem(last=False)
+        try:
+            # 论文由文档缓存延迟写回，此时的文件可能还是旧内容，不记录修改时间，下次同步时重新读取并比对
+            mtime_ns = _source_mtime_ns(kind, name) if content is not None and kind != KIND_PAPER else None
+            with _lock:
+                _apply(kind, name, content, mtime_ns)
+        except Exception as e:
+            logger.warning("更新全文检索索引失败 (%s/%s): %s", kind, name, e)
+
+
+def schedule_update(kind: str, name: str, content):
+    """
+    在后台更新一个源文件的索引，短时间内对同一文件的多次更新只写入最后一次。
+
+    Args:
+        kind (str): 文档类型（markdown / analysis / paper）。
+        name (str): 文件名（不含扩展名）。
+        content: Markdown 和分析为文本，论文为 {章节key: 内容}；为 None 时从索引中移除。
+    """
+    global _drain_scheduled
+    if not SEARCH_INDEX_ENABLED:
+        return
+    with _pending_lock:
+        _pending[(kind, name)] = content
+        _pending.move_to_end((kind, name))
+        if not _drain_scheduled:
+            _drain_scheduled = True
+            _executor.submit(_drain)
+
+
+def _source_dir(kind: str):
+    return {KIND_MARKDOWN: file_service.MARKDOWNS_DIR, KIND_ANALYSIS: file_service.ANALYSES_DIR,
+            KIND_PAPER: file_service.PAPER_WRITING_DIR}[kind]
+
+
+def _source_path(kind: str, name: str):
+    return _source_dir(kind) / (f"{name}.json" if kind == KIND_PAPER else f"{name}.md")
+
+
+def _source_mtime_ns(kind: str, name: str):
+    try:
+        return _source_path(kind, name).stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_source(kind: str, name: str):
+    if kind == KIND_PAPER:
+        # 通过文档缓存读取，尚未写回磁盘的修改也会被索引
+        data = file_service.get_paper_content(name)
+        if data is None:
+            return None
+        return {key: (data.get(key) or {}).get('content', '') for key in PAPER_STRUCTURE_MAP}
+    return _source_path(kind, name).read_text(encoding="utf-8")
+
+
+def sync() -> dict:
+    """比对源文件的修改时间与索引记录，补录新增或修改的文件并移除已删除的文件。返回各类操作的数量。"""
+    stats = {"indexed": 0, "removed": 0}
+    for kind in KINDS:
+        source_dir = _source_dir(kind)
+        pattern = "*.json" if kind == KIND_PAPER else "*.md"
+        current = {path.stem: path.stat().st_mtime_ns for path in source_dir.glob(pattern)} \
+            if source_dir.exists() else {}
+        with _lock:
+            indexed = dict(_get_conn().execute("SELECT name, mtime_ns FROM sources WHERE kind = ?", (kind,)))
+        for name, mtime_ns in current.items():
+            if indexed.get(name) == mtime_ns:
+                continue
+            try:
+                content = _read_source(kind, name)
+            except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+                logger.warning("读取 %s/%s 失败，跳过索引: %s", kind, name, e)
+                continue
+            with _lock:
+                _apply(kind, name, content, mtime_ns)
+            stats["indexed"] += 1
+        for name in indexed.keys() - current.keys():
+            with _lock:
+                _apply(kind, name, None)
+            stats["removed"] += 1
+    return stats
+
+
+def _run_sync():
+    try:
+        stats = sync()
+        if stats["indexed"] or stats["removed"]:
+            logger.info("全文检索索引已同步：更新 %d 个文件，移除 %d 个文件。", stats["indexed"], stats["removed"])
+    except Exception as e:
+        logger.warning("同步全文检索索引失败: %s", e)
+
+
+def start_background_sync():
+    """在后台线程中同步索引（与增量更新共用同一线程，按提交顺序执行）。"""
+    if SEARCH_INDEX_ENABLED:
+        _executor.submit(_run_sync)
+
+
+def _make_snippet(body: str, terms: list) -> (str, list):
+    """截取正文中第一个命中词附近的片段，返回 (摘要, 摘要中命中位置的 [起点, 终点] 列表)。"""
+    lowered = body.lower()
+    positions = [pos for pos in (lowered.find(term) for term in terms) if pos >= 0]
+    first = min(positions) if positions else 0
+    start = max(0, first - SEARCH_SNIPPET_CHARS // 4)
+    end = min(len(body), start + SEARCH_SNIPPET_CHARS)
+    start = max(0, min(start, end - SEARCH_SNIPPET_CHARS))
+    prefix = "…" if start > 0 else ""
+    snippet = prefix + body[start:end].replace("\n", " ") + ("…" if end < len(body) else "")
+
+    highlights = []
+    window = lowered[start:end]
+    for term in terms:
+        pos = window.find(term)
+        while pos >= 0:
+            highlights.append([len(prefix) + pos, len(prefix) + pos + len(term)])
+            pos = window.find(term, pos + len(term))
+    highlights.sort()
+    merged = []
+    for span in highlights:
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return snippet, merged
+
+
+def search(query: str, kinds: list = None, limit: int = SEARCH_DEFAULT_LIMIT) -> list:
+    """
+    全文检索。
+
+    Args:
+        query (str): 搜索词，空白分隔的多个词须同时命中；每个词可以是任意长度的中文片段或单词前缀。
+        kinds (list, optional): 只搜索这些类型的文档，默认全部。
+        limit (int): 返回的结果数上限（不超过 SEARCH_MAX_LIMIT）。
+
+    Returns:
+        list: 按相关度排序的结果，每条为 {"kind", "name", "section", "title", "snippet", "highlights", "score"}，
+            score 越小越相关。
+
+    Raises:
+        ValueError: 搜索词中没有可检索的内容，或包含未知的文档类型。
+    """
+    expression = _match_expression(query)
+    if expression is None:
+        raise ValueError("搜索词不能为空")
+    unknown_kinds = [kind for kind in (kinds or []) if kind not in KINDS]
+    if unknown_kinds:
+        raise ValueError(f"未知的文档类型: {', '.join(unknown_kinds)}")
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+
+    sql = ("SELECT d.kind, d.name, d.section, d.title, d.body, bm25(documents_fts, ?, ?) AS score"
+           " FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid"
+           " WHERE documents_fts MATCH ?")
+    params = [_TITLE_WEIGHT, _BODY_WEIGHT, expression]
+    if kinds:
+        sql += f" AND d.kind IN ({', '.join('?' * len(kinds))})"
+        params += kinds
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+    with _lock:
+        rows = _get_conn().execute(sql, params).fetchall()
+
+    terms = [term.lower() for term in query.split()]
+    results = []
+    for kind, name, section, title, body, score in rows:
+        snippet, highlights = _make_snippet(body, terms)
+        results.append({"kind": kind, "name": name, "section": section, "title": title,
+                        "snippet": snippet, "highlights": highlights, "score": round(score, 4)})
+    return results
+
+
+def get_stats() -> dict:
+    """返回索引中的文档数量（按类型）以及尚未写入的更新数量。"""
+    with _lock:
+        counts = dict(_get_conn().execute("SELECT kind, COUNT(*) FROM documents GROUP BY kind"))
+    with _pending_lock:
+        pending = len(_pending)
+    return {"documents": {kind: counts.get(kind, 0) for kind in KINDS}, "pending": pending}
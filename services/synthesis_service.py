@@ -0,0 +1,151 @@
+# services/synthesis_service.py
+"""
+综合文献分析的分层（map-reduce）服务。
+
+当所选文献的分析报告总量超出模型上下文窗口，或单次调用过慢、过贵时：
+1. map: 将分析报告分批，并行生成每批的阶段性综合报告；
+2. reduce: 将阶段性报告逐级合并，直到数量不超过 COMPREHENSIVE_REDUCE_FAN_IN，
+   再由调用方基于它们生成最终综述。
+
+批次边界由文献名的哈希决定（内容定义分块），新增一篇文献只会改变它所在的批次；
+每一级合并的分组同样由各报告对应的首篇文献名的哈希决定，新增的批次只影响它所在的合并路径。
+每个批次和每次合并的结果都按输入内容哈希保存到 result/reports/partials/，
+未变化的批次和合并在下次运行时直接复用。
+"""
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import COMPREHENSIVE_MAP_BATCH_SIZE, COMPREHENSIVE_MAP_MAX_WORKERS, COMPREHENSIVE_REDUCE_FAN_IN
+from services import file_service, llm_service
+
+
+def _stable_hash(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def plan_batches(stems: list, batch_size: int = COMPREHENSIVE_MAP_BATCH_SIZE) -> list:
+    """
+    将文献按名称排序后切分为批次。
+
+    当某篇文献名称的哈希值能被 batch_size 整除时，在它之后切分，批次的平均大小约为 batch_size；
+    同时单个批次不超过 2 * batch_size 篇。由于切分点只取决于文献自身，
+    插入或删除一篇文献只会影响其所在的批次，其余批次保持不变，从而可以复用已缓存的阶段性报告。
+    """
+    batches, current = [], []
+    for stem in sorted(stems):
+        current.append(stem)
+        if _stable_hash(stem) % batch_size == 0 or len(current) >= 2 * batch_size:
+            batches.append(current)
+            current = []
+    if current:
+        batches.append(current)
+    return batches
+
+
+def plan_groups(keys: list, level: int, fan_in: int = COMPREHENSIVE_REDUCE_FAN_IN) -> list:
+    """
+    将一级阶段性报告切分为合并组，返回每组报告的下标列表。
+
+    keys 为各报告的标识（所含首篇文献名），与 plan_batches 相同，当某个标识（加上层级）的哈希值
+    能被 fan_in 整除时在它之后切分，单组不超过 2 * fan_in 份，因此新增或删除一个批次只会改变它所在的组。
+    每组都只有一份报告、无法减少报告数量时，退回按位置切分。
+    """
+    groups, current = [], []
+    for i, key in enumerate(keys):
+        current.append(i)
+        if _stable_hash(f"{level}:{key}") % fan_in == 0 or len(current) >= 2 * fan_in:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    if len(groups) == len(keys):
+        groups = [list(range(i, min(i + fan_in, len(keys)))) for i in range(0, len(keys), fan_in)]
+    return groups
+
+
+def _partial_path(prompt: str, model_name: str, temperature: float):
+    key = hashlib.sha256(json.dumps([model_name, temperature, prompt], ensure_ascii=False).encode("utf-8"))
+    return file_service.PARTIAL_REPORTS_DIR / f"{key.hexdigest()}.md"
+
+
+def _generate_partial(prompt: str, model_name: str, temperature: float, api_key: str, use_cache: bool) -> str:
+    """生成一份阶段性报告；相同输入的结果会被保存并在之后直接复用。"""
+    partial_path = _partial_path(prompt, model_name, temperature)
+    if use_cache and partial_path.exists():
+        return partial_path.read_text(encoding="utf-8")
+    content = llm_service.generate_text_from_prompt([prompt], model_name, temperature, api_key, use_cache=use_cache)
+    file_service.PARTIAL_REPORTS_DIR.mkdir(exist_ok=True)
+    partial_path.write_text(content, encoding="utf-8")
+    return content
+
+
+def _run_parallel(prompts: list, model_name: str, temperature: float, api_key: str, use_cache: bool,
+                  on_done=None) -> list:
+    """并行生成多份阶段性报告，结果顺序与输入一致。"""
+    def run(prompt):
+        content = _generate_partial(prompt, model_name, temperature, api_key, use_cache)
+        if on_done is not None:
+            on_done()
+        return content
+
+    with ThreadPoolExecutor(max_workers=COMPREHENSIVE_MAP_MAX_WORKERS) as executor:
+        return list(executor.map(run, prompts))
+
+
+def _join_partials(partials: list) -> str:
+    return "\n\n".join(f"--- 阶段性综合报告 {i} ---\n\n{content}" for i, content in enumerate(partials, 1))
+
+
+def synthesize_partials(stems: list, prompts, model_name: str, temperature: float, api_key: str,
+                        use_cache: bool = True, report_progress=None) -> list:
+    """
+    执行 map 阶段和中间的 reduce 阶段，返回不超过 COMPREHENSIVE_REDUCE_FAN_IN 份的阶段性综合报告。
+
+    Args:
+        stems (list): 参与综述的文献名（不含扩展名）。
+        prompts (PromptRegistry): 提示词注册表（见 prompt_service）。
+        report_progress (callable, optional): 接收 {"phase", "done", "total"} 进度字典的回调。
+    """
+    contents = dict(file_service.get_analysis_contents(stems))
+    batches = [[stem for stem in batch if stem in contents] for batch in plan_batches(list(contents))]
+
+    progress = {"phase": "map", "done": 0, "total": len(batches)}
+    progress_lock = threading.Lock()
+
+    def on_done():
+        # 在工作线程中调用；在锁内上报，保证上报的完成数单调递增
+        with progress_lock:
+            progress["done"] += 1
+            if report_progress is not None:
+                report_progress(dict(progress))
+
+    map_prompts = [
+        prompts.render('comprehensive_analysis_map',
+                       combined_text=file_service.format_analysis_documents([(stem, contents[stem]) for stem in batch]))
+        for batch in batches
+    ]
+    partials = _run_parallel(map_prompts, model_name, temperature, api_key, use_cache, on_done)
+    keys = [batch[0] for batch in batches]
+
+    level = 1
+    while len(partials) > COMPREHENSIVE_REDUCE_FAN_IN:
+        groups = plan_groups(keys, level)
+        # 只有一份报告的组直接进入下一级，不需要合并
+        merge_groups = [group for group in groups if len(group) > 1]
+        with progress_lock:
+            progress.update(phase=f"reduce-{level}", done=0, total=len(merge_groups))
+        merge_prompts = [prompts.render('comprehensive_analysis_merge',
+                                        partial_reports=_join_partials([partials[i] for i in group]))
+                         for group in merge_groups]
+        merged = iter(_run_parallel(merge_prompts, model_name, temperature, api_key, use_cache, on_done))
+        partials = [next(merged) if len(group) > 1 else partials[group[0]] for group in groups]
+        keys = [keys[group[0]] for group in groups]
+        level += 1
+    return partials
+
+
+def build_final_prompt(partials: list, prompts) -> str:
+    """基于阶段性综合报告构建生成最终综述的提示词。"""
+    return prompts.render('comprehensive_analysis_reduce', partial_reports=_join_partials(partials))
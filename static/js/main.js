@@ -111,6 +111,81 @@ function getApiKey() {
     return apiKey;
 }
 
+/**
+ * 以 POST 方式请求一个 Server-Sent Events 流式接口。
+ * 服务端会逐段推送 `token` 事件，生成结束时推送 `done` 事件，出错时推送 `error` 事件。
+ * @param {string} url - 流式接口地址。
+ * @param {object} body - 请求体（将被序列化为 JSON）。
+ * @param {Function} onToken - 每收到一个文本片段时调用，参数为截至目前的完整文本。
+ * @returns {Promise<object>} `done` 事件携带的数据。
+ */
+async function streamSSE(url, body, onToken) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    if (!response.ok) {
+        const err = await response.json();
+        throw new Error(err.message);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let fullText = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let eventType = 'message', data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) eventType = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            const payload = JSON.parse(data);
+            if (eventType === 'token') {
+                fullText += payload.text;
+                onToken(fullText);
+            } else if (eventType === 'done') {
+                return payload;
+            } else if (eventType === 'error') {
+                throw new Error(payload.message);
+            }
+        }
+    }
+    throw new Error('连接在生成完成前中断。');
+}
+
+/**
+ * 创建一个节流渲染函数，流式输出时避免每个片段都触发完整的 Markdown 和公式排版。
+ * @param {HTMLElement} targetElement - 渲染目标元素。
+ * @param {number} [interval=300] - 两次渲染之间的最小间隔（毫秒）。
+ * @returns {Function} 接收最新完整文本的渲染函数。
+ */
+function createThrottledRenderer(targetElement, interval = 300) {
+    let lastRender = 0;
+    let pendingTimer = null;
+    let latestText = '';
+    return (text) => {
+        latestText = text;
+        const now = Date.now();
+        if (now - lastRender >= interval) {
+            lastRender = now;
+            renderMarkdownWithMath(latestText, targetElement);
+        } else if (!pendingTimer) {
+            pendingTimer = setTimeout(() => {
+                pendingTimer = null;
+                lastRender = Date.now();
+                renderMarkdownWithMath(latestText, targetElement);
+            }, interval);
+        }
+    };
+}
+
 /**
  * 初始化首页逻辑，负责 API Key 的保存和加载。
  */
@@ -230,30 +305,80 @@ function initSingleAnalysisPage() {
             startBtn.textContent = '开始分析';
             return;
         }
-        for (const filename of papersToProcess) {
-            logMessage(`开始处理文件: ${filename}...`);
-            updateFileStatus(filename, 'processing', '正在处理...');
-            try {
-                const response = await fetch('/api/single_analysis/process_file', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ apiKey, filename, model, temperature_markdown: tempMarkdown, temperature_analysis: tempAnalysis })
-                });
-                const result = await response.json();
-                if (response.ok) {
-                    logMessage(`文件 ${filename} 处理成功。`, 'success');
-                    updateFileStatus(filename, 'processed', '已处理');
-                } else { throw new Error(result.message); }
-            } catch (error) {
-                logMessage(`文件 ${filename} 处理失败: ${error.message}`, 'error');
-                updateFileStatus(filename, 'failed', '处理失败');
-            }
+        papersToProcess.forEach(filename => updateFileStatus(filename, 'processing', '排队中...'));
+        try {
+            const response = await fetch('/api/single_analysis/batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ apiKey, filenames: papersToProcess, model, temperature_markdown: tempMarkdown, temperature_analysis: tempAnalysis })
+            });
+            const result = await response.json();
+            if (!response.ok) throw new Error(result.message);
+            logMessage(`已提交 ${papersToProcess.length} 个文件，服务端正在并发处理...`);
+            localStorage.setItem('currentBatchId', result.batch_id);
+            await pollBatch(result.batch_id);
+            localStorage.removeItem('currentBatchId');
+            logMessage('所有任务已完成。', 'info');
+        } catch (error) {
+            logMessage(`批量处理失败: ${error.message}`, 'error');
+            papersToProcess.forEach(filename => updateFileStatus(filename, 'failed', '处理失败'));
         }
-        logMessage('所有任务已完成。', 'info');
         startBtn.disabled = false;
         startBtn.textContent = '开始分析';
     });
-    fetchPapers();
+
+    /**
+     * 轮询批处理任务的进度，直到所有文件处理完毕。
+     * 仅在文件状态发生变化时更新UI并记录日志。
+     * @param {string} batchId - 服务端返回的批处理任务ID。
+     */
+    async function pollBatch(batchId) {
+        const lastStatus = {};
+        while (true) {
+            const response = await fetch(`/api/single_analysis/batch/${batchId}`);
+            const batch = await response.json();
+            if (!response.ok) throw new Error(batch.message);
+            batch.files.forEach(file => {
+                if (lastStatus[file.filename] === file.status) return;
+                lastStatus[file.filename] = file.status;
+                if (file.status === 'processing') {
+                    logMessage(`开始处理文件: ${file.filename}...`);
+                    updateFileStatus(file.filename, 'processing', '正在处理...');
+                } else if (file.status === 'processed') {
+                    logMessage(`文件 ${file.filename} 处理成功。`, 'success');
+                    updateFileStatus(file.filename, 'processed', '已处理');
+                } else if (file.status === 'failed') {
+                    logMessage(`文件 ${file.filename} 处理失败: ${file.message}`, 'error');
+                    updateFileStatus(file.filename, 'failed', '处理失败');
+                }
+            });
+            if (batch.done) return;
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
+    }
+
+    /**
+     * 页面刷新后，若上次提交的批处理任务仍在进行，则继续跟踪其进度。
+     * 批处理任务在服务端后台执行，刷新页面不会中断处理。
+     */
+    async function resumePendingBatch() {
+        const batchId = localStorage.getItem('currentBatchId');
+        if (!batchId) return;
+        startBtn.disabled = true;
+        startBtn.textContent = '正在处理...';
+        logMessage('检测到进行中的批处理任务，继续跟踪进度...');
+        try {
+            await pollBatch(batchId);
+            logMessage('所有任务已完成。', 'info');
+        } catch (error) {
+            logMessage(`无法获取批处理进度: ${error.message}`, 'error');
+        }
+        localStorage.removeItem('currentBatchId');
+        startBtn.disabled = false;
+        startBtn.textContent = '开始分析';
+    }
+
+    fetchPapers().then(resumePendingBatch);
 }
 
 /**
@@ -317,19 +442,12 @@ function initComprehensiveAnalysisPage() {
         const model = document.getElementById('model-select').value;
         const temperature = document.getElementById('temp-slider').value;
         try {
-            const response = await fetch('/api/comprehensive_analysis/start', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ apiKey, model, temperature, papers: selectedPapers })
-            });
-            const result = await response.json();
-            if (response.ok) {
-                renderMarkdownWithMath(result.report, reportOutput);
-            } else {
-                reportOutput.innerHTML = `<p style="color: var(--error-color);">生成失败: ${result.message}</p>`;
-            }
+            const result = await streamSSE('/api/comprehensive_analysis/stream',
+                { apiKey, model, temperature, papers: selectedPapers },
+                createThrottledRenderer(reportOutput));
+            renderMarkdownWithMath(result.report, reportOutput);
         } catch (error) {
-            reportOutput.innerHTML = `<p style="color: var(--error-color);">发生网络错误: ${error}</p>`;
+            reportOutput.innerHTML = `<p style="color: var(--error-color);">生成失败: ${error.message}</p>`;
         } finally {
             startBtn.disabled = false;
             startBtn.textContent = '生成/更新综述报告';
@@ -434,26 +552,17 @@ function initBrainstormingPage() {
         }
 
         try {
-            const response = await fetch('/api/brainstorming/start', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(requestBody)
-            });
-            const result = await response.json();
-            if (response.ok) {
-                history = history.slice(0, historyIndex + 1); // 产生新内容时，清除旧的"重做"历史
-                history.push(result.results);
-                historyIndex = history.length - 1;
-                updateUI(result.results);
-                modificationPrompt.value = '';
-            } else {
-                outputDiv.innerHTML = `<p style="color: var(--error-color);">操作失败: ${result.message}</p>`;
-                if (historyIndex > -1 && history[historyIndex]) {
-                    renderMarkdownWithMath(history[historyIndex], outputDiv);
-                }
-            }
+            const result = await streamSSE('/api/brainstorming/stream', requestBody, createThrottledRenderer(outputDiv));
+            history = history.slice(0, historyIndex + 1); // 产生新内容时，清除旧的"重做"历史
+            history.push(result.results);
+            historyIndex = history.length - 1;
+            updateUI(result.results);
+            modificationPrompt.value = '';
         } catch (error) {
-            outputDiv.innerHTML = `<p style="color: var(--error-color);">发生网络错误: ${error}</p>`;
+            outputDiv.innerHTML = `<p style="color: var(--error-color);">操作失败: ${error.message}</p>`;
+            if (historyIndex > -1 && history[historyIndex]) {
+                renderMarkdownWithMath(history[historyIndex], outputDiv);
+            }
         } finally {
             actionButton.disabled = false;
             actionButton.textContent = originalButtonText;
@@ -630,6 +739,12 @@ function initPaperWritingPage() {
     const deleteBtn = document.getElementById('delete-paper-btn');
     const exportPdfBtn = document.getElementById('export-pdf-btn');
     const exportMarkdownBtn = document.getElementById('export-markdown-btn');
+    const exportHtmlBtn = document.getElementById('export-html-btn');
+    const exportDocxBtn = document.getElementById('export-docx-btn');
+    const exportAllFormat = document.getElementById('export-all-format');
+    const exportAllBtn = document.getElementById('export-all-btn');
+    const generateDraftBtn = document.getElementById('generate-draft-btn');
+    const refreshStaleBtn = document.getElementById('refresh-stale-btn');
     const toggleFocusModeBtn = document.getElementById('toggle-focus-mode-btn');
     const wordCountDisplay = document.getElementById('word-count-display');
     const annotationModal = document.getElementById('annotation-modal');
@@ -642,6 +757,11 @@ function initPaperWritingPage() {
     let paperStructure = []; // 从后端加载的论文结构配置
     let paperStructureMap = {}; // 便于通过 key 快速查找结构配置
     let saveTimeout; // 用于自动保存的延迟计时器
+    let dirtySections = new Map(); // 自上次保存以来发生变化的章节key -> 产生修改的操作类型
+    let sectionBaseVersions = new Map(); // 章节key -> 编辑器中该章节内容所基于的服务器版本号，用于按章节检测冲突
+    let isSaving = false; // 是否有保存请求正在进行
+    let staleSections = new Set(); // 因依赖章节被修改而过期的章节key
+    let annotationCount = 0; // 服务端统计的已保存批注总数
     let editingSection = null; // 当前正在编辑的章节key
     let currentPaperId = null; // 当前加载的论文ID
     let isAIGenerating = false; // AI是否正在生成内容的标志，防止并发请求
@@ -696,7 +816,8 @@ function initPaperWritingPage() {
         });
 
         // 格式化数字（例如 1234 -> 1,234）并更新UI。
-        wordCountDisplay.textContent = `总字数: ${totalWords.toLocaleString('en-US')}`;
+        wordCountDisplay.textContent = `总字数: ${totalWords.toLocaleString('en-US')}`
+            + (annotationCount ? ` · 批注: ${annotationCount}` : '');
         wordCountDisplay.classList.add('visible');
     }
 
@@ -717,6 +838,10 @@ function initPaperWritingPage() {
                 sectionData.status = isLocked ? 'locked' : (sectionData.content.trim() === '' ? 'empty' : 'completed');
             }
             sectionEl.dataset.status = sectionData.status;
+            const isStale = staleSections.has(key) && sectionData.status !== 'generating';
+            sectionEl.classList.toggle('stale', isStale);
+            const staleBadge = sectionEl.querySelector('.stale-badge');
+            if (staleBadge) staleBadge.style.display = isStale ? 'inline-flex' : 'none';
 
             // 更新状态指示器
             const statusIndicator = sectionEl.querySelector('.status-indicator');
@@ -764,7 +889,10 @@ function initPaperWritingPage() {
             } else {
                 const isCompleted = sectionData.status === 'completed';
                 const isEmpty = sectionData.status === 'empty';
-                if (!isLocked) sectionEl.querySelector('.btn-edit').style.display = 'inline-block';
+                if (!isLocked) {
+                    sectionEl.querySelector('.btn-edit').style.display = 'inline-block';
+                    sectionEl.querySelector('.btn-history').style.display = 'inline-block';
+                }
                 if (isEmpty) sectionEl.querySelector('.btn-generate').style.display = 'inline-block';
                 if (isCompleted) {
                     ['.btn-modify', '.btn-ai-annotate', '.btn-modify-annotated', '.btn-expand', '.btn-polish'].forEach(selector => {
@@ -774,6 +902,10 @@ function initPaperWritingPage() {
                 }
             }
         });
+        if (refreshStaleBtn) {
+            refreshStaleBtn.disabled = isAIGenerating || staleSections.size === 0;
+            refreshStaleBtn.innerHTML = `<i class="ph ph-arrows-clockwise"></i> 刷新过期章节${staleSections.size ? ` (${staleSections.size})` : ''}`;
+        }
         updateToolbarPosition();
         updateTotalWordCount();
     }
@@ -787,7 +919,7 @@ function initPaperWritingPage() {
         paperStructure.forEach(sectionConfig => {
             const key = sectionConfig.key;
             const titleNumber = sectionConfig.numbered ? `<span class="section-number">${numberedSectionCounter++}.</span>` : '';
-            const titleHTML = `<h3 class="paper-section-title">${titleNumber}${sectionConfig.name}</h3>`;
+            const titleHTML = `<h3 class="paper-section-title">${titleNumber}${sectionConfig.name}<span class="stale-badge" style="display:none;" title="依赖的章节已被修改，此章节可能需要重新生成">需更新</span></h3>`;
             const sectionControlsHTML = `
                 <button class="btn btn-edit" data-section="${key}">编辑</button>
                 <button class="btn btn-save" data-section="${key}" style="display:none;">保存</button>
@@ -798,6 +930,7 @@ function initPaperWritingPage() {
                 <button class="btn btn-modify-annotated" data-section="${key}" style="display:none;">批注修改</button>
                 <button class="btn btn-expand" data-section="${key}" style="display:none;">扩写</button>
                 <button class="btn btn-polish" data-section="${key}" style="display:none;">润色</button>
+                <button class="btn btn-history" data-section="${key}" style="display:none;">历史</button>
             `;
             const sectionHTML = `<div class="paper-section" data-key="${key}" id="section-${key}">
                 <div class="section-header">
@@ -845,7 +978,7 @@ function initPaperWritingPage() {
 
                     textarea.value = textarea.value.substring(0, start) + newText + textarea.value.substring(end);
                     paperState[editingSection].content = textarea.value;
-                    scheduleSave();
+                    scheduleSave(editingSection);
 
                     adjustTextareaHeight(textarea);
                     textarea.scrollTop = scrollTop;
@@ -888,23 +1021,196 @@ function initPaperWritingPage() {
     /**
      * 安排一个延迟的保存操作。
      * 在用户停止输入1秒后自动向后端保存数据，避免频繁请求。
+     * 只提交发生变化的章节，并附带各章节所基于的版本号，用于按章节检测冲突。
+     * @param {string} sectionKey - 发生变化的章节key。
+     * @param {string} [action='edit'] - 产生修改的操作类型，记录在修订历史中。
      */
-    async function scheduleSave() {
+    function scheduleSave(sectionKey, action = 'edit') {
         if (!currentPaperId) return;
+        // AI 操作的类型优先于随后的手动编辑，便于在历史中找到对应版本
+        if (!dirtySections.has(sectionKey) || action !== 'edit') dirtySections.set(sectionKey, action);
         clearTimeout(saveTimeout);
-        saveTimeout = setTimeout(async () => {
-            try {
-                const response = await fetch(`/api/paper/save/${currentPaperId}`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(paperState),
+        saveTimeout = setTimeout(flushSave, 1000);
+    }
+
+    /** 将所有变化的章节通过 PATCH 请求增量保存到后端。 */
+    async function flushSave() {
+        if (!currentPaperId || dirtySections.size === 0) return;
+        // 上一次保存尚未完成时稍后重试，保证版本号按顺序递增
+        if (isSaving) { saveTimeout = setTimeout(flushSave, 300); return; }
+
+        const paperId = currentPaperId;
+        const pending = new Map(dirtySections);
+        dirtySections.clear();
+        const sections = {};
+        pending.forEach((action, key) => {
+            sections[key] = {
+                content: paperState[key].content, status: paperState[key].status, action,
+                base_version: sectionBaseVersions.get(key) ?? (paperState.version || 0),
+            };
+            if (paperState[key].generation) sections[key].generation = paperState[key].generation;
+        });
+
+        isSaving = true;
+        try {
+            const response = await fetch(`/api/paper/content/${paperId}`, {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ version: paperState.version || 0, sections }),
+            });
+            const result = await response.json();
+            if (paperId !== currentPaperId) return;
+            if (response.ok) {
+                paperState.version = result.version;
+                pending.forEach((action, key) => sectionBaseVersions.set(key, result.version));
+                refreshStaleState();
+            } else if (response.status === 409) {
+                // 只丢弃冲突章节中的修改，其余章节稍后重新提交
+                const conflicts = result.sections || [...pending.keys()];
+                alert(`${result.message}\n这些章节中未保存的修改将被丢弃，其他章节的修改会继续保存。`);
+                pending.forEach((action, key) => {
+                    if (!conflicts.includes(key) && !dirtySections.has(key)) dirtySections.set(key, action);
                 });
-                 if (!response.ok) {
-                    const err = await response.json();
-                    console.error('自动保存失败:', err.message);
+                await reloadSections(paperId, conflicts);
+                renderPaperState();
+                if (dirtySections.size) saveTimeout = setTimeout(flushSave, 0);
+            } else {
+                pending.forEach((action, key) => { if (!dirtySections.has(key)) dirtySections.set(key, action); });
+                console.error('自动保存失败:', result.message);
+            }
+        } catch (error) {
+            if (paperId === currentPaperId) pending.forEach((action, key) => { if (!dirtySections.has(key)) dirtySections.set(key, action); });
+            console.error('自动保存网络错误:', error);
+        } finally {
+            isSaving = false;
+        }
+    }
+
+    /**
+     * 从后端重新获取指定章节的内容，替换编辑器中的版本（这些章节中未保存的修改会被丢弃）。
+     * @param {string} paperId - 论文ID。
+     * @param {string[]} keys - 需要重新获取的章节key。
+     */
+    async function reloadSections(paperId, keys) {
+        const response = await fetch(`/api/paper/content/${paperId}`);
+        if (!response.ok) throw new Error('未能加载论文内容');
+        const latest = await response.json();
+        if (paperId !== currentPaperId) return;
+        keys.forEach(key => {
+            paperState[key] = latest[key] || { content: '', status: 'empty' };
+            sectionBaseVersions.set(key, latest.version);
+            dirtySections.delete(key);
+        });
+        paperState.version = latest.version;
+    }
+
+    /** 从后端获取过期章节列表，并更新章节标记和“刷新过期章节”按钮。 */
+    async function refreshStaleState() {
+        if (!currentPaperId) return;
+        try {
+            const response = await fetch(`/api/paper/stale/${currentPaperId}`);
+            if (!response.ok) return;
+            const result = await response.json();
+            staleSections = new Set(result.stale);
+            renderPaperState();
+        } catch (error) { console.error('获取过期章节失败:', error); }
+        refreshAnnotationCount();
+    }
+
+    /** 从后端获取已保存内容中的批注数量，显示在字数统计旁。 */
+    async function refreshAnnotationCount() {
+        if (!currentPaperId) return;
+        try {
+            const response = await fetch(`/api/paper/annotations/${currentPaperId}`);
+            if (!response.ok) return;
+            annotationCount = (await response.json()).total;
+            updateTotalWordCount();
+        } catch (error) { console.error('获取批注统计失败:', error); }
+    }
+
+    /** 立即保存所有尚未提交的修改（等待进行中的保存完成）。 */
+    async function saveNow() {
+        clearTimeout(saveTimeout);
+        while (isSaving) await new Promise(resolve => setTimeout(resolve, 100));
+        await flushSave();
+    }
+
+    // 修订历史中操作类型的显示名称
+    const REVISION_ACTION_NAMES = {
+        initial: '初始内容', edit: '手动编辑', save: '保存', restore: '恢复历史版本',
+        generate: 'AI生成', modify: 'AI修改', expand: '扩写', polish: '润色',
+        ai_annotate: 'AI批注', modify_annotated: '批注修改',
+    };
+
+    /**
+     * 在按钮下方弹出章节的修订历史列表，点击某条修订后对比差异并确认恢复。
+     * @param {string} sectionKey - 章节key。
+     * @param {HTMLElement} anchor - 弹出框定位的参照元素。
+     */
+    async function showRevisionHistory(sectionKey, anchor) {
+        document.querySelectorAll('.annotation-popover').forEach(el => el.remove());
+        try {
+            const response = await fetch(`/api/paper/revisions/${currentPaperId}?section=${encodeURIComponent(sectionKey)}&limit=50`);
+            const revisions = await response.json();
+
+            const popover = document.createElement('div');
+            popover.className = 'annotation-popover revision-popover';
+            popover.innerHTML = revisions.length
+                ? `<ul class="revision-list">${revisions.map(r => `<li data-rev="${r.rev}"><span>${REVISION_ACTION_NAMES[r.action] || r.action}</span><time>${r.ts.replace('T', ' ')}</time></li>`).join('')}</ul>`
+                : '<div class="annotation-popover-content">暂无修订历史。</div>';
+            document.body.appendChild(popover);
+            const rect = anchor.getBoundingClientRect();
+            popover.style.left = `${rect.left + window.scrollX}px`;
+            popover.style.top = `${rect.bottom + window.scrollY + 8}px`;
+            requestAnimationFrame(() => { popover.classList.add('visible'); });
+
+            popover.addEventListener('click', async (event) => {
+                const item = event.target.closest('li[data-rev]');
+                if (!item) return;
+                popover.remove();
+                const rev = item.dataset.rev;
+                const revResponse = await fetch(`/api/paper/revisions/${currentPaperId}/${sectionKey}/${rev}`);
+                const revision = await revResponse.json();
+                if (!revResponse.ok) { alert(revision.message); return; }
+                showDiffModal(paperState[sectionKey].content, revision.content, () => restoreRevision(sectionKey, rev), () => {});
+            });
+            const closePopover = (event) => {
+                if (!popover.contains(event.target)) {
+                    popover.remove();
+                    document.removeEventListener('click', closePopover);
                 }
-            } catch (error) { console.error('自动保存网络错误:', error); }
-        }, 1000);
+            };
+            setTimeout(() => document.addEventListener('click', closePopover), 0);
+        } catch (error) {
+            console.error('加载修订历史失败:', error);
+        }
+    }
+
+    /** 将章节恢复为指定修订的内容。恢复前先保存尚未提交的修改，保证该章节的版本号是最新的。 */
+    async function restoreRevision(sectionKey, rev) {
+        await saveNow();
+        try {
+            const response = await fetch(`/api/paper/revisions/${currentPaperId}/${sectionKey}/${rev}/restore`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ version: sectionBaseVersions.get(sectionKey) ?? (paperState.version || 0) }),
+            });
+            const result = await response.json();
+            if (!response.ok) {
+                alert(`恢复失败: ${result.message}`);
+                if (response.status === 409) {
+                    await reloadSections(currentPaperId, [sectionKey]);
+                    renderPaperState();
+                }
+                return;
+            }
+            paperState[sectionKey].content = result.content;
+            paperState.version = result.version;
+            sectionBaseVersions.set(sectionKey, result.version);
+            renderPaperState();
+        } catch (error) {
+            console.error('恢复历史版本失败:', error);
+        }
     }
 
     /**
@@ -930,6 +1236,9 @@ function initPaperWritingPage() {
             }
             paperState = await response.json();
             currentPaperId = paperId;
+            dirtySections.clear();
+            sectionBaseVersions = new Map(paperStructure.map(section => [section.key, paperState.version || 0]));
+            clearTimeout(saveTimeout);
             localStorage.setItem('currentPaperId', paperId);
 
             // 数据清洗：确保所有章节都存在，并重置可能残留的 'generating' 状态
@@ -943,7 +1252,10 @@ function initPaperWritingPage() {
             });
 
             renameInput.value = paperState.documentName || '';
+            staleSections = new Set();
+            annotationCount = 0;
             renderPaperState();
+            refreshStaleState();
         } catch (error) {
             console.error('加载论文数据失败:', error);
             alert(`加载论文数据失败: ${error.message}`);
@@ -1044,8 +1356,19 @@ function initPaperWritingPage() {
     renameBtn.addEventListener('click', async () => { const newName = renameInput.value.trim(); if (!newName || !currentPaperId || newName === currentPaperId) return; try { const response = await fetch(`/api/papers/rename/${currentPaperId}`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ newName }) }); const result = await response.json(); if (result.status === 'success') { localStorage.setItem('currentPaperId', newName); await loadPaperList(); } else { alert(`重命名失败: ${result.message}`); renameInput.value = currentPaperId; } } catch (error) { console.error('重命名失败:', error); } });
     deleteBtn.addEventListener('click', async () => { if (!currentPaperId) return; if (confirm(`确定要删除文章 "${paperState.documentName}" 吗？此操作无法撤销。`)) { try { await fetch(`/api/papers/delete/${currentPaperId}`, { method: 'DELETE' }); localStorage.removeItem('currentPaperId'); await loadPaperList(); } catch (error) { console.error('删除失败:', error); } } });
     exportPdfBtn.addEventListener('click', () => { if (!currentPaperId) { alert("请先选择一篇要导出的文章。"); return; } const originalTitle = document.title; const paperTitle = paperState.title?.content.trim() || paperState.documentName || '未命名论文'; const safeFileName = paperTitle.replace(/[\/\\?%*:|"<>]/g, '-').replace(/\s+/g, ' ').trim(); document.title = safeFileName; window.print(); setTimeout(() => { document.title = originalTitle; }, 1000); });
-    exportMarkdownBtn.addEventListener('click', () => { if (!currentPaperId) { alert("请先选择一篇要导出的文章。"); return; } window.location.href = `/api/paper/export/markdown/${currentPaperId}`; });
+    /** 先保存未提交的修改，再下载服务端导出的文件。 */
+    async function exportPaper(format) {
+        if (!currentPaperId) { alert("请先选择一篇要导出的文章。"); return; }
+        await saveNow();
+        window.location.href = `/api/paper/export/${format}/${encodeURIComponent(currentPaperId)}`;
+    }
+    exportMarkdownBtn.addEventListener('click', () => exportPaper('markdown'));
+    exportHtmlBtn.addEventListener('click', () => exportPaper('html'));
+    exportDocxBtn.addEventListener('click', () => exportPaper('docx'));
+    exportAllBtn.addEventListener('click', async () => { await saveNow(); window.location.href = `/api/papers/export/${exportAllFormat.value}`; });
     toggleFocusModeBtn.addEventListener('click', toggleFocusMode);
+    generateDraftBtn.addEventListener('click', () => generateDraft('paper_draft'));
+    refreshStaleBtn.addEventListener('click', () => generateDraft('paper_refresh_stale'));
 
     /**
      * 中心化的交互事件处理器。
@@ -1084,7 +1407,7 @@ function initPaperWritingPage() {
                         const newRawToken = rawToken.replace(/【修改意见：([\s\S]+?)】/, `【修改意见：${newComment.trim()}】`);
                         paperState[sectionKey].content = paperState[sectionKey].content.replace(rawToken, newRawToken);
                         renderPaperState();
-                        scheduleSave();
+                        scheduleSave(sectionKey);
                     }
                 });
                 popover.remove();
@@ -1095,7 +1418,7 @@ function initPaperWritingPage() {
                 const textInside = rawToken.match(/^{{([\s\S]+?)}}/)[1];
                 paperState[sectionKey].content = paperState[sectionKey].content.replace(rawToken, textInside);
                 renderPaperState();
-                scheduleSave();
+                scheduleSave(sectionKey);
                 popover.remove();
             });
 
@@ -1116,8 +1439,9 @@ function initPaperWritingPage() {
             const sectionConfig = paperStructureMap[sectionKey];
 
             if (button.matches('.btn-edit')) { editingSection = sectionKey; renderPaperState(); const textarea = document.getElementById(`textarea-${sectionKey}`); if (textarea) textarea.focus({ preventScroll: true }); return; }
-            if (button.matches('.btn-save')) { const textarea = document.getElementById(`textarea-${sectionKey}`); if (textarea) { paperState[sectionKey].content = textarea.value; scheduleSave(); } editingSection = null; renderPaperState(); return; }
+            if (button.matches('.btn-save')) { const textarea = document.getElementById(`textarea-${sectionKey}`); if (textarea) { paperState[sectionKey].content = textarea.value; scheduleSave(sectionKey); } editingSection = null; renderPaperState(); return; }
             if (button.matches('.btn-cancel')) { editingSection = null; renderPaperState(); return; }
+            if (button.matches('.btn-history')) { e.stopPropagation(); showRevisionHistory(sectionKey, button); return; }
 
             // 触发AI操作
             if (button.matches('.btn-generate')) performSectionAction(sectionKey, 'generate');
@@ -1139,7 +1463,7 @@ function initPaperWritingPage() {
             const sectionKey = target.dataset.section;
             paperState[sectionKey].content = target.value;
             adjustTextareaHeight(target);
-            scheduleSave();
+            scheduleSave(sectionKey);
             updateTotalWordCount();
         }
     }
@@ -1147,6 +1471,79 @@ function initPaperWritingPage() {
     document.body.addEventListener('click', handleInteraction);
     document.body.addEventListener('input', handleInteraction);
 
+    /**
+     * 提交草稿生成任务：服务端按章节依赖关系并行生成所有尚无内容的章节（paper_draft），
+     * 或只重新生成过期的章节（paper_refresh_stale）。每完成一个章节就写入文章，
+     * 前端通过任务事件流实时显示进度和已生成的内容。
+     * @param {string} jobType - 'paper_draft' 或 'paper_refresh_stale'。
+     */
+    async function generateDraft(jobType) {
+        if (isAIGenerating) { alert('已有AI任务在执行中，请等待其完成后再试。'); return; }
+        if (!currentPaperId) { alert("请先选择或创建一篇文章。"); return; }
+        const apiKey = getApiKey(); if (!apiKey) return;
+        const confirmMessage = jobType === 'paper_draft'
+            ? '将按章节依赖关系自动生成所有尚无内容的章节，生成结果会直接写入文章。是否继续？'
+            : `将重新生成以下过期章节，现有内容会被覆盖（可在“历史”中恢复）：${[...staleSections].map(key => paperStructureMap[key]?.name || key).join('、')}。是否继续？`;
+        if (!confirm(confirmMessage)) return;
+
+        isAIGenerating = true;
+        generateDraftBtn.disabled = true;
+        await saveNow();
+        const paperId = currentPaperId;
+        const appliedSections = new Set();
+
+        // 将已生成的章节内容同步到编辑器，并把正在生成的章节标记为生成中
+        const applyProgress = async (progress) => {
+            if (paperId !== currentPaperId) return;
+            const newSections = (progress.generated || []).filter(key => !appliedSections.has(key));
+            if (newSections.length) {
+                await reloadSections(paperId, newSections);
+                newSections.forEach(key => appliedSections.add(key));
+            }
+            paperStructure.forEach(section => {
+                if ((progress.running || []).includes(section.key)) paperState[section.key].status = 'generating';
+                else if (paperState[section.key].status === 'generating') paperState[section.key].status = 'empty';
+            });
+            renderPaperState();
+        };
+
+        try {
+            const response = await fetch('/api/jobs', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ type: jobType, apiKey, paper_name: paperId, model: modelSelect.value, temperature: parseFloat(tempSlider.value), language: languageSelect.value }),
+            });
+            const submitted = await response.json();
+            if (!response.ok) throw new Error(submitted.message);
+
+            const job = await new Promise((resolve, reject) => {
+                const source = new EventSource(`/api/jobs/${submitted.job_id}/events`);
+                source.addEventListener('job', async (event) => {
+                    const update = JSON.parse(event.data);
+                    if (['succeeded', 'failed', 'interrupted'].includes(update.status)) {
+                        source.close();
+                        resolve(update);
+                    } else if (update.progress) {
+                        await applyProgress(update.progress);
+                    }
+                });
+                source.onerror = () => { source.close(); reject(new Error('与服务器的连接中断，任务仍在后台运行。')); };
+            });
+            await applyProgress({ generated: job.result ? job.result.generated : [], running: [] });
+            if (job.status !== 'succeeded') throw new Error(job.error || '任务未完成');
+            const failed = Object.keys(job.result.failed || {});
+            if (failed.length) alert(`以下章节生成失败: ${failed.map(key => paperStructureMap[key]?.name || key).join('、')}`);
+        } catch (error) {
+            console.error('生成草稿失败:', error);
+            alert(`生成草稿失败: ${error.message}`);
+        } finally {
+            isAIGenerating = false;
+            generateDraftBtn.disabled = false;
+            renderPaperState();
+            refreshStaleState();
+        }
+    }
+
     /**
      * 调用后端API执行AI操作（生成、修改、扩写等）。
      * @param {string} sectionKey - 目标章节的key。
@@ -1159,6 +1556,8 @@ function initPaperWritingPage() {
         const apiKey = getApiKey(); if (!apiKey) return;
 
         isAIGenerating = true;
+        // 先保存尚未提交的修改，服务端按论文名称读取依赖章节的最新内容
+        await saveNow();
         const originalStatus = paperState[sectionKey].status;
         const originalContent = paperState[sectionKey].content;
         paperState[sectionKey].status = 'generating';
@@ -1168,32 +1567,29 @@ function initPaperWritingPage() {
         globalPromptInput.value = '';
 
         try {
-            const response = await fetch('/api/paper/generate', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ apiKey, model: modelSelect.value, temperature: parseFloat(tempSlider.value), language: languageSelect.value, target_section: sectionKey, paper_data: paperState, action_type: actionType, user_prompt: userPrompt }),
-            });
-            const result = await response.json();
-            if (response.ok) {
-                // 操作成功后，显示差异对比模态框
-                showDiffModal(
-                    originalContent, result.content,
-                    () => { // onAccept: 用户接受更改
-                        paperState[sectionKey].content = result.content;
-                        paperState[sectionKey].status = originalStatus;
-                        isAIGenerating = false;
-                        renderPaperState();
-                        scheduleSave();
-                    },
-                    () => { // onReject: 用户放弃更改
-                        paperState[sectionKey].status = originalStatus;
-                        isAIGenerating = false;
-                        renderPaperState();
-                    }
-                );
-            } else {
-                throw new Error(result.message);
-            }
+            // 流式生成期间，将已生成的内容实时显示在该章节中
+            const displayDiv = document.querySelector(`.paper-section[data-key="${sectionKey}"] .content-display`);
+            const renderPartial = displayDiv ? createThrottledRenderer(displayDiv) : () => {};
+            const result = await streamSSE('/api/paper/generate/stream',
+                { apiKey, model: modelSelect.value, temperature: parseFloat(tempSlider.value), language: languageSelect.value, target_section: sectionKey, paper_name: currentPaperId, action_type: actionType, user_prompt: userPrompt },
+                renderPartial);
+            // 操作成功后，显示差异对比模态框
+            showDiffModal(
+                originalContent, result.content,
+                () => { // onAccept: 用户接受更改
+                    paperState[sectionKey].content = result.content;
+                    paperState[sectionKey].generation = result.generation;
+                    paperState[sectionKey].status = originalStatus;
+                    isAIGenerating = false;
+                    renderPaperState();
+                    scheduleSave(sectionKey, actionType);
+                },
+                () => { // onReject: 用户放弃更改
+                    paperState[sectionKey].status = originalStatus;
+                    isAIGenerating = false;
+                    renderPaperState();
+                }
+            );
         } catch (error) {
             alert(`操作失败: ${error.message}`);
             paperState[sectionKey].status = originalStatus;
@@ -0,0 +1,54 @@
+# tests/test_governor_service.py
+"""调用治理（限流、重试、熔断）的测试。"""
+import os
+import sys
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import governor_service  # noqa: E402
+
+
+@pytest.fixture
+def fast_breaker(monkeypatch):
+    """一次失败即熔断、冷却时间很短且不重试的治理配置。"""
+    monkeypatch.setattr(governor_service, "GOVERNOR_BREAKER_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(governor_service, "GOVERNOR_BREAKER_COOLDOWN_SECONDS", 0.05)
+    monkeypatch.setattr(governor_service, "GOVERNOR_MAX_RETRIES", 0)
+    monkeypatch.setattr(governor_service, "_buckets", {})
+    monkeypatch.setattr(governor_service, "_breakers", {})
+
+
+def _raise(error):
+    def func():
+        raise error
+    return func
+
+
+def test_probe_with_non_retryable_error_closes_breaker(fast_breaker):
+    with pytest.raises(httpx.ConnectError):
+        governor_service.call("key", "model", _raise(httpx.ConnectError("down")))
+    with pytest.raises(governor_service.CircuitOpenError):
+        governor_service.call("key", "model", lambda: "ok")
+
+    time.sleep(0.06)
+    # 试探调用因请求本身的错误失败，不代表服务不可用
+    with pytest.raises(ValueError):
+        governor_service.call("key", "model", _raise(ValueError("bad request")))
+    assert governor_service.call("key", "model", lambda: "ok") == "ok"
+
+
+def test_unfinished_probe_is_retried_after_cooldown(fast_breaker):
+    with pytest.raises(httpx.ConnectError):
+        governor_service.call("key", "model", _raise(httpx.ConnectError("down")))
+    time.sleep(0.06)
+    _, breaker = governor_service._get_governors("key", "model")
+    assert breaker.allow()  # 放行的试探调用没有记录结果
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert governor_service.call("key", "model", lambda: "ok") == "ok"
+    assert breaker.state == "closed"